@@ -0,0 +1,71 @@
+import random
+import re
+from spendlog.aliasMatcher import AliasMatcher, wildcardToRegex
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.loggingProvider import LoggingProvider
+from benchmarks.benchmarkLedger import timeCall
+logging = LoggingProvider().logging
+
+N_MERCHANTS = 1000
+N_ALIASES = 20000
+CITIES = ["STOCKHOLM", "GOTEBORG", "MALMO", "UPPSALA", "VASTERAS"]
+
+# One prefix, one wildcard and one regex rule per merchant, as (kind, rule, merchant)
+def generateRules():
+    rules = list()
+    for merchant in range(N_MERCHANTS):
+        rules.append(("prefix", f"MERCHANT {merchant} ", merchant))
+        rules.append(("wildcard", f"CARD*{merchant} ?????", merchant))
+        rules.append(("regex", f"SHOP {merchant} [0-9]+ [A-Z]+", merchant))
+    return rules
+
+# Card transaction aliases, one of every four matching no rule
+def generateAliases(seed = 0):
+    rng = random.Random(seed)
+    aliases = list()
+    for _ in range(N_ALIASES):
+        merchant = rng.randrange(N_MERCHANTS)
+        city = rng.choice(CITIES)
+        aliases.append(rng.choice([f"MERCHANT {merchant} {rng.randrange(10000)} {city}",
+                                   f"CARD {rng.randrange(100)} {merchant} {city[:5]}",
+                                   f"SHOP {merchant} {rng.randrange(10000)} {city}",
+                                   f"UNKNOWN {merchant} {rng.randrange(10000)} {city}"]))
+    return aliases
+
+def printThroughput(name, seconds, baselineSeconds = None):
+    line = f"  {name:<50} {N_ALIASES / seconds:12.0f} lookups/s"
+    if baselineSeconds is not None:
+        line += f"  ({baselineSeconds / seconds:.1f}x)"
+    print(line)
+
+def main():
+    rules = generateRules()
+    aliases = generateAliases()
+    print(f"Resolving {N_ALIASES} aliases against {len(rules)} rules")
+
+    # every rule tried in turn, the first match winning
+    compiledRules = [(re.compile(re.escape(rule) + ".*" if kind == "prefix" else wildcardToRegex(rule) if kind == "wildcard" else rule), merchant)
+                     for kind, rule, merchant in rules]
+    def scanRules():
+        for alias in aliases:
+            next((merchant for regex, merchant in compiledRules if regex.fullmatch(alias)), None)
+    baselineSeconds = timeCall(scanRules, repeat = 1)
+    printThroughput("linear scan over the rules", baselineSeconds)
+
+    matcher = AliasMatcher()
+    for kind, rule, merchant in rules:
+        getattr(matcher, {"prefix" : "addPrefix", "wildcard" : "addWildcard", "regex" : "addRegex"}[kind])(rule, merchant)
+    printThroughput("AliasMatcher.match", timeCall(lambda : [matcher.match(alias) for alias in aliases]), baselineSeconds)
+
+    CounterPartyDataBase().reset()
+    for merchant in range(N_MERCHANTS):
+        CounterPartyDataBase().addCounterParty([f"merchant {merchant}"],
+                                               prefixes = [f"MERCHANT {merchant} "],
+                                               wildcards = [f"CARD*{merchant} ?????"],
+                                               regexes = [f"SHOP {merchant} [0-9]+ [A-Z]+"])
+    logging.getLogger().handlers = [logging.NullHandler()]
+    printThroughput("CounterPartyDataBase.getCounterParty (first)", timeCall(lambda : [CounterPartyDataBase().getCounterParty(alias) for alias in aliases], repeat = 1), baselineSeconds)
+    printThroughput("CounterPartyDataBase.getCounterParty (memoized)", timeCall(lambda : [CounterPartyDataBase().getCounterParty(alias) for alias in aliases]), baselineSeconds)
+
+if __name__ == '__main__':
+    main()
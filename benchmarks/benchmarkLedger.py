@@ -0,0 +1,39 @@
+import datetime
+import random
+import timeit
+from spendlog.ledger import Ledger
+from spendlog.counterParty import CounterPartyDataBase
+
+# Helpers shared by the benchmarks. Run a benchmark from the repository root, e.g.:
+#
+#       python -m benchmarks.queryPlanner
+
+CATEGORIES = [f"category {i}" for i in range(20)]
+TAGS = [f"tag {i}" for i in range(10)]
+ALIASES = [f"alias {i}" for i in range(200)]
+FIRST_DATE = datetime.datetime(2015, 1, 1)
+N_DAYS = 3650
+
+def populateLedger(nTransactions, seed = 0):
+    Ledger().reset()
+    CounterPartyDataBase().reset()
+    rng = random.Random(seed)
+    for alias in ALIASES:
+        CounterPartyDataBase().addCounterParty([alias],
+                                               tags = set(rng.sample(TAGS, rng.randint(0, 2))),
+                                               category = rng.choice(CATEGORIES))
+    for fingerPrint in range(nTransactions):
+        Ledger().addTransaction(liquidityChange = rng.randint(-5000, 5000),
+                                capitalChange = rng.choice([0, 0, 0, rng.randint(-100, 100)]),
+                                counterPartyAlias = rng.choice(ALIASES),
+                                date = FIRST_DATE + datetime.timedelta(days = rng.randrange(N_DAYS)),
+                                fingerPrint = fingerPrint)
+
+def timeCall(function, repeat = 5, number = 1):
+    return min(timeit.repeat(function, repeat = repeat, number = number)) / number
+
+def printTiming(name, seconds, baselineSeconds = None):
+    line = f"  {name:<50} {seconds * 1000:10.3f} ms"
+    if baselineSeconds is not None:
+        line += f"  ({baselineSeconds / seconds:.1f}x)"
+    print(line)
@@ -0,0 +1,30 @@
+import datetime
+from spendlog.ledger import Ledger, TimeRange, CATEGORY
+from benchmarks.benchmarkLedger import populateLedger, timeCall, printTiming, FIRST_DATE
+
+N_TRANSACTIONS = 200000
+
+def main():
+    populateLedger(N_TRANSACTIONS)
+    # timed calls would otherwise just be returned from the query cache
+    Ledger.setQueryCacheSize(0)
+    oneYear = TimeRange(FIRST_DATE + datetime.timedelta(days = 1000), FIRST_DATE + datetime.timedelta(days = 1365))
+    # none of these can be answered from the daily rollup, so they measure the scans
+    queries = {
+        "without tag"                      : lambda : Ledger().getTotalNetChange(forbiddenTags = ["tag 1"]),
+        "one year, without category"       : lambda : Ledger().getTotalLiquidityChange(timeRange = oneYear, forbiddenCategory = "category 3"),
+        "one year, two categories"         : lambda : Ledger().getTotalLiquidityChange(timeRange = oneYear, allowedCategories = ["category 3", "category 4"]),
+        "one year, without tag"            : lambda : Ledger().getTotalLiquidityChange(timeRange = oneYear, forbiddenTags = ["tag 1"]),
+        "one year, by category"            : lambda : Ledger().aggregateBy(CATEGORY, timeRange = oneYear),
+    }
+    baselineSeconds = dict()
+    print(f"Totals on a ledger of {N_TRANSACTIONS} transactions (objects vs. columnar storage)")
+    for name, query in queries.items():
+        baselineSeconds[name] = timeCall(query, repeat = 3)
+        printTiming(f"{name} (objects)", baselineSeconds[name])
+    Ledger.enableColumnarStorage()
+    for name, query in queries.items():
+        printTiming(f"{name} (columnar)", timeCall(query), baselineSeconds[name])
+
+if __name__ == '__main__':
+    main()
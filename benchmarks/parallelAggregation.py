@@ -0,0 +1,31 @@
+import datetime
+from spendlog.ledger import Ledger, TimeRange, CATEGORY, COUNTER_PARTY
+from benchmarks.benchmarkLedger import populateLedger, timeCall, printTiming, FIRST_DATE
+
+N_TRANSACTIONS = 200000
+WORKERS = 4
+
+def main():
+    populateLedger(N_TRANSACTIONS)
+    Ledger.setQueryCacheSize(0)
+    fiveYears = TimeRange(FIRST_DATE + datetime.timedelta(days = 1000), FIRST_DATE + datetime.timedelta(days = 2825))
+    queries = {
+        "without tag"                      : lambda : Ledger().getTotalLiquidityChange(forbiddenTags = ["tag 1"]),
+        "five years, without category"     : lambda : Ledger().getTotalNetChange(timeRange = fiveYears, forbiddenCategory = "category 3"),
+        "by category"                      : lambda : Ledger().aggregateBy(CATEGORY),
+        "five years, by counter party"     : lambda : Ledger().aggregateBy(COUNTER_PARTY, timeRange = fiveYears),
+    }
+    baselineSeconds = dict()
+    print(f"Aggregates on a ledger of {N_TRANSACTIONS} transactions (serial vs. {WORKERS} worker processes)")
+    for name, query in queries.items():
+        baselineSeconds[name] = timeCall(query, repeat = 3)
+        printTiming(f"{name} (serial)", baselineSeconds[name])
+    Ledger.enableParallelAggregation(workers = WORKERS, minimumSize = 0)
+    for name, query in queries.items():
+        # the first call starts the workers and writes the memory-mapped snapshot
+        query()
+        printTiming(f"{name} (parallel)", timeCall(query, repeat = 3), baselineSeconds[name])
+    Ledger.disableParallelAggregation()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import datetime
+from spendlog.ledger import Ledger, TimeRange
+from spendlog.counterParty import CounterPartyDataBase
+from benchmarks.benchmarkLedger import populateLedger, timeCall, printTiming, FIRST_DATE
+
+N_TRANSACTIONS = 100000
+
+# The implementation of Ledger.getTransactions before the query planner: one full scan
+# per filter (or a full copy, when the filter isn't used), all intersected
+def getTransactionsByScanning(timeRange = None,
+                              requiredCategory = None,
+                              requiredCounterParty = None,
+                              forbiddenTags = None):
+    transactionSet = Ledger().transactionSet
+    def counterParty(alias):
+        return CounterPartyDataBase().getCounterParty(alias)
+    transactions = transactionSet.copy()
+    if timeRange is None:
+        transactions &= transactionSet.copy()
+    else:
+        transactions &= {transaction for transaction in transactionSet if timeRange.start <= transaction.getDate() <= timeRange.end}
+    if requiredCategory is None:
+        transactions &= transactionSet.copy()
+    else:
+        transactions &= {transaction for transaction in transactionSet if transaction.getCategory() == requiredCategory}
+    if forbiddenTags is None:
+        transactions &= transactionSet.copy()
+    else:
+        transactions &= {transaction for transaction in transactionSet if not set(forbiddenTags) & set(transaction.tags)}
+    if requiredCounterParty is None:
+        transactions &= transactionSet.copy()
+    else:
+        transactions &= {transaction for transaction in transactionSet if counterParty(transaction.counterPartyAlias) == counterParty(requiredCounterParty)}
+    # the remaining six filters are unused in these queries, but still each copied the ledger
+    for _ in range(6):
+        transactions &= transactionSet.copy()
+    return transactions
+
+def main():
+    populateLedger(N_TRANSACTIONS)
+    # timed calls would otherwise just be returned from the query cache
+    Ledger.setQueryCacheSize(0)
+    oneMonth = TimeRange(FIRST_DATE + datetime.timedelta(days = 1800), FIRST_DATE + datetime.timedelta(days = 1830))
+    queries = {
+        "no filters"                       : {},
+        "one month"                        : {"timeRange" : oneMonth},
+        "one category"                     : {"requiredCategory" : "category 3"},
+        "one month, one category"          : {"timeRange" : oneMonth, "requiredCategory" : "category 3"},
+        "one counter party"                : {"requiredCounterParty" : "alias 7"},
+        "one month, without tag"           : {"timeRange" : oneMonth, "forbiddenTags" : ["tag 1"]},
+    }
+    print(f"getTransactions on a ledger of {N_TRANSACTIONS} transactions (full scan vs. query planner)")
+    for name, filters in queries.items():
+        assert Ledger().getTransactions(**filters) == getTransactionsByScanning(**filters)
+        baselineSeconds = timeCall(lambda : getTransactionsByScanning(**filters), repeat = 3)
+        printTiming(f"{name} (full scan)", baselineSeconds)
+        printTiming(f"{name} (planner)", timeCall(lambda : Ledger().getTransactions(**filters)), baselineSeconds)
+
+if __name__ == '__main__':
+    main()
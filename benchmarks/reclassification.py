@@ -0,0 +1,36 @@
+import time
+from spendlog.ledger import Ledger
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.loggingProvider import LoggingProvider
+from benchmarks.benchmarkLedger import populateLedger, printTiming, ALIASES, CATEGORIES
+logging = LoggingProvider().logging
+
+N_TRANSACTIONS = 200000
+
+# Changing the category of one counter party (of 200), which reclassifies its share of
+# the transactions in place, vs. rebuilding the ledger from the same records
+def main():
+    populateLedger(N_TRANSACTIONS)
+    logging.getLogger().handlers = [logging.NullHandler()]
+    records = [{"liquidityChange"   : transaction.getLiquidityChange(),
+                "capitalChange"     : transaction.getCapitalChange(),
+                "counterPartyAlias" : transaction.getSourceAlias(),
+                "date"              : transaction.getDate(),
+                "fingerPrint"       : transaction.fingerPrint} for transaction in Ledger().transactionSet]
+    alias = ALIASES[0]
+    nAffected = len(Ledger().sourceAliasIndex.getBucket(alias))
+    print(f"Changing the category of one counter party ({nAffected} of {N_TRANSACTIONS} transactions)")
+
+    start = time.perf_counter()
+    Ledger().reset()
+    Ledger().addTransactions(records)
+    baselineSeconds = time.perf_counter() - start
+    printTiming("rebuild the ledger", baselineSeconds)
+
+    start = time.perf_counter()
+    CounterPartyDataBase().addCounterParty([alias], category = CATEGORIES[1])
+    printTiming("reclassify in place", time.perf_counter() - start, baselineSeconds)
+    assert Ledger().categoryIndex.getSize(CATEGORIES[1]) >= nAffected
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import datetime
+import random
+from spendlog.transaction import Transaction
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.loggingProvider import LoggingProvider
+from benchmarks.benchmarkLedger import ALIASES, CATEGORIES, TAGS, FIRST_DATE, N_DAYS, timeCall
+logging = LoggingProvider().logging
+
+N_TRANSACTIONS = 100000
+
+# Records as a parser returns them, a tenth of them without a fingerprint
+def generateRecords(nTransactions, seed = 0):
+    rng = random.Random(seed)
+    records = list()
+    for fingerPrint in range(nTransactions):
+        records.append({"liquidityChange"   : rng.randint(-5000, 5000),
+                        "counterPartyAlias" : rng.choice(ALIASES),
+                        "date"              : FIRST_DATE + datetime.timedelta(days = rng.randrange(N_DAYS)),
+                        "fingerPrint"       : None if fingerPrint % 10 == 0 else fingerPrint})
+    return records
+
+def printThroughput(name, seconds, baselineSeconds = None):
+    line = f"  {name:<50} {N_TRANSACTIONS / seconds:12.0f} transactions/s"
+    if baselineSeconds is not None:
+        line += f"  ({baselineSeconds / seconds:.1f}x)"
+    print(line)
+
+def main():
+    CounterPartyDataBase().reset()
+    rng = random.Random(0)
+    for alias in ALIASES:
+        CounterPartyDataBase().addCounterParty([alias],
+                                               tags = set(rng.sample(TAGS, rng.randint(0, 2))),
+                                               category = rng.choice(CATEGORIES))
+    records = generateRecords(N_TRANSACTIONS)
+    # warnings are written the same as in normal use, but not to the terminal
+    logging.getLogger().handlers = [logging.NullHandler()]
+    print(f"Constructing {N_TRANSACTIONS} transactions")
+    baselineSeconds = timeCall(lambda : [Transaction(**record) for record in records], repeat = 3)
+    printThroughput("Transaction(**record)", baselineSeconds)
+    printThroughput("Transaction.fromRecords", timeCall(lambda : Transaction.fromRecords(records), repeat = 3), baselineSeconds)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+from spendlog.ledger import Ledger
+from benchmarks.benchmarkLedger import populateLedger, timeCall, printTiming
+
+N_TRANSACTIONS = 200000
+
+# Building and intersecting sets of transactions, as the ledger does for every query
+# that isn't answered from an index alone
+def main():
+    populateLedger(N_TRANSACTIONS)
+    transactions = list(Ledger().transactionSet)
+    withoutFingerPrints = [transaction.__class__.fromFields(transaction.getLiquidityChangeMinor(),
+                                                            transaction.getCapitalChangeMinor(),
+                                                            transaction.counterPartyAlias,
+                                                            transaction.tags,
+                                                            transaction.category,
+                                                            transaction.date,
+                                                            None) for transaction in transactions]
+    every2nd = set(transactions[::2])
+    every3rd = set(transactions[::3])
+    print(f"Sets of {N_TRANSACTIONS} transactions")
+    printTiming("set of transactions", timeCall(lambda : set(transactions)))
+    printTiming("set of transactions without fingerprint", timeCall(lambda : set(withoutFingerPrints)))
+    printTiming("intersection", timeCall(lambda : every2nd & every3rd))
+    printTiming("intersection of new sets", timeCall(lambda : set(transactions[::2]) & set(transactions[::3])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import datetime
+import gc
+import random
+import subprocess
+import tracemalloc
+import types
+from spendlog.transaction import Transaction
+from spendlog.counterParty import CounterPartyDataBase
+from benchmarks.benchmarkLedger import ALIASES, CATEGORIES, TAGS, FIRST_DATE, N_DAYS
+
+N_TRANSACTIONS = 200000
+
+# The commit before Transaction got __slots__ and integer minor unit amounts. Its
+# Transaction (with an instance __dict__ and a tag set of its own per transaction) is
+# what the current one is measured against
+BASELINE_COMMIT = "36bea1b"
+
+# Transaction as it was in BASELINE_COMMIT, read from git. Run from the repository
+def loadBaselineTransaction():
+    source = subprocess.run(["git", "show", f"{BASELINE_COMMIT}:spendlog/transaction.py"],
+                            capture_output = True, text = True, check = True).stdout
+    module = types.ModuleType("baselineTransaction")
+    exec(compile(source, f"{BASELINE_COMMIT}:spendlog/transaction.py", "exec"), module.__dict__)
+    return module.Transaction
+
+# The fields of nTransactions transactions, as parsed: every row gets new objects, the
+# way a parser creates them from the lines of a file
+def generateFields(nTransactions, seed = 0):
+    rng = random.Random(seed)
+    for fingerPrint in range(nTransactions):
+        date = FIRST_DATE + datetime.timedelta(days = rng.randrange(N_DAYS))
+        yield (rng.randint(-500000, 500000),
+               rng.choice([0, 0, 0, rng.randint(-10000, 10000)]),
+               "".join(rng.choice(ALIASES)),
+               set(rng.sample(TAGS, rng.randint(0, 2))),
+               "".join(rng.choice(CATEGORIES)),
+               datetime.datetime(date.year, date.month, date.day),
+               fingerPrint)
+
+# Bytes allocated per transaction while creating and holding nTransactions of them
+def measureBytesPerTransaction(create, nTransactions):
+    gc.collect()
+    tracemalloc.start()
+    transactions = [create(*fields) for fields in generateFields(nTransactions)]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del transactions
+    return allocated / nTransactions
+
+def main():
+    CounterPartyDataBase().reset()
+    for alias in ALIASES:
+        CounterPartyDataBase().addCounterParty([alias])
+    print(f"Memory per transaction, over {N_TRANSACTIONS} transactions")
+    baseline = measureBytesPerTransaction(loadBaselineTransaction(), N_TRANSACTIONS)
+    print(f"  {f'Transaction at {BASELINE_COMMIT} (before)':<50} {baseline:10.1f} bytes")
+    compact = measureBytesPerTransaction(Transaction, N_TRANSACTIONS)
+    print(f"  {'Transaction':<50} {compact:10.1f} bytes  ({baseline / compact:.1f}x smaller)")
+
+if __name__ == '__main__':
+    main()
@@ -53,6 +53,14 @@ if __name__ == '__main__':
         presentAllTransactions = True
 
     specificCounterPartyDatabase.populateCounterPartyDatabase()
+
+    # uncomment these if you want to keep the ledger in a local
+    # file between runs, so that only new transactions are added:
+
+    # from spendlog.ledger import Ledger
+    # from spendlog.sqliteStore import SqliteStore
+    # Ledger.attachStore(SqliteStore("ledger.sqlite"))
+
     parser = InternetbankenParser()
     parser.parseFromFilename(filename)
     start = datetime.datetime.strptime("2025-03-24", DATE_FORMAT)
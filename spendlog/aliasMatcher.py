@@ -0,0 +1,158 @@
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+import re
+
+class AliasRuleError(Exception):
+    pass
+
+# Characters that end the literal prefix of a regex
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+REGEX_QUANTIFIERS = set("*+?{")
+WILDCARD_METACHARACTERS = set("*?")
+NUMBERED_BACKREFERENCE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]")
+
+# The literal characters a regex starts with, i.e. that every alias it matches starts
+# with. Conservative: nothing for a regex with an alternation anywhere, and a literal
+# character followed by a quantifier is not part of the prefix
+def getRegexLiteralPrefix(regex) -> str:
+    if "|" in regex:
+        return ""
+    length = 0
+    while length < len(regex) and regex[length] not in REGEX_METACHARACTERS:
+        length += 1
+    if length < len(regex) and regex[length] in REGEX_QUANTIFIERS:
+        length -= 1
+    return regex[:max(length, 0)]
+
+def getWildcardLiteralPrefix(wildcard) -> str:
+    length = 0
+    while length < len(wildcard) and wildcard[length] not in WILDCARD_METACHARACTERS:
+        length += 1
+    return wildcard[:length]
+
+# '*' matches any number of characters and '?' any one character (newlines included),
+# everything else matches itself
+def wildcardToRegex(wildcard) -> str:
+    return "".join("(?s:.*)" if character == "*" else "(?s:.)" if character == "?" else re.escape(character) for character in wildcard)
+
+# The rules whose literal prefix ends at this node of the trie: the value of the prefix
+# rule for that prefix (if any), and the wildcard and regex rules starting with it. The
+# patterns are compiled into one regex when first matched against, with each rule
+# wrapped in a group of its own, so which rule matched is given by the last (outermost)
+# group of the match.
+class TrieNode:
+    __slots__ = ("children", "prefixValue", "patterns", "compiled", "valueOfGroup")
+
+    def __init__(self):
+        self.children = dict()
+        self.prefixValue = None
+        self.patterns = dict()
+        self.compiled = None
+        self.valueOfGroup = None
+
+    def hasRules(self) -> bool:
+        return self.prefixValue is not None or bool(self.patterns)
+
+    def addPattern(self, regex, value, nGroups = 0):
+        # replacing a rule keeps its place in the order
+        self.patterns[regex] = (value, nGroups)
+        self.compiled = None
+
+    def compile(self):
+        alternatives = list()
+        self.valueOfGroup = dict()
+        group = 1
+        for regex, (value, nGroups) in self.patterns.items():
+            alternatives.append(f"({regex})")
+            self.valueOfGroup[group] = value
+            group += nGroups + 1
+        self.compiled = re.compile("|".join(alternatives))
+
+    def match(self, alias):
+        if self.patterns:
+            if self.compiled is None:
+                self.compile()
+            match = self.compiled.fullmatch(alias)
+            if match is not None:
+                return self.valueOfGroup[match.lastindex]
+        return self.prefixValue
+
+# Matches aliases against prefix, wildcard and regex rules, each mapping to a value (e.g.
+# the counter party of the rule). Wildcards ('*' and '?') and regexes must match the
+# whole alias.
+#
+# Every rule is kept in a trie, at the node of its literal prefix (the whole prefix of a
+# prefix rule, and the characters before the first wildcard or regex metacharacter of
+# the others). An alias only walks down its own path of the trie, and is only tried
+# against the rules along that path, so a lookup costs time proportional to the length
+# of the alias rather than the number of rules (except for rules without a literal
+# prefix, e.g. '*KEBAB*', which every alias is tried against). The rules at each node
+# are combined into one regex.
+#
+# When several rules match, the one with the longest literal prefix wins. Among rules
+# with the same literal prefix, wildcard and regex rules win over the prefix rule, and
+# the first one added wins among them.
+#
+# Regexes are combined, so they can't use global flags (use e.g. '(?i:...)' instead),
+# named groups or numbered backreferences.
+class AliasMatcher:
+    def __init__(self):
+        self.root = TrieNode()
+
+    def getNode(self, literalPrefix) -> TrieNode:
+        node = self.root
+        for character in literalPrefix:
+            child = node.children.get(character)
+            if child is None:
+                child = node.children[character] = TrieNode()
+            node = child
+        return node
+
+    # Each add returns the literal prefix of the rule, which every alias it matches starts
+    # with
+    def addPrefix(self, prefix, value) -> str:
+        node = self.getNode(prefix)
+        if node.prefixValue is not None:
+            logging.warning(f"Adding prefix rule '{prefix}', which is already in the alias matcher! The old rule will be replaced")
+        node.prefixValue = value
+        return prefix
+
+    def addWildcard(self, wildcard, value) -> str:
+        literalPrefix = getWildcardLiteralPrefix(wildcard)
+        self.getNode(literalPrefix).addPattern(wildcardToRegex(wildcard), value)
+        return literalPrefix
+
+    # Raises AliasRuleError unless the regex can be combined with others. Returns the
+    # number of groups in it
+    @staticmethod
+    def checkRegex(regex) -> int:
+        # compiled the way it will be combined, so that e.g. global flags are rejected
+        try:
+            compiled = re.compile(f"({regex})")
+        except re.error as e:
+            raise AliasRuleError(f"Invalid regex alias rule '{regex}': {e}")
+        if compiled.groupindex or NUMBERED_BACKREFERENCE.search(regex):
+            raise AliasRuleError(f"Regex alias rule '{regex}' can't use named groups or numbered backreferences")
+        return compiled.groups - 1
+
+    def addRegex(self, regex, value) -> str:
+        nGroups = self.checkRegex(regex)
+        literalPrefix = getRegexLiteralPrefix(regex)
+        self.getNode(literalPrefix).addPattern(regex, value, nGroups)
+        return literalPrefix
+
+    # The value of the rule that matches the alias (see above), or None if none does
+    def match(self, alias):
+        node = self.root
+        path = [node] if node.hasRules() else []
+        for character in alias:
+            node = node.children.get(character)
+            if node is None:
+                break
+            if node.hasRules():
+                path.append(node)
+        for node in reversed(path):
+            value = node.match(alias)
+            if value is not None:
+                return value
+        return None
@@ -0,0 +1,343 @@
+from spendlog.transactionQuery import LIQUIDITY_CHANGE, CAPITAL_CHANGE
+from spendlog.snapshot import GROUP_BY_CATEGORY, GROUP_BY_TAG
+from spendlog.timeSeries import WEEK, MONTH, YEAR
+from spendlog.transaction import fromMinorUnits
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+try:
+    import numpy
+except ModuleNotFoundError:
+    numpy = None
+
+INITIAL_CAPACITY = 1024
+TAGS_PER_WORD = 64
+# The store is compacted once more than this fraction of its rows are dead
+MAXIMUM_DEAD_FRACTION = 0.25
+COLUMNS = ("liquidityChanges", "capitalChanges", "dates", "categoryCodes", "counterPartyCodes", "tagMasks", "alive")
+
+class ColumnarStorageUnavailableError(Exception):
+    pass
+
+# Columnar copy of the transactions in the ledger, used to compute totals as vectorized
+# mask-and-sum operations rather than by iterating over Transaction objects.
+#
+# Each transaction is a row. Amounts are int64 columns of minor units, dates are datetime64, category
+# and (stored) counter party alias are dictionary encoded as integer codes, and tags are
+# bitmasks (one uint64 word per 64 distinct tags). The Transaction objects themselves are
+# kept alongside the columns (transactions[row]), so a row can always be viewed through
+# the normal Transaction API.
+#
+# Removing a transaction only marks its row as dead; dead rows are never matched. Once
+# more than MAXIMUM_DEAD_FRACTION of the rows are dead, the live rows are moved together
+# (in order) and the dead ones dropped, so that replacing and reclassifying transactions
+# doesn't grow the columns without bound. Each compaction follows at least a quarter of
+# the rows being removed, so it costs amortized O(1) per removal.
+#
+# Requires numpy, which is an optional dependency of spendlog.
+class ColumnarStore:
+    def __init__(self):
+        if numpy is None:
+            raise ColumnarStorageUnavailableError("Columnar storage requires numpy, which is not installed")
+        self.clear()
+
+    def clear(self):
+        self.size = 0
+        self.nDeadRows = 0
+        self.capacity = INITIAL_CAPACITY
+        self.liquidityChanges = numpy.zeros(self.capacity, dtype = numpy.int64)
+        self.capitalChanges = numpy.zeros(self.capacity, dtype = numpy.int64)
+        self.dates = numpy.zeros(self.capacity, dtype = "datetime64[us]")
+        self.categoryCodes = numpy.zeros(self.capacity, dtype = numpy.int32)
+        self.counterPartyCodes = numpy.zeros(self.capacity, dtype = numpy.int32)
+        self.tagMasks = numpy.zeros((self.capacity, 1), dtype = numpy.uint64)
+        self.alive = numpy.zeros(self.capacity, dtype = bool)
+        self.transactions = list()
+        self.rowOfTransaction = dict()
+        self.categoryDictionary = dict()
+        self.categories = list()
+        self.counterPartyDictionary = dict()
+        self.counterPartyAliases = list()
+        self.tagDictionary = dict()
+        self.tags = list()
+
+    def add(self, transaction):
+        self.addAll([transaction])
+
+    def addAll(self, transactions):
+        if not transactions:
+            return
+        while self.size + len(transactions) > self.capacity:
+            self.grow()
+        first = self.size
+        last = first + len(transactions)
+        self.liquidityChanges[first:last] = [transaction.getLiquidityChangeMinor() for transaction in transactions]
+        self.capitalChanges[first:last] = [transaction.getCapitalChangeMinor() for transaction in transactions]
+        self.dates[first:last] = numpy.array([transaction.getDate() for transaction in transactions], dtype = "datetime64[us]")
+        self.categoryCodes[first:last] = [self.encode(self.categoryDictionary, self.categories, transaction.getCategory()) for transaction in transactions]
+        self.counterPartyCodes[first:last] = [self.encode(self.counterPartyDictionary, self.counterPartyAliases, transaction.counterPartyAlias) for transaction in transactions]
+        tagMasks = [self.getTagMask(transaction.getTags()) for transaction in transactions]
+        words = self.tagMasks.shape[1]
+        self.tagMasks[first:last] = [tagMask + [0] * (words - len(tagMask)) for tagMask in tagMasks]
+        self.alive[first:last] = True
+        for row, transaction in enumerate(transactions, start = first):
+            self.rowOfTransaction[id(transaction)] = row
+        self.transactions += transactions
+        self.size = last
+
+    def remove(self, transaction):
+        row = self.rowOfTransaction.pop(id(transaction), None)
+        if row is None:
+            logging.warning(f"Tried to remove transaction from columnar store, but it is not in the store: {transaction}")
+            return
+        self.alive[row] = False
+        self.transactions[row] = None
+        self.nDeadRows += 1
+        if self.nDeadRows > self.size * MAXIMUM_DEAD_FRACTION:
+            self.compact()
+
+    def grow(self):
+        self.capacity *= 2
+        for name in COLUMNS:
+            column = getattr(self, name)
+            newColumn = numpy.zeros((self.capacity,) + column.shape[1:], dtype = column.dtype)
+            newColumn[:self.size] = column[:self.size]
+            setattr(self, name, newColumn)
+
+    # Drops the dead rows, keeping the live ones in the order they were added. The
+    # capacity and the dictionaries of codes are kept
+    def compact(self):
+        rows = numpy.flatnonzero(self.alive[:self.size])
+        size = len(rows)
+        for name in COLUMNS:
+            column = getattr(self, name)
+            column[:size] = column[rows]
+        self.alive[size:self.size] = False
+        self.transactions = [self.transactions[row] for row in rows.tolist()]
+        self.rowOfTransaction = {id(transaction) : row for row, transaction in enumerate(self.transactions)}
+        logging.debug(f"Compacted columnar store from {self.size} to {size} rows")
+        self.size = size
+        self.nDeadRows = 0
+
+    def encode(self, dictionary, values, value):
+        if value not in dictionary:
+            dictionary[value] = len(values)
+            values.append(value)
+        return dictionary[value]
+
+    def getTagMask(self, tags):
+        mask = [0] * self.tagMasks.shape[1]
+        for tag in tags:
+            bit = self.encode(self.tagDictionary, self.tags, tag)
+            word = bit // TAGS_PER_WORD
+            if word >= self.tagMasks.shape[1]:
+                self.tagMasks = numpy.hstack([self.tagMasks, numpy.zeros((self.capacity, 1), dtype = numpy.uint64)])
+                mask.append(0)
+            mask[word] |= 1 << (bit % TAGS_PER_WORD)
+        return mask
+
+    # The mask of tag bits for the given tags, as one uint64 per word. Tags that have never
+    # been seen have no bit, and are returned separately since they can't be in any mask
+    def getQueryTagMask(self, tags):
+        mask = numpy.zeros(self.tagMasks.shape[1], dtype = numpy.uint64)
+        unknownTags = set()
+        for tag in tags:
+            if tag not in self.tagDictionary:
+                unknownTags.add(tag)
+                continue
+            bit = self.tagDictionary[tag]
+            mask[bit // TAGS_PER_WORD] |= numpy.uint64(1 << (bit % TAGS_PER_WORD))
+        return mask, unknownTags
+
+    def getCodes(self, dictionary, values):
+        return [dictionary[value] for value in values if value in dictionary]
+
+    def isIn(self, codeColumn, codes):
+        if len(codes) == 1:
+            return codeColumn == codes[0]
+        return numpy.isin(codeColumn, codes)
+
+    # Boolean mask of the rows matching the given filters. These are the same as for
+    # Ledger.getTransactions, except that the counter party filters must already be
+    # resolved into the sets of stored counter party aliases they match
+    def getMask(self,
+                timeRange = None,
+                requiredCategory = None,
+                forbiddenCategory = None,
+                allowedCategories = None,
+                requiredTags = None,
+                forbiddenTags = None,
+                allowedTags = None,
+                requiredCounterPartyAliases = None,
+                forbiddenCounterPartyAliases = None,
+                allowedCounterPartyAliases = None):
+        mask = self.alive[:self.size].copy()
+        categoryCodes = self.categoryCodes[:self.size]
+        counterPartyCodes = self.counterPartyCodes[:self.size]
+        tagMasks = self.tagMasks[:self.size]
+
+        if timeRange is not None:
+            dates = self.dates[:self.size]
+            mask &= dates >= numpy.datetime64(timeRange.start, "us")
+            mask &= dates <= numpy.datetime64(timeRange.end, "us")
+
+        if requiredCategory is not None:
+            mask &= self.isIn(categoryCodes, self.getCodes(self.categoryDictionary, [requiredCategory]))
+
+        if forbiddenCategory is not None:
+            mask &= ~self.isIn(categoryCodes, self.getCodes(self.categoryDictionary, [forbiddenCategory]))
+
+        if allowedCategories is not None:
+            mask &= self.isIn(categoryCodes, self.getCodes(self.categoryDictionary, allowedCategories))
+
+        if requiredTags:
+            tagMask, unknownTags = self.getQueryTagMask(requiredTags)
+            if unknownTags:
+                mask[:] = False
+            mask &= ((tagMasks & tagMask) == tagMask).all(axis = 1)
+
+        if forbiddenTags is not None:
+            tagMask, _ = self.getQueryTagMask(forbiddenTags)
+            mask &= ((tagMasks & tagMask) == 0).all(axis = 1)
+
+        if allowedTags is not None:
+            tagMask, _ = self.getQueryTagMask(allowedTags)
+            mask &= ((tagMasks & ~tagMask) == 0).all(axis = 1)
+
+        if requiredCounterPartyAliases is not None:
+            mask &= self.isIn(counterPartyCodes, self.getCodes(self.counterPartyDictionary, requiredCounterPartyAliases))
+
+        if forbiddenCounterPartyAliases is not None:
+            mask &= ~self.isIn(counterPartyCodes, self.getCodes(self.counterPartyDictionary, forbiddenCounterPartyAliases))
+
+        if allowedCounterPartyAliases is not None:
+            mask &= self.isIn(counterPartyCodes, self.getCodes(self.counterPartyDictionary, allowedCounterPartyAliases))
+
+        return mask
+
+    def getTotalLiquidityChange(self, mask):
+        return fromMinorUnits(int(self.liquidityChanges[:self.size][mask].sum()))
+
+    def getTotalCapitalChange(self, mask):
+        return fromMinorUnits(int(self.capitalChanges[:self.size][mask].sum()))
+
+    def getTotalNetChange(self, mask):
+        return fromMinorUnits(int(self.liquidityChanges[:self.size][mask].sum()) + int(self.capitalChanges[:self.size][mask].sum()))
+
+    def getTransactions(self, mask) -> set:
+        return {self.transactions[row] for row in numpy.flatnonzero(mask)}
+
+    def getAmounts(self, amount):
+        if amount == LIQUIDITY_CHANGE:
+            return self.liquidityChanges[:self.size]
+        if amount == CAPITAL_CHANGE:
+            return self.capitalChanges[:self.size]
+        return self.liquidityChanges[:self.size] + self.capitalChanges[:self.size]
+
+    # The n masked transactions with the largest (or smallest) amount (see
+    # transactionQuery.AMOUNTS), in order. Selecting them is a partition rather than a
+    # sort, so only the n selected ones are sorted
+    def getTopTransactions(self, mask, amount, n, largest = True) -> list:
+        if n <= 0:
+            return list()
+        rows = numpy.flatnonzero(mask)
+        values = self.getAmounts(amount)[rows]
+        if largest:
+            values = -values
+        if n < len(rows):
+            selected = numpy.argpartition(values, n - 1)[:n]
+        else:
+            selected = numpy.arange(len(rows))
+        selected = selected[numpy.argsort(values[selected], kind = "stable")]
+        return [self.transactions[row] for row in rows[selected]]
+
+    # Per code totals of the given amount column over the masked rows, as a dict from the
+    # decoded value to its total
+    def getTotalsByCode(self, codes, values, amounts, mask) -> dict:
+        totals = numpy.zeros(len(values), dtype = numpy.int64)
+        numpy.add.at(totals, codes[:self.size][mask], amounts[:self.size][mask])
+        present = numpy.zeros(len(values), dtype = bool)
+        present[codes[:self.size][mask]] = True
+        return {values[code] : fromMinorUnits(int(totals[code])) for code in numpy.flatnonzero(present)}
+
+    def getTotalsByCategory(self, mask) -> tuple[dict, dict]:
+        return (self.getTotalsByCode(self.categoryCodes, self.categories, self.liquidityChanges, mask),
+                self.getTotalsByCode(self.categoryCodes, self.categories, self.capitalChanges, mask))
+
+    def getTotalsByCounterPartyAlias(self, mask) -> tuple[dict, dict]:
+        return (self.getTotalsByCode(self.counterPartyCodes, self.counterPartyAliases, self.liquidityChanges, mask),
+                self.getTotalsByCode(self.counterPartyCodes, self.counterPartyAliases, self.capitalChanges, mask))
+
+    def getTotalsByTag(self, mask) -> tuple[dict, dict]:
+        liquidityChanges = self.liquidityChanges[:self.size][mask]
+        capitalChanges = self.capitalChanges[:self.size][mask]
+        tagMasks = self.tagMasks[:self.size][mask]
+        liquidityTotals = dict()
+        capitalTotals = dict()
+        for bit, tag in enumerate(self.tags):
+            hasTag = (tagMasks[:, bit // TAGS_PER_WORD] & numpy.uint64(1 << (bit % TAGS_PER_WORD))) != 0
+            if hasTag.any():
+                liquidityTotals[tag] = fromMinorUnits(int(liquidityChanges[hasTag].sum()))
+                capitalTotals[tag] = fromMinorUnits(int(capitalChanges[hasTag].sum()))
+        return liquidityTotals, capitalTotals
+
+    # Dates of the earliest and latest masked rows, or None if no rows are masked
+    def getDateRange(self, mask) -> tuple:
+        dates = self.dates[:self.size][mask]
+        if not len(dates):
+            return None
+        return dates.min().item(), dates.max().item()
+
+    # Number of the day, week (starting on Monday), month or year of each date, counted
+    # from the epoch. 1970-01-01 was a Thursday, so weeks start 3 days after a multiple of 7
+    def getPeriodNumbers(self, dates, frequency):
+        if frequency == YEAR:
+            return dates.astype("datetime64[Y]").astype(numpy.int64)
+        if frequency == MONTH:
+            return dates.astype("datetime64[M]").astype(numpy.int64)
+        days = dates.astype("datetime64[D]").astype(numpy.int64)
+        if frequency == WEEK:
+            return (days + 3) // 7
+        return days
+
+    def sumByIndex(self, indices, size, amounts):
+        totals = numpy.zeros(size, dtype = numpy.int64)
+        numpy.add.at(totals, indices, amounts)
+        return totals
+
+    def sumByIndexInMajorUnits(self, indices, size, amounts) -> list:
+        return [fromMinorUnits(total) for total in self.sumByIndex(indices, size, amounts).tolist()]
+
+    # Liquidity and capital change per period, of nPeriods periods starting with the one
+    # starting at firstPeriod, over the masked rows. Returned as a dict from the decoded
+    # value of the groupBy column (see snapshot.GROUP_BY_*), or None if not grouped, to
+    # (liquidity changes, capital changes) lists with one total per period
+    def getTotalsByPeriod(self, mask, frequency, firstPeriod, nPeriods, groupBy = None) -> dict:
+        rows = numpy.flatnonzero(mask)
+        periods = self.getPeriodNumbers(self.dates[rows], frequency) - self.getPeriodNumbers(numpy.array([firstPeriod], dtype = "datetime64[us]"), frequency)[0]
+        liquidityChanges = self.liquidityChanges[rows]
+        capitalChanges = self.capitalChanges[rows]
+        if groupBy is None:
+            return {None : (self.sumByIndexInMajorUnits(periods, nPeriods, liquidityChanges), self.sumByIndexInMajorUnits(periods, nPeriods, capitalChanges))}
+
+        totals = dict()
+        if groupBy == GROUP_BY_TAG:
+            tagMasks = self.tagMasks[rows]
+            for bit, tag in enumerate(self.tags):
+                hasTag = (tagMasks[:, bit // TAGS_PER_WORD] & numpy.uint64(1 << (bit % TAGS_PER_WORD))) != 0
+                if hasTag.any():
+                    totals[tag] = (self.sumByIndexInMajorUnits(periods[hasTag], nPeriods, liquidityChanges[hasTag]),
+                                   self.sumByIndexInMajorUnits(periods[hasTag], nPeriods, capitalChanges[hasTag]))
+            return totals
+
+        if groupBy == GROUP_BY_CATEGORY:
+            codes, values = self.categoryCodes[rows], self.categories
+        else:
+            codes, values = self.counterPartyCodes[rows], self.counterPartyAliases
+        # one row of periods per code, summed in a single pass over the flattened grid
+        cells = codes.astype(numpy.int64) * nPeriods + periods
+        liquidityGrid = self.sumByIndex(cells, len(values) * nPeriods, liquidityChanges).reshape(len(values), nPeriods)
+        capitalGrid = self.sumByIndex(cells, len(values) * nPeriods, capitalChanges).reshape(len(values), nPeriods)
+        for code in numpy.unique(codes):
+            totals[values[code]] = ([fromMinorUnits(total) for total in liquidityGrid[code].tolist()],
+                                    [fromMinorUnits(total) for total in capitalGrid[code].tolist()])
+        return totals
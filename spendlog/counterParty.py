@@ -1,5 +1,7 @@
+from spendlog.aliasMatcher import AliasMatcher
 from spendlog.loggingProvider import LoggingProvider
 logging = LoggingProvider().logging
+import threading
 
 class NameMismatchError(Exception):
     pass
@@ -7,6 +9,8 @@ class NameMismatchError(Exception):
 class CounterParty:
     def __init__(self, name, tags = None, category = None, transactionModifier = None):
         self.name = name
+        # assigned by the counter party database when added to it
+        self.id = None
 
         if tags is None:
             self.tags = set()
@@ -41,47 +45,171 @@ class CounterParty:
     def __hash__(self):
         return hash(self.name)
 
+# The database is used from any thread that creates transactions or queries the
+# ledger, so everything that touches it holds lock (which is reentrant, since looking
+# up an unknown alias adds it)
+#
+# Every counter party added gets a new integer id, so counter parties can be compared
+# by id rather than with __eq__. Ids are never reused, not even across resets. The
+# generation is bumped whenever an alias that was already resolved may resolve
+# differently, so that whoever caches what an alias resolves to (e.g.
+# Transaction.getCounterParty and the query cache of the ledger) knows when to resolve
+# it again. Adding counter parties that only new aliases resolve to (e.g. the ones
+# auto-added while ingesting new merchants) doesn't change any cached resolution, so it
+# doesn't bump the generation. It keeps counting across resets, so a cached resolution
+# never looks current to a later database.
+#
+# Besides exact aliases, a counter party can be given prefix, wildcard and regex alias
+# rules (see aliasMatcher.py), e.g. for card transactions like 'ICA NARA 1234
+# STOCKHOLM', which would otherwise each become a counter party of their own. An alias
+# is resolved exactly if it can be, otherwise by the rules, and the counter party it
+# resolves to by the rules is remembered. An alias that neither resolves to adds a
+# counter party of its own, as before. Such auto-added aliases give way to rules added
+# later that match them.
+#
+# Adding a counter party changes what some aliases that were already resolved resolve to:
+# the aliases it is given, and the remembered and auto-added aliases its rules now match.
+# Change listeners (e.g. the ledger, see Ledger.reclassifyAliases) are called with these
+# aliases once the change is done and lock is released, so that they can update whatever
+# they derived from them. Only the aliases starting with the literal prefix of a new rule
+# are matched against the rules again, so the cost of a change doesn't grow with the
+# number of rules.
 class CounterPartyDataBase:
     _instance = None
+    lock = threading.RLock()
+    nextCounterPartyId = 0
+    generation = 0
+    changeListeners = list()
 
     def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls, *args, **kwargs)
-            cls.aliasToCounterPartyMap = dict()
-            logging.debug(f"Initializing and returning new CounterPartyDataBase")
-        else:
-            logging.everything(f"CounterPartyDataBase already exists. Returning existing instance")
-        return cls._instance
+        with cls.lock:
+            if cls._instance is None:
+                instance = super().__new__(cls, *args, **kwargs)
+                cls.initializeAliases()
+                cls._instance = instance
+                logging.debug(f"Initializing and returning new CounterPartyDataBase")
+            else:
+                logging.everything(f"CounterPartyDataBase already exists. Returning existing instance")
+            return cls._instance
 
     @classmethod
     def reset(cls):
-        cls.aliasToCounterPartyMap = dict()
-        cls._instance = None
+        with cls.lock:
+            cls.initializeAliases()
+            cls.generation += 1
+            cls._instance = None
         logging.debug(f"Reset CounterPartyDataBase")
 
-    def getCounterParty(self, alias):
-        if alias not in self.aliasToCounterPartyMap:
-            logging.info(f"'{alias}' is not in counter party database. Adding it")
-            self.addCounterParty([alias])
-        return self.aliasToCounterPartyMap[alias]
+    @classmethod
+    def initializeAliases(cls):
+        cls.aliasToCounterPartyMap = dict()
+        cls.aliasMatcher = AliasMatcher()
+        cls.matchedAliases = dict()
+        cls.autoAddedAliases = set()
 
-    def addCounterParty(self, aliases, *args, **kwargs):
+    # Listeners are called with the set of aliases that resolve differently after a
+    # change. They are kept across resets
+    @classmethod
+    def addChangeListener(cls, listener):
+        with cls.lock:
+            if listener not in cls.changeListeners:
+                cls.changeListeners.append(listener)
+
+    @classmethod
+    def removeChangeListener(cls, listener):
+        with cls.lock:
+            if listener in cls.changeListeners:
+                cls.changeListeners.remove(listener)
+
+    def getCounterParty(self, alias):
+        with self.lock:
+            counterParty = self.findCounterParty(alias)
+            if counterParty is None:
+                logging.info(f"'{alias}' is not in counter party database. Adding it")
+                self.addCounterParty([alias])
+                self.autoAddedAliases.add(alias)
+                counterParty = self.aliasToCounterPartyMap[alias]
+            return counterParty
+
+    # The counter party the alias resolves to, exactly or by the alias rules, or None if
+    # it resolves to none (without adding one, unlike getCounterParty)
+    def findCounterParty(self, alias):
+        with self.lock:
+            counterParty = self.aliasToCounterPartyMap.get(alias)
+            if counterParty is None:
+                counterParty = self.matchedAliases.get(alias)
+                if counterParty is None:
+                    counterParty = self.aliasMatcher.match(alias)
+                    if counterParty is not None:
+                        self.matchedAliases[alias] = counterParty
+            return counterParty
+
+    # Matches the remembered and auto-added aliases starting with any of the literal
+    # prefixes against the rules again. Auto-added aliases that now match a rule are
+    # dropped. Returns the aliases that now resolve differently
+    def applyNewRules(self, literalPrefixes) -> set:
+        literalPrefixes = tuple(literalPrefixes)
+        changedAliases = set()
+        for alias in [alias for alias in self.matchedAliases if alias.startswith(literalPrefixes)]:
+            counterParty = self.aliasMatcher.match(alias)
+            if counterParty is not self.matchedAliases[alias]:
+                self.matchedAliases[alias] = counterParty
+                changedAliases.add(alias)
+        for alias in [alias for alias in self.autoAddedAliases if alias.startswith(literalPrefixes)]:
+            counterParty = self.aliasMatcher.match(alias)
+            if counterParty is not None:
+                del self.aliasToCounterPartyMap[alias]
+                self.autoAddedAliases.discard(alias)
+                self.matchedAliases[alias] = counterParty
+                changedAliases.add(alias)
+        return changedAliases
+
+    # Adds a counter party, named by its first alias, that the aliases resolve to, along
+    # with any aliases starting with one of the prefixes, or matching one of the
+    # wildcards or regexes (see aliasMatcher.py). Giving an alias that is already in the
+    # database replaces what it resolves to, e.g. to change the category of a counter
+    # party, and then the change listeners are called
+    def addCounterParty(self, aliases, *args, prefixes = (), wildcards = (), regexes = (), **kwargs):
         if not aliases:
             return
-        for alias in aliases:
-            if alias in self.aliasToCounterPartyMap:
-                logging.warning(f"Adding counter party with alias '{alias}', which is already in the counter party database! The old alias will be replaced")
-        name = aliases[0]
-        counterParty = CounterParty(name, *args, **kwargs)
-        for alias in aliases:
-            self.aliasToCounterPartyMap[alias] = counterParty
+        for regex in regexes:
+            AliasMatcher.checkRegex(regex)
+        with self.lock:
+            changedAliases = set()
+            for alias in aliases:
+                if alias in self.aliasToCounterPartyMap:
+                    logging.warning(f"Adding counter party with alias '{alias}', which is already in the counter party database! The old alias will be replaced")
+                    changedAliases.add(alias)
+                elif self.matchedAliases.pop(alias, None) is not None:
+                    changedAliases.add(alias)
+            name = aliases[0]
+            counterParty = CounterParty(name, *args, **kwargs)
+            counterParty.id = type(self).nextCounterPartyId
+            type(self).nextCounterPartyId += 1
+            for alias in aliases:
+                self.aliasToCounterPartyMap[alias] = counterParty
+            self.autoAddedAliases.difference_update(aliases)
+            literalPrefixes = [self.aliasMatcher.addRegex(regex, counterParty) for regex in regexes]
+            literalPrefixes += [self.aliasMatcher.addPrefix(prefix, counterParty) for prefix in prefixes]
+            literalPrefixes += [self.aliasMatcher.addWildcard(wildcard, counterParty) for wildcard in wildcards]
+            if literalPrefixes:
+                changedAliases |= self.applyNewRules(literalPrefixes)
+            if changedAliases:
+                type(self).generation += 1
+            listeners = list(self.changeListeners)
+        if changedAliases:
+            for listener in listeners:
+                listener(changedAliases)
 
     def getAllCounterParties(self):
-        return set(self.aliasToCounterPartyMap.values())
+        with self.lock:
+            return set(self.aliasToCounterPartyMap.values())
 
     def getAllCounterPartyNames(self):
-        return {party.name for party in set(self.aliasToCounterPartyMap.values())}
+        with self.lock:
+            return {party.name for party in set(self.aliasToCounterPartyMap.values())}
 
     def getAllCounterPartyAliases(self):
-        return set(self.aliasToCounterPartyMap.keys())
+        with self.lock:
+            return set(self.aliasToCounterPartyMap.keys())
 
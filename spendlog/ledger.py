@@ -1,94 +1,695 @@
-from spendlog.transaction import Transaction, FingerprintMismatchError
+from spendlog.transaction import Transaction, FingerprintMismatchError, toMinorUnits, fromMinorUnits
 from spendlog.loggingProvider import LoggingProvider
 from spendlog.counterParty import CounterPartyDataBase
+from spendlog.ledgerIndex import TransactionIndex, DateIndex, PartitionIndex, MONTH
+from spendlog.columnarStore import ColumnarStore
+from spendlog.queryCache import QueryCache
+from spendlog.rollup import DailyRollup, RollingWindowError
+from spendlog.snapshot import Snapshot, SnapshotError, GROUP_BY_CATEGORY, GROUP_BY_TAG, GROUP_BY_COUNTER_PARTY_ALIAS
+from spendlog.transactionQuery import TransactionQuery, ORDER_KEYS, AMOUNTS, LIQUIDITY_CHANGE, UnknownAmountError
+from spendlog.readWriteLock import ReadWriteLock, LockUpgradeError, readLocked, writeLocked
+from spendlog.parallelAggregation import ParallelAggregator, DEFAULT_MINIMUM_SIZE
+from spendlog.timeSeries import TimeSeries, getPeriods, getPeriodStart, checkFrequency, DAY
+from spendlog.sketches import SketchIndex, SketchError
+import datetime
+import heapq
+import threading
 logging = LoggingProvider().logging
 
+CATEGORY = "category"
+TAG = "tag"
+COUNTER_PARTY = "counterParty"
+DIMENSIONS = (CATEGORY, TAG, COUNTER_PARTY)
+# The snapshot and columnar store column each dimension is grouped by (None for no grouping)
+GROUP_BY_OF_DIMENSION = {None : None, CATEGORY : GROUP_BY_CATEGORY, TAG : GROUP_BY_TAG, COUNTER_PARTY : GROUP_BY_COUNTER_PARTY_ALIAS}
+
+# The filters accepted by getTransactions (and everything built on it), in order
+QUERY_FILTERS = ("timeRange",
+                 "requiredCategory",
+                 "forbiddenCategory",
+                 "allowedCategories",
+                 "requiredTags",
+                 "forbiddenTags",
+                 "allowedTags",
+                 "requiredCounterParty",
+                 "forbiddenCounterParty",
+                 "allowedCounterParties")
+UNORDERED_QUERY_FILTERS = ("allowedCategories", "requiredTags", "forbiddenTags", "allowedTags", "allowedCounterParties")
+
+DEFAULT_QUERY_CACHE_SIZE = 256
+
+ALL_TRANSACTIONS = "all transactions"
+
+class UnknownDimensionError(Exception):
+    pass
+
 class TimeRange:
     def __init__(self, start, end):
         self.start = start
         self.end = end
 
+# Running totals over a group of transactions, as returned by Ledger.aggregateBy().
+# Kept in minor units (see transaction.py), so that they add up exactly, and read and
+# written in major units through liquidityChange and capitalChange
+class Totals:
+    def __init__(self, liquidityChange = 0, capitalChange = 0):
+        self.liquidityChangeMinor = toMinorUnits(liquidityChange)
+        self.capitalChangeMinor = toMinorUnits(capitalChange)
+
+    @property
+    def liquidityChange(self):
+        return fromMinorUnits(self.liquidityChangeMinor)
+
+    @liquidityChange.setter
+    def liquidityChange(self, liquidityChange):
+        self.liquidityChangeMinor = toMinorUnits(liquidityChange)
+
+    @property
+    def capitalChange(self):
+        return fromMinorUnits(self.capitalChangeMinor)
+
+    @capitalChange.setter
+    def capitalChange(self, capitalChange):
+        self.capitalChangeMinor = toMinorUnits(capitalChange)
+
+    def __str__(self):
+        return f"liquidity: {self.liquidityChange}; capital change: {self.capitalChange}; net change: {self.getNetChange()}"
+
+    def __repr__(self):
+        return str(self)
+
+    def __eq__(self, other):
+        return self.liquidityChangeMinor == other.liquidityChangeMinor and self.capitalChangeMinor == other.capitalChangeMinor
+
+    def add(self, transaction):
+        self.liquidityChangeMinor += transaction.getLiquidityChangeMinor()
+        self.capitalChangeMinor += transaction.getCapitalChangeMinor()
+
+    def getLiquidityChange(self):
+        return self.liquidityChange
+
+    def getCapitalChange(self):
+        return self.capitalChange
+
+    def getNetChange(self):
+        return fromMinorUnits(self.liquidityChangeMinor + self.capitalChangeMinor)
+
+# A plan for answering a transaction query: iterate over a single source of candidate
+# transactions (an index bucket or date range that the query allows us to use, or the
+# whole ledger if there is none), and keep the candidates that pass every remaining
+# predicate. Predicates are ordered so that the ones expected to let the fewest
+# transactions through are checked first.
+class QueryPlan:
+    def __init__(self, sources, sourceSize, predicates):
+        self.sources = sources
+        self.sourceSize = sourceSize
+        self.predicates = predicates
+
+    def iterate(self):
+        predicates = self.predicates
+        for source in self.sources:
+            for transaction in source:
+                for predicate in predicates:
+                    if not predicate(transaction):
+                        break
+                else:
+                    yield transaction
+
+    # Same plan over copies of the sources, which can be iterated without holding the
+    # lock of the ledger (the predicates only read the transactions)
+    def copy(self):
+        return QueryPlan([list(source) for source in self.sources], self.sourceSize, self.predicates)
+
+    def execute(self) -> set[Transaction]:
+        if self.predicates:
+            return set(self.iterate())
+        transactions = set()
+        for source in self.sources:
+            transactions.update(source)
+        return transactions
+
 class Ledger:
     _instance = None
+    useColumnarStorage = False
+    queryCacheSize = DEFAULT_QUERY_CACHE_SIZE
+    partitionGranularity = MONTH
+    parallelAggregator = None
+    generation = 0
+    lock = ReadWriteLock()
+    _instanceLock = threading.Lock()
 
+    # The ledger may be used from several threads at once. Every method that reads the
+    # ledger holds lock for reading, and every method that changes it holds it for
+    # writing, so any number of queries can run in parallel, but never while a change is
+    # half applied. The instance is only published once it is fully initialized.
     def __new__(cls, *args, **kwargs):
         logging.everything(f"Ledger requested")
         if cls._instance is None:
-            logging.debug(f"Initializing and returning new Ledger")
-            cls._instance = super().__new__(cls, *args, **kwargs)
-            cls.transactionSet = set()
-        else:
-            logging.everything(f"Ledger already exists. Returning existing instance")
+            with cls._instanceLock:
+                if cls._instance is None:
+                    logging.debug(f"Initializing and returning new Ledger")
+                    instance = super().__new__(cls, *args, **kwargs)
+                    cls.transactionSet = set()
+                    cls.store = None
+                    cls.initializeIndexes()
+                    CounterPartyDataBase.addChangeListener(cls.counterPartyAliasesChanged)
+                    cls._instance = instance
+                    return instance
+        logging.everything(f"Ledger already exists. Returning existing instance")
         return cls._instance
 
     @classmethod
+    @writeLocked
     def reset(cls):
         logging.debug(f"Reset Ledger")
         cls._instance = None
         cls.transactionSet = set()
+        cls.store = None
+        cls.initializeIndexes()
 
-    def addTransaction(self, *args, **kwargs):
-        newTransaction = Transaction(*args, **kwargs)
+    # Attaching a store (see sqliteStore.py) loads the counter parties and transactions
+    # persisted in it, saves the transactions and counter parties that weren't in it, and
+    # from then on writes every change to the ledger through to the store. Resetting the
+    # ledger detaches the store (without touching what is persisted).
+    #
+    # The store is for persistence only: every stored transaction is loaded into memory,
+    # and queries on the ledger are answered from its own indexes, never from SQL. To
+    # query stored transactions from disk without loading them, query the store itself
+    # (SqliteStore.getTransactions and getTotal*) without attaching it.
+    @classmethod
+    @writeLocked
+    def attachStore(cls, store):
+        ledger = cls()
+        store.loadCounterParties()
+        storedTransactions = store.loadTransactions()
+        ledger.insertTransactions(storedTransactions)
+        storedTransactionIds = {id(transaction) for transaction in storedTransactions}
+        store.saveTransactions([transaction for transaction in ledger.transactionSet if id(transaction) not in storedTransactionIds])
+        store.saveCounterParties()
+        cls.store = store
+        logging.debug(f"Attached store with {len(storedTransactions)} transactions")
+
+    # Writes the transactions in the ledger to a binary snapshot (see snapshot.py)
+    @classmethod
+    @readLocked
+    def saveSnapshot(cls, path):
+        Snapshot.write(path, cls().transactionSet)
+
+    # Memory maps a snapshot and returns it. Unless materialize is False, its transactions
+    # are also added to the ledger right away. Otherwise the snapshot can be queried
+    # directly (e.g. for totals) and materialized into the ledger later, if needed at all
+    @classmethod
+    def loadSnapshot(cls, path, materialize = True) -> Snapshot:
+        snapshot = Snapshot(path)
+        if materialize:
+            cls.materializeSnapshot(snapshot)
+        return snapshot
+
+    @classmethod
+    @writeLocked
+    def materializeSnapshot(cls, snapshot):
+        cls().insertTransactions(snapshot.getAllTransactions())
+        logging.debug(f"Materialized {snapshot.size} transactions from snapshot '{snapshot.path}'")
+
+    # The indexes map each category, tag and (stored) counter party alias to the set of
+    # transactions that have it, and keep the transactions sorted by date, so that the
+    # filters below don't need to scan the whole ledger. Transactions are also indexed by
+    # fingerprint, to find duplicates without scanning. They must be kept in sync with
+    # transactionSet, so always go through addTransaction (or indexTransaction/
+    # unindexTransaction) when modifying the ledger.
+    #
+    # The source alias index maps the alias each transaction was constructed with (see
+    # Transaction.getSourceAlias) to the transactions, so that the ones a counter party
+    # change affects can be found without scanning (see reclassifyAliases).
+    @classmethod
+    def initializeIndexes(cls):
+        cls.categoryIndex = TransactionIndex()
+        cls.tagIndex = TransactionIndex()
+        cls.counterPartyIndex = TransactionIndex()
+        cls.sourceAliasIndex = TransactionIndex()
+        cls.pendingAliases = set()
+        cls.dateIndex = DateIndex()
+        cls.fingerPrintIndex = dict()
+        cls.columnarStore = ColumnarStore() if cls.useColumnarStorage else None
+        cls.dailyRollup = DailyRollup()
+        cls.partitionIndex = PartitionIndex(cls.partitionGranularity)
+        cls.sketchIndex = SketchIndex()
+        cls.indexedAliases = (None, dict())
+        # The generation keeps counting across resets, so nothing stamped with it (the
+        # query cache, the parallel snapshot) looks current to a later ledger
+        cls.generation += 1
+        cls.queryCache = QueryCache(cls.queryCacheSize)
+
+    # In columnar storage mode the ledger additionally keeps a ColumnarStore (see
+    # columnarStore.py), and totals and aggregates are computed from its columns.
+    # This requires numpy. The mode is kept across resets until disabled. Switching it
+    # bumps the generation, so no result cached in the other mode is returned.
+    @classmethod
+    @writeLocked
+    def enableColumnarStorage(cls):
+        columnarStore = ColumnarStore()
+        columnarStore.addAll(list(cls().transactionSet))
+        cls.useColumnarStorage = True
+        cls.columnarStore = columnarStore
+        cls.generation += 1
+        logging.debug(f"Enabled columnar storage")
+
+    @classmethod
+    @writeLocked
+    def disableColumnarStorage(cls):
+        cls.useColumnarStorage = False
+        cls.columnarStore = None
+        cls.generation += 1
+        logging.debug(f"Disabled columnar storage")
+
+    # Transactions are also partitioned by month (or year, see ledgerIndex.py), and
+    # queries skip the partitions that can't match. The granularity is kept across
+    # resets until changed.
+    @classmethod
+    @writeLocked
+    def setPartitionGranularity(cls, granularity):
+        partitionIndex = PartitionIndex(granularity)
+        for transaction in cls().transactionSet:
+            partitionIndex.add(transaction)
+        cls.partitionGranularity = granularity
+        cls.partitionIndex = partitionIndex
+
+    # In parallel aggregation mode, getTotal* and aggregateBy split the ledger into one
+    # shard (of contiguous dates) per worker, aggregate the shards in a pool of worker
+    # processes, and merge the partial totals (see parallelAggregation.py). Queries over
+    # fewer than minimumSize transactions (in the partitions that can match) still run
+    # serially. The mode is kept across resets until disabled.
+    @classmethod
+    @writeLocked
+    def enableParallelAggregation(cls, workers = None, minimumSize = DEFAULT_MINIMUM_SIZE):
+        if cls.parallelAggregator is not None:
+            cls.parallelAggregator.shutdown()
+        cls.parallelAggregator = ParallelAggregator(workers, minimumSize)
+        logging.debug(f"Enabled parallel aggregation with {cls.parallelAggregator.workers} workers")
+
+    @classmethod
+    @writeLocked
+    def disableParallelAggregation(cls):
+        if cls.parallelAggregator is not None:
+            cls.parallelAggregator.shutdown()
+        cls.parallelAggregator = None
+        logging.debug(f"Disabled parallel aggregation")
+
+    # Results of getTransactions, getTotal* and aggregateBy are cached, keyed on their
+    # (normalized) filters. Entries are stamped with the generation of the ledger and of
+    # the counter party database, and every change to either bumps its generation, so
+    # stale results are never returned. A size of 0 disables the cache.
+    @classmethod
+    @writeLocked
+    def setQueryCacheSize(cls, maxSize):
+        cls.queryCacheSize = maxSize
+        cls.queryCache = QueryCache(maxSize)
+
+    def getQueryCacheStatistics(self) -> dict:
+        return self.queryCache.getStatistics()
+
+    # The filters given to a query, by name, leaving out the ones that aren't used
+    def getFilters(self, args, kwargs) -> dict:
+        filters = dict(zip(QUERY_FILTERS, args))
+        filters.update(kwargs)
+        return {name : value for name, value in filters.items() if value is not None}
+
+    def getQueryKey(self, operation, args, kwargs) -> tuple:
+        key = [operation]
+        for name, value in sorted(self.getFilters(args, kwargs).items()):
+            if name == "timeRange":
+                value = (value.start, value.end)
+            elif name in UNORDERED_QUERY_FILTERS:
+                value = frozenset(value)
+            key.append((name, value))
+        return tuple(key)
+
+    def cachedQuery(self, operation, compute, args, kwargs):
+        generation = (self.generation, CounterPartyDataBase().generation)
+        return self.queryCache.get(self.getQueryKey(operation, args, kwargs), generation, compute)
+
+    @writeLocked
+    def indexTransaction(self, transaction):
+        self.indexTransactions([transaction])
+
+    # Indexing many transactions at once lets the date index and columnar store merge
+    # them in one go, rather than inserting them one by one
+    @writeLocked
+    def indexTransactions(self, transactions):
+        # e.g. a batch of nothing but duplicates, which doesn't change the ledger
+        if not transactions:
+            return
+        if self.pendingAliases:
+            self.reclassifyAliases(set())
+        type(self).generation += 1
+        for transaction in transactions:
+            self.indexFields(transaction)
+            if transaction.fingerPrint is not None:
+                self.fingerPrintIndex[transaction.fingerPrint] = transaction
+            self.addToSketches(self.sketchIndex, transaction)
+        self.dateIndex.addAll(transactions)
+        if self.columnarStore is not None:
+            self.columnarStore.addAll(transactions)
+        if self.store is not None:
+            self.store.saveTransactions(transactions)
+
+    @writeLocked
+    def unindexTransaction(self, transaction):
+        type(self).generation += 1
+        self.unindexFields(transaction)
+        self.dateIndex.remove(transaction)
+        if self.fingerPrintIndex.get(transaction.fingerPrint) is transaction:
+            del self.fingerPrintIndex[transaction.fingerPrint]
+        self.sketchIndex.markStale()
+        if self.columnarStore is not None:
+            self.columnarStore.remove(transaction)
+        if self.store is not None:
+            self.store.deleteTransaction(transaction)
+
+    # The indexes and aggregates that depend on the category, tags and counter party of a
+    # transaction (everything but the date, fingerprint and sketch indexes, the columnar
+    # store and the store)
+    def indexFields(self, transaction):
+        self.categoryIndex.add(transaction.getCategory(), transaction)
+        for tag in set(transaction.getTags()):
+            self.tagIndex.add(tag, transaction)
+        self.counterPartyIndex.add(transaction.counterPartyAlias, transaction)
+        sourceAlias = transaction.getSourceAlias()
+        if sourceAlias is not None:
+            self.sourceAliasIndex.add(sourceAlias, transaction)
+        self.partitionIndex.add(transaction)
+        day = transaction.getDate().toordinal()
+        for key in self.getRollupKeys(transaction):
+            self.dailyRollup.add(key, day, transaction.getLiquidityChangeMinor(), transaction.getCapitalChangeMinor())
+
+    def unindexFields(self, transaction):
+        self.categoryIndex.remove(transaction.getCategory(), transaction)
+        for tag in set(transaction.getTags()):
+            self.tagIndex.remove(tag, transaction)
+        self.counterPartyIndex.remove(transaction.counterPartyAlias, transaction)
+        sourceAlias = transaction.getSourceAlias()
+        if sourceAlias is not None:
+            self.sourceAliasIndex.remove(sourceAlias, transaction)
+        self.partitionIndex.remove(transaction)
+        day = transaction.getDate().toordinal()
+        for key in self.getRollupKeys(transaction):
+            self.dailyRollup.remove(key, day, transaction.getLiquidityChangeMinor(), transaction.getCapitalChangeMinor())
+
+    # Called by the counter party database with the aliases that resolve differently
+    # after a change to it. A thread that holds the read lock of the ledger can't change
+    # it, so if the database was changed from such a thread, the transactions are
+    # reclassified with the next change to the ledger instead
+    @classmethod
+    def counterPartyAliasesChanged(cls, aliases):
+        ledger = cls()
         try:
-            if newTransaction in self.transactionSet:
-                logging.warning("Transaction already exists!")
-        except FingerprintMismatchError as e:
-            logging.error(str(e) + "\nNote: Replacing old transaction with new to recover.")
-            for oldTransaction in self.transactionSet:
-                if hash(newTransaction) == hash(oldTransaction):
-                    self.transactionSet.remove(oldTransaction)
-                    break
-        self.transactionSet.add(Transaction(*args, **kwargs))
-
-    def getTransactions(self,
-                 timeRange = None,
-                 requiredCategory = None,
-                 forbiddenCategory = None,
-                 allowedCategories = None,
-                 requiredTags = None,
-                 forbiddenTags = None,
-                 allowedTags = None,
-                 requiredCounterParty = None,
-                 forbiddenCounterParty = None,
-                 allowedCounterParties = None) -> set[Transaction]:
-        transactions = self.transactionSet.copy()
-        transactions &= self.getAllTransactionsInTimeRange(timeRange)
-        transactions &= self.getAllTransactionsWithCategory(requiredCategory)
-        transactions &= self.getAllTransactionsWithoutCategory(forbiddenCategory)
-        transactions &= self.getAllTransactionsInCategories(allowedCategories)
-        transactions &= self.getAllTransactionsWithRequiredTags(requiredTags)
-        transactions &= self.getAllTransactionsWithoutTags(forbiddenTags)
-        transactions &= self.getAllTransactionsWithAllowedTags(allowedTags)
-        transactions &= self.getAllTransactionsWithCounterParty(requiredCounterParty)
-        transactions &= self.getAllTransactionsWithoutCounterParty(forbiddenCounterParty)
-        transactions &= self.getAllTransactionsInCounterParties(allowedCounterParties)
-        return transactions
+            ledger.reclassifyAliases(aliases)
+        except LockUpgradeError:
+            logging.warning(f"Counter parties changed while reading the ledger. Reclassifying transactions with the next change to the ledger")
+            ledger.pendingAliases.update(aliases)
+
+    # Derives the transactions constructed with any of the aliases again (see
+    # Transaction.rederive), with the counter party each alias resolves to now, and
+    # updates their indexes and aggregates in place. Only the affected transactions are
+    # touched, found through the source alias index, so this costs time proportional to
+    # their number rather than the size of the ledger. Transactions without a source
+    # (e.g. ones loaded from a store or snapshot) keep their fields.
+    #
+    # Sketches can't forget transactions, so they are rebuilt the next time they are
+    # queried (see getSketchIndex)
+    @writeLocked
+    def reclassifyAliases(self, aliases):
+        aliases = set(aliases) | self.pendingAliases
+        self.pendingAliases.clear()
+        transactions = [transaction for alias in aliases for transaction in self.sourceAliasIndex.getBucket(alias)]
+        if not transactions:
+            return
+        type(self).generation += 1
+        movedTransactions = list()
+        for transaction in transactions:
+            # the hash may change, so the transaction is taken out of every set first
+            self.unindexFields(transaction)
+            self.transactionSet.remove(transaction)
+            if self.columnarStore is not None:
+                self.columnarStore.remove(transaction)
+            if self.store is not None:
+                self.store.deleteTransaction(transaction)
+            date = transaction.getDate()
+            transaction.rederive()
+            if transaction.getDate() != date:
+                self.dateIndex.remove(transaction, date)
+                movedTransactions.append(transaction)
+            self.transactionSet.add(transaction)
+            self.indexFields(transaction)
+        if movedTransactions:
+            self.dateIndex.addAll(movedTransactions)
+        self.sketchIndex.markStale()
+        if self.columnarStore is not None:
+            self.columnarStore.addAll(transactions)
+        if self.store is not None:
+            self.store.saveTransactions(transactions)
+        logging.debug(f"Reclassified {len(transactions)} transactions of {len(aliases)} changed aliases")
+
+    # Transactions are constructed before the write lock is taken to insert them, so the
+    # counter party database may change in between. The ledger is reclassified for such a
+    # change (see reclassifyAliases) without the transactions that aren't in it yet, so
+    # they would keep their old classification. Instead, transactions derived in an older
+    # generation of the database are derived again when inserted, under the write lock,
+    # before they are compared to the transactions already in the ledger
+    def rederiveStaleTransactions(self, transactions):
+        for transaction in transactions:
+            if transaction.isStale():
+                transaction.rederive()
+
+    def addTransaction(self, *args, **kwargs):
+        self.insertTransaction(Transaction(*args, **kwargs))
+
+    # Adds an already constructed transaction to the ledger. A transaction with the same
+    # fingerprint as one already in the ledger is a duplicate and is not added, unless
+    # its data differs, in which case it replaces the old transaction
+    @writeLocked
+    def insertTransaction(self, newTransaction):
+        self.rederiveStaleTransactions([newTransaction])
+        oldTransaction = self.getTransactionByFingerPrint(newTransaction.fingerPrint)
+        if oldTransaction is not None:
+            try:
+                if oldTransaction == newTransaction:
+                    logging.warning("Transaction already exists!")
+                    return
+            except FingerprintMismatchError as e:
+                logging.error(str(e) + "\nNote: Replacing old transaction with new to recover.")
+                self.transactionSet.remove(oldTransaction)
+                self.unindexTransaction(oldTransaction)
+        self.transactionSet.add(newTransaction)
+        self.indexTransaction(newTransaction)
+
+    @readLocked
+    def getTransactionByFingerPrint(self, fingerPrint) -> Transaction:
+        if fingerPrint is None:
+            return None
+        return self.fingerPrintIndex.get(fingerPrint)
+
+    # Adds a batch of transactions, each given as a mapping of the keyword arguments for
+    # Transaction. Duplicates are handled the same as by addTransaction (also within the
+    # batch, where later records win), but all transactions are deduplicated in one pass
+    # and indexed together at the end. The transactions are constructed with
+    # Transaction.fromRecords.
+    def addTransactions(self, records):
+        self.insertTransactions(Transaction.fromRecords(records))
 
+    # Same as addTransactions, but for already constructed transactions
+    @writeLocked
+    def insertTransactions(self, transactions):
+        transactions = list(transactions)
+        self.rederiveStaleTransactions(transactions)
+        newTransactions = dict()
+        transactionsWithoutFingerPrint = list()
+        replacedTransactions = list()
+        for newTransaction in transactions:
+            fingerPrint = newTransaction.fingerPrint
+            if fingerPrint is None:
+                transactionsWithoutFingerPrint.append(newTransaction)
+                continue
+            oldTransaction = newTransactions.get(fingerPrint)
+            if oldTransaction is None:
+                oldTransaction = self.getTransactionByFingerPrint(fingerPrint)
+            if oldTransaction is not None:
+                try:
+                    if oldTransaction == newTransaction:
+                        logging.warning("Transaction already exists!")
+                        continue
+                except FingerprintMismatchError as e:
+                    logging.error(str(e) + "\nNote: Replacing old transaction with new to recover.")
+                    if self.getTransactionByFingerPrint(fingerPrint) is oldTransaction:
+                        replacedTransactions.append(oldTransaction)
+            newTransactions[fingerPrint] = newTransaction
 
+        for oldTransaction in replacedTransactions:
+            self.transactionSet.remove(oldTransaction)
+            self.unindexTransaction(oldTransaction)
+        addedTransactions = list(newTransactions.values()) + transactionsWithoutFingerPrint
+        self.transactionSet.update(addedTransactions)
+        self.indexTransactions(addedTransactions)
+        logging.debug(f"Added {len(addedTransactions)} transactions to the ledger")
+
+    @readLocked
+    def getTransactions(self, *args, **kwargs) -> set[Transaction]:
+        return set(self.cachedQuery("getTransactions", lambda : frozenset(self.planQuery(*args, **kwargs).execute()), args, kwargs))
+
+    # Lazy version of getTransactions, taking the same filters (see transactionQuery.py)
+    def query(self, *args, **kwargs) -> TransactionQuery:
+        return TransactionQuery(self, self.getFilters(args, kwargs))
+
+    # Builds a QueryPlan for the given filters. Filters that are None are dropped
+    # entirely. Of the remaining ones, every filter that can be answered from an index
+    # is a candidate source, as are the partitions that can match all the filters, and
+    # the one expected to yield the fewest transactions is iterated over. All other
+    # filters (and the source filter, when the source is only an approximation of it)
+    # are checked as predicates in the same pass.
+    #
+    # If orderedByDate, the date index is always the source, so that the plan yields the
+    # transactions in order of date.
+    @readLocked
+    def planQuery(self,
+                  timeRange = None,
+                  requiredCategory = None,
+                  forbiddenCategory = None,
+                  allowedCategories = None,
+                  requiredTags = None,
+                  forbiddenTags = None,
+                  allowedTags = None,
+                  requiredCounterParty = None,
+                  forbiddenCounterParty = None,
+                  allowedCounterParties = None,
+                  orderedByDate = False) -> QueryPlan:
+        nTransactions = len(self.transactionSet)
+        sourceCandidates = list()
+        predicates = list()
+        requiredAliases = forbiddenAliases = allowedAliases = None
+        dateSource = (nTransactions, lambda : [self.dateIndex.transactions], None)
+
+        def addSource(expectedSize, getSources, exactPredicate):
+            sourceCandidates.append((expectedSize, getSources, exactPredicate))
+
+        def addPredicate(expectedSize, predicate):
+            predicates.append((expectedSize, predicate))
+            return predicate
+
+        if timeRange is not None:
+            start, end = timeRange.start, timeRange.end
+            first, last = self.dateIndex.getRangeBounds(start, end)
+            size = max(last - first, 0)
+            predicate = addPredicate(size, lambda transaction : start <= transaction.getDate() <= end)
+            addSource(size, lambda : [self.dateIndex.transactions[first:last]], predicate)
+            dateSource = sourceCandidates[-1]
+
+        if requiredCategory is not None:
+            size = self.categoryIndex.getSize(requiredCategory)
+            predicate = addPredicate(size, lambda transaction : transaction.getCategory() == requiredCategory)
+            addSource(size, lambda : [self.categoryIndex.getBucket(requiredCategory)], predicate)
+
+        if forbiddenCategory is not None:
+            size = nTransactions - self.categoryIndex.getSize(forbiddenCategory)
+            addPredicate(size, lambda transaction : transaction.getCategory() != forbiddenCategory)
+
+        if allowedCategories is not None:
+            allowedCategorySet = set(allowedCategories)
+            size = sum(self.categoryIndex.getSize(category) for category in allowedCategorySet)
+            predicate = addPredicate(size, lambda transaction : transaction.getCategory() in allowedCategorySet)
+            addSource(size, lambda : [self.categoryIndex.getBucket(category) for category in allowedCategorySet], predicate)
+
+        if requiredTags:
+            requiredTagSet = set(requiredTags)
+            smallestTag = min(requiredTagSet, key = self.tagIndex.getSize)
+            size = self.tagIndex.getSize(smallestTag)
+            predicate = addPredicate(size, lambda transaction : self.isAllRequiredTagsPresentInTags(requiredTagSet, transaction.tags))
+            addSource(size, lambda : [self.tagIndex.getBucket(smallestTag)], predicate if len(requiredTagSet) == 1 else None)
+
+        if forbiddenTags is not None:
+            forbiddenTagSet = set(forbiddenTags)
+            size = max(nTransactions - sum(self.tagIndex.getSize(tag) for tag in forbiddenTagSet), 0)
+            addPredicate(size, lambda transaction : self.isNoForbiddenTagsPresentInTags(forbiddenTagSet, transaction.tags))
+
+        if allowedTags is not None:
+            allowedTagSet = set(allowedTags)
+            size = max(nTransactions - sum(self.tagIndex.getSize(tag) for tag in self.tagIndex.getKeys() if tag not in allowedTagSet), 0)
+            addPredicate(size, lambda transaction : self.isAllTagsAllowed(allowedTagSet, transaction.tags))
+
+        if requiredCounterParty is not None:
+            counterParty = CounterPartyDataBase().getCounterParty(requiredCounterParty)
+            requiredAliases = set(self.getIndexedAliasesOfCounterParties({counterParty}))
+            size = sum(self.counterPartyIndex.getSize(alias) for alias in requiredAliases)
+            predicate = addPredicate(size, lambda transaction : transaction.counterPartyAlias in requiredAliases)
+            addSource(size, lambda : [self.counterPartyIndex.getBucket(alias) for alias in requiredAliases], predicate)
+
+        if forbiddenCounterParty is not None:
+            forbiddenAliases = set(self.getIndexedAliasesOfCounterParties({CounterPartyDataBase().getCounterParty(forbiddenCounterParty)}))
+            size = nTransactions - sum(self.counterPartyIndex.getSize(alias) for alias in forbiddenAliases)
+            addPredicate(size, lambda transaction : transaction.counterPartyAlias not in forbiddenAliases)
+
+        if allowedCounterParties is not None:
+            counterParties = {CounterPartyDataBase().getCounterParty(counterPartyAlias) for counterPartyAlias in allowedCounterParties}
+            allowedAliases = set(self.getIndexedAliasesOfCounterParties(counterParties))
+            size = sum(self.counterPartyIndex.getSize(alias) for alias in allowedAliases)
+            predicate = addPredicate(size, lambda transaction : transaction.counterPartyAlias in allowedAliases)
+            addSource(size, lambda : [self.counterPartyIndex.getBucket(alias) for alias in allowedAliases], predicate)
+
+        partitions = self.partitionIndex.getMatchingPartitions(timeRange = timeRange,
+                                                               requiredCategory = requiredCategory,
+                                                               forbiddenCategory = forbiddenCategory,
+                                                               allowedCategories = allowedCategories,
+                                                               requiredTags = requiredTags,
+                                                               requiredCounterPartyAliases = requiredAliases,
+                                                               forbiddenCounterPartyAliases = forbiddenAliases,
+                                                               allowedCounterPartyAliases = allowedAliases)
+        if len(partitions) == len(self.partitionIndex.keyToPartition):
+            addSource(nTransactions, lambda : [self.transactionSet], None)
+        else:
+            addSource(sum(partition.getSize() for partition in partitions), lambda : [partition.transactions for partition in partitions], None)
+
+        if orderedByDate:
+            sourceSize, getSources, sourcePredicate = dateSource
+        else:
+            sourceSize, getSources, sourcePredicate = min(sourceCandidates, key = lambda candidate : candidate[0])
+        sources = getSources()
+
+        if sourceSize == 0:
+            return QueryPlan(list(), 0, list())
+
+        predicates.sort(key = lambda expectedSizeAndPredicate : expectedSizeAndPredicate[0])
+        return QueryPlan(sources,
+                         sourceSize,
+                         [predicate for _, predicate in predicates if predicate is not sourcePredicate])
+
+    @readLocked
     def getAllTransactionsInTimeRange(self, timeRange) -> list[Transaction]:
         if timeRange is None:
             return self.transactionSet.copy()
-        return {transaction for transaction in self.transactionSet if timeRange.start <= transaction.getDate() <= timeRange.end}
+        return self.dateIndex.getRange(timeRange.start, timeRange.end)
 
+    @readLocked
     def getAllTransactionsWithCategory(self, category) -> list[Transaction]:
         if category is None:
             return self.transactionSet.copy()
-        return {transaction for transaction in self.transactionSet if transaction.getCategory() == category}
+        return self.categoryIndex.get(category)
 
+    @readLocked
     def getAllTransactionsWithoutCategory(self, category) -> list[Transaction]:
         if category is None:
             return self.transactionSet.copy()
-        return {transaction for transaction in self.transactionSet if transaction.getCategory() != category}
+        return self.transactionSet - self.categoryIndex.getBucket(category)
 
+    @readLocked
     def getAllTransactionsInCategories(self, categories) -> list[Transaction]:
         if categories is None:
             return self.transactionSet.copy()
-        return {transaction for transaction in self.transactionSet if transaction.getCategory() in categories}
+        return self.categoryIndex.getUnion(set(categories))
 
+    @readLocked
     def getAllTransactionsWithRequiredTags(self, tags) -> list[Transaction]:
-        if tags is None:
+        if tags is None or not tags:
             return self.transactionSet.copy()
-        return {transaction for transaction in self.transactionSet if self.isAllRequiredTagsPresentInTags(tags, transaction.tags)}
+        return self.tagIndex.getIntersection(set(tags))
 
     def isAllRequiredTagsPresentInTags(self, requiredTags, tags) -> bool:
         for requiredTag in requiredTags:
@@ -96,10 +697,11 @@ class Ledger:
                 return False
         return True
 
+    @readLocked
     def getAllTransactionsWithoutTags(self, tags) -> list[Transaction]:
         if tags is None:
             return self.transactionSet.copy()
-        return {transaction for transaction in self.transactionSet if self.isNoForbiddenTagsPresentInTags(tags, transaction.tags)}
+        return self.transactionSet - self.tagIndex.getUnion(set(tags))
 
     def isNoForbiddenTagsPresentInTags(self, forbidenTags, tags) -> bool:
         for forbiddenTag in forbidenTags:
@@ -107,10 +709,15 @@ class Ledger:
                 return False
         return True
 
+    # A transaction only has allowed tags if it isn't in the bucket of any tag outside
+    # of the allowed ones
+    @readLocked
     def getAllTransactionsWithAllowedTags(self, tags) -> list[Transaction]:
         if tags is None:
             return self.transactionSet.copy()
-        return {transaction for transaction in self.transactionSet if self.isAllTagsAllowed(tags, transaction.tags)}
+        allowedTags = set(tags)
+        disallowedTags = [tag for tag in self.tagIndex.getKeys() if tag not in allowedTags]
+        return self.transactionSet - self.tagIndex.getUnion(disallowedTags)
 
     def isAllTagsAllowed(self, allowedTags, tags) -> bool:
         for tag in tags:
@@ -118,29 +725,493 @@ class Ledger:
                 return False
         return True
 
+    @readLocked
     def getAllTransactionsWithCounterParty(self, counterPartyAlias) -> list[Transaction]:
         if counterPartyAlias is None:
             return self.transactionSet.copy()
         counterParty = CounterPartyDataBase().getCounterParty(counterPartyAlias)
-        return {transaction for transaction in self.transactionSet if CounterPartyDataBase().getCounterParty(transaction.counterPartyAlias) == counterParty}
+        return self.counterPartyIndex.getUnion(self.getIndexedAliasesOfCounterParties({counterParty}))
 
+    @readLocked
     def getAllTransactionsWithoutCounterParty(self, counterPartyAlias) -> list[Transaction]:
         if counterPartyAlias is None:
             return self.transactionSet.copy()
         counterParty = CounterPartyDataBase().getCounterParty(counterPartyAlias)
-        return {transaction for transaction in self.transactionSet if CounterPartyDataBase().getCounterParty(transaction.counterPartyAlias) != counterParty}
+        return self.transactionSet - self.counterPartyIndex.getUnion(self.getIndexedAliasesOfCounterParties({counterParty}))
 
+    @readLocked
     def getAllTransactionsInCounterParties(self, counterPartyAliases) -> list[Transaction]:
         if counterPartyAliases is None:
             return self.transactionSet.copy()
         counterParties = {CounterPartyDataBase().getCounterParty(counterPartyAlias) for counterPartyAlias in counterPartyAliases}
-        return {transaction for transaction in self.transactionSet if CounterPartyDataBase().getCounterParty(transaction.counterPartyAlias) in counterParties}
+        return self.counterPartyIndex.getUnion(self.getIndexedAliasesOfCounterParties(counterParties))
+
+    # The counter party index is keyed on the alias stored on each transaction. Which
+    # counter party an alias resolves to is up to the counter party database (and may
+    # change when it is updated), so we resolve the (few) distinct indexed aliases at
+    # query time rather than resolving every transaction. Counter parties are matched by
+    # id (see CounterPartyDataBase), not compared field by field
+    @readLocked
+    def getIndexedAliasesOfCounterParties(self, counterParties) -> list:
+        aliasesOfCounterPartyId = self.getIndexedAliasesByCounterPartyId()
+        return [alias for counterPartyId in {counterParty.id for counterParty in counterParties} for alias in aliasesOfCounterPartyId.get(counterPartyId, ())]
+
+    # The indexed aliases of every counter party, by id. Kept until either the ledger or
+    # the counter party database changes, and replaced in one go so concurrent readers
+    # never see it half built
+    def getIndexedAliasesByCounterPartyId(self) -> dict:
+        stamp, aliasesOfCounterPartyId = self.indexedAliases
+        if stamp == (self.generation, CounterPartyDataBase.generation):
+            return aliasesOfCounterPartyId
+        counterPartyDataBase = CounterPartyDataBase()
+        with counterPartyDataBase.lock:
+            aliasesOfCounterPartyId = dict()
+            for alias in self.counterPartyIndex.getKeys():
+                aliasesOfCounterPartyId.setdefault(counterPartyDataBase.getCounterParty(alias).id, []).append(alias)
+            # read after resolving, since resolving an unknown alias adds it
+            type(self).indexedAliases = ((self.generation, CounterPartyDataBase.generation), aliasesOfCounterPartyId)
+        return aliasesOfCounterPartyId
+
+    # Totals for every category, tag or counter party (by name) among the transactions
+    # matching the given filters (same as for getTransactions), computed in a single pass.
+    # A transaction with several tags counts towards the totals of each of its tags.
+    @readLocked
+    def aggregateBy(self, dimension, *args, **kwargs) -> dict[str, Totals]:
+        if dimension not in DIMENSIONS:
+            raise UnknownDimensionError(f"Can't aggregate by '{dimension}'. Dimension must be one of {DIMENSIONS}")
+        totals = self.cachedQuery(("aggregateBy", dimension), lambda : self.computeAggregateBy(dimension, *args, **kwargs), args, kwargs)
+        return {key : Totals(keyTotals.liquidityChange, keyTotals.capitalChange) for key, keyTotals in totals.items()}
+
+    # The n transactions matching the filters (same as for getTransactions) with the
+    # largest key (or smallest, unless largest), in order. The key is the name of a field
+    # or a function, same as for TransactionQuery.orderBy. E.g. the 10 largest expenses:
+    #
+    #       Ledger().topTransactions(10, LIQUIDITY_CHANGE, largest = False)
+    #
+    # The transactions are selected with a heap of n, or from the columnar store (when
+    # enabled and the key is an amount), rather than by sorting every transaction. No
+    # transactions are selected if n isn't positive.
+    @readLocked
+    def topTransactions(self, n, key = LIQUIDITY_CHANGE, *args, largest = True, **kwargs) -> list[Transaction]:
+        if n <= 0:
+            return list()
+        if self.columnarStore is not None and not callable(key) and key in AMOUNTS:
+            return self.columnarStore.getTopTransactions(self.getColumnarMask(*args, **kwargs), key, n, largest)
+        return self.query(*args, **kwargs).orderBy(key, descending = largest).limit(n).materialize()
+
+    # The n categories, tags or counter parties (see aggregateBy) with the largest total
+    # of the metric (one of transactionQuery.AMOUNTS), or smallest unless largest, among
+    # the transactions matching the filters. Returned as (key, Totals) pairs, in order.
+    # E.g. the 5 counter parties with the most spent:
+    #
+    #       Ledger().topGroups(5, COUNTER_PARTY, LIQUIDITY_CHANGE, largest = False)
+    @readLocked
+    def topGroups(self, n, dimension, metric = LIQUIDITY_CHANGE, *args, largest = True, **kwargs) -> list[tuple[str, Totals]]:
+        if metric not in AMOUNTS:
+            raise UnknownAmountError(f"Can't rank groups by '{metric}'. Metric must be one of {AMOUNTS}")
+        totals = self.aggregateBy(dimension, *args, **kwargs)
+        getMetric = lambda keyAndTotals : ORDER_KEYS[metric](keyAndTotals[1])
+        if largest:
+            return heapq.nlargest(n, totals.items(), key = getMetric)
+        return heapq.nsmallest(n, totals.items(), key = getMetric)
+
+    def computeAggregateBy(self, dimension, *args, **kwargs) -> dict[str, Totals]:
+        if self.columnarStore is not None:
+            return self.aggregateColumnsBy(dimension, *args, **kwargs)
+        totals = self.aggregateInParallel(dimension, *args, **kwargs)
+        if totals is not None:
+            return totals
+        counterPartyNames = dict()
+        totals = dict()
+        for transaction in self.planQuery(*args, **kwargs).iterate():
+            for key in self.getDimensionKeys(transaction, dimension, counterPartyNames):
+                if key not in totals:
+                    totals[key] = Totals()
+                totals[key].add(transaction)
+        return totals
+
+    # The keys of the dimension (see aggregateBy) the transaction counts towards. Counter
+    # party names are looked up once per alias, and kept in counterPartyNames
+    def getDimensionKeys(self, transaction, dimension, counterPartyNames):
+        if dimension is None:
+            return [None]
+        if dimension == CATEGORY:
+            return [transaction.getCategory()]
+        if dimension == TAG:
+            return set(transaction.getTags())
+        alias = transaction.counterPartyAlias
+        if alias not in counterPartyNames:
+            counterPartyNames[alias] = CounterPartyDataBase().getCounterParty(alias).name
+        return [counterPartyNames[alias]]
+
+    def aggregateColumnsBy(self, dimension, *args, **kwargs) -> dict[str, Totals]:
+        mask = self.getColumnarMask(*args, **kwargs)
+        if dimension == CATEGORY:
+            liquidityTotals, capitalTotals = self.columnarStore.getTotalsByCategory(mask)
+        elif dimension == TAG:
+            liquidityTotals, capitalTotals = self.columnarStore.getTotalsByTag(mask)
+        else:
+            liquidityTotals, capitalTotals = self.columnarStore.getTotalsByCounterPartyAlias(mask)
+        totals = dict()
+        for key in liquidityTotals:
+            if dimension == COUNTER_PARTY:
+                keyTotals = Totals(liquidityTotals[key], capitalTotals[key])
+                key = CounterPartyDataBase().getCounterParty(key).name
+                if key in totals:
+                    keyTotals.liquidityChangeMinor += totals[key].liquidityChangeMinor
+                    keyTotals.capitalChangeMinor += totals[key].capitalChangeMinor
+                totals[key] = keyTotals
+            else:
+                totals[key] = Totals(liquidityTotals[key], capitalTotals[key])
+        return totals
 
+    # Liquidity and capital change per day, week, month or year (see timeSeries.py) of the
+    # transactions matching the filters (same as for getTransactions), optionally split by
+    # category, tag or counter party (same as aggregateBy), computed in a single pass. The
+    # periods span the time range of the query, or the matching transactions if it has
+    # none. E.g. the monthly totals of every category in 2025:
+    #
+    #       Ledger().resample(MONTH, CATEGORY, timeRange = TimeRange(datetime(2025, 1, 1), datetime(2025, 12, 31, 23, 59)))
+    @readLocked
+    def resample(self, frequency, dimension = None, *args, **kwargs) -> TimeSeries:
+        checkFrequency(frequency)
+        if dimension is not None and dimension not in DIMENSIONS:
+            raise UnknownDimensionError(f"Can't resample by '{dimension}'. Dimension must be None or one of {DIMENSIONS}")
+        timeSeries = self.cachedQuery(("resample", frequency, dimension), lambda : self.computeResample(frequency, dimension, *args, **kwargs), args, kwargs)
+        return timeSeries.copy()
+
+    def computeResample(self, frequency, dimension, *args, **kwargs) -> TimeSeries:
+        if self.columnarStore is not None:
+            return self.resampleColumns(frequency, dimension, *args, **kwargs)
+        counterPartyNames = dict()
+        # totals by (period start, key), until the periods are known
+        periodTotals = dict()
+        periodStarts = set()
+        for transaction in self.planQuery(*args, **kwargs).iterate():
+            periodStart = getPeriodStart(transaction.getDate(), frequency)
+            periodStarts.add(periodStart)
+            for key in self.getDimensionKeys(transaction, dimension, counterPartyNames):
+                totals = periodTotals.get((periodStart, key))
+                if totals is None:
+                    totals = periodTotals[(periodStart, key)] = Totals()
+                totals.add(transaction)
+
+        timeRange = self.getFilters(args, kwargs).get("timeRange")
+        if timeRange is not None:
+            periods = getPeriods(timeRange.start, timeRange.end, frequency)
+        elif periodStarts:
+            # spanning every matching transaction, even those without a key (e.g. no tags)
+            periods = getPeriods(min(periodStarts), max(periodStarts), frequency)
+        else:
+            periods = list()
+        timeSeries = TimeSeries(frequency, periods, dimension)
+        periodOfStart = {periodStart : period for period, periodStart in enumerate(periods)}
+        for (periodStart, key), totals in periodTotals.items():
+            timeSeries.add(key, periodOfStart[periodStart], totals.liquidityChange, totals.capitalChange)
+        return timeSeries
+
+    def resampleColumns(self, frequency, dimension, *args, **kwargs) -> TimeSeries:
+        mask = self.getColumnarMask(*args, **kwargs)
+        timeRange = self.getFilters(args, kwargs).get("timeRange")
+        if timeRange is not None:
+            periods = getPeriods(timeRange.start, timeRange.end, frequency)
+        else:
+            dateRange = self.columnarStore.getDateRange(mask)
+            periods = list() if dateRange is None else getPeriods(*dateRange, frequency)
+        timeSeries = TimeSeries(frequency, periods, dimension)
+        if not periods:
+            return timeSeries
+        totals = self.columnarStore.getTotalsByPeriod(mask, frequency, periods[0], len(periods), GROUP_BY_OF_DIMENSION[dimension])
+        for key, (liquidityChanges, capitalChanges) in totals.items():
+            if dimension == COUNTER_PARTY:
+                key = CounterPartyDataBase().getCounterParty(key).name
+            timeSeries.addSeries(key, liquidityChanges, capitalChanges)
+        return timeSeries
+
+    # Same filters as getTransactions, translated to a row mask over the columnar store
+    def getColumnarMask(self, *args, **kwargs):
+        return self.columnarStore.getMask(**self.getResolvedFilters(*args, **kwargs))
+
+    # Same filters as getTransactions, but with the counter party filters resolved into
+    # the sets of indexed counter party aliases they match, for the parts of the ledger
+    # that have no access to the counter party database (or shouldn't look up every row
+    # in it). Filters that are None are left out
+    def getResolvedFilters(self,
+                           timeRange = None,
+                           requiredCategory = None,
+                           forbiddenCategory = None,
+                           allowedCategories = None,
+                           requiredTags = None,
+                           forbiddenTags = None,
+                           allowedTags = None,
+                           requiredCounterParty = None,
+                           forbiddenCounterParty = None,
+                           allowedCounterParties = None) -> dict:
+        def getIndexedAliases(counterPartyAliases):
+            if counterPartyAliases is None:
+                return None
+            counterParties = {CounterPartyDataBase().getCounterParty(counterPartyAlias) for counterPartyAlias in counterPartyAliases}
+            return set(self.getIndexedAliasesOfCounterParties(counterParties))
+        filters = {"timeRange"                    : timeRange,
+                   "requiredCategory"             : requiredCategory,
+                   "forbiddenCategory"            : forbiddenCategory,
+                   "allowedCategories"            : None if allowedCategories is None else set(allowedCategories),
+                   "requiredTags"                 : None if requiredTags is None else set(requiredTags),
+                   "forbiddenTags"                : None if forbiddenTags is None else set(forbiddenTags),
+                   "allowedTags"                  : None if allowedTags is None else set(allowedTags),
+                   "requiredCounterPartyAliases"  : getIndexedAliases(None if requiredCounterParty is None else [requiredCounterParty]),
+                   "forbiddenCounterPartyAliases" : getIndexedAliases(None if forbiddenCounterParty is None else [forbiddenCounterParty]),
+                   "allowedCounterPartyAliases"   : getIndexedAliases(allowedCounterParties)}
+        return {name : value for name, value in filters.items() if value is not None}
+
+    # Totals of the transactions matching the filters, per value of the dimension (or all
+    # under None), computed by the parallel aggregator. None if parallel aggregation is
+    # disabled, not worthwhile for this query, or fails, or if the ledger has changed
+    # since it was last snapshotted and it isn't yet time to snapshot it again (see
+    # parallelAggregation.py)
+    def aggregateInParallel(self, dimension, *args, **kwargs) -> dict:
+        if self.parallelAggregator is None:
+            return None
+        filters = self.getResolvedFilters(*args, **kwargs)
+        partitions = self.partitionIndex.getMatchingPartitions(**filters)
+        size = sum(partition.getSize() for partition in partitions)
+        if not self.parallelAggregator.isWorthwhile(size):
+            return None
+        groupBy = GROUP_BY_OF_DIMENSION[dimension]
+        with self.parallelAggregator.lock:
+            try:
+                if not self.parallelAggregator.prepareSnapshot(self.transactionSet, self.generation, size):
+                    return None
+            except SnapshotError as e:
+                logging.warning(f"Can't aggregate the ledger in parallel, falling back to serial execution: {e}")
+                return None
+            partials = self.parallelAggregator.aggregate(filters, groupBy)
+        if partials is None:
+            return None
+        totals = dict()
+        for key, (liquidityChange, capitalChange) in partials.items():
+            if dimension == COUNTER_PARTY:
+                key = CounterPartyDataBase().getCounterParty(key).name
+            if key not in totals:
+                totals[key] = Totals()
+            totals[key].liquidityChangeMinor += liquidityChange
+            totals[key].capitalChangeMinor += capitalChange
+        return totals
+
+    def getTotalsInParallel(self, *args, **kwargs) -> Totals:
+        totals = self.aggregateInParallel(None, *args, **kwargs)
+        if totals is None:
+            return None
+        return totals.get(None, Totals())
+
+    # The daily rollup keeps the totals of every day (in minor units), for the whole
+    # ledger, per category and per (stored) counter party alias
+    def getRollupKeys(self, transaction) -> list:
+        return [ALL_TRANSACTIONS,
+                (CATEGORY, transaction.getCategory()),
+                (COUNTER_PARTY, transaction.counterPartyAlias)]
+
+    # The rollup keys of the transactions with the required category, or counter party
+    # (any of its indexed aliases), or of all transactions if neither is given
+    def getRollupKeysOfFilters(self, requiredCategory = None, requiredCounterParty = None) -> list:
+        if requiredCategory is not None:
+            return [(CATEGORY, requiredCategory)]
+        if requiredCounterParty is not None:
+            counterParty = CounterPartyDataBase().getCounterParty(requiredCounterParty)
+            return [(COUNTER_PARTY, alias) for alias in set(self.getIndexedAliasesOfCounterParties({counterParty}))]
+        return [ALL_TRANSACTIONS]
+
+    # Totals for queries filtering on at most a time range and one of required category or
+    # required counter party can be answered from the daily rollup in O(log n). Days that
+    # are only partly covered by the time range (the first and last) are summed from the
+    # date index instead. For other queries, this returns None.
+    @readLocked
+    def getTotalsFromRollup(self, *args, **kwargs) -> Totals:
+        filters = self.getFilters(args, kwargs)
+        if not set(filters) <= {"timeRange", "requiredCategory", "requiredCounterParty"}:
+            return None
+        if "requiredCategory" in filters and "requiredCounterParty" in filters:
+            return None
+
+        keys = self.getRollupKeysOfFilters(filters.get("requiredCategory"), filters.get("requiredCounterParty"))
+        if "requiredCategory" in filters:
+            category = filters["requiredCategory"]
+            isOfKeys = lambda transaction : transaction.getCategory() == category
+        elif "requiredCounterParty" in filters:
+            aliases = {alias for _, alias in keys}
+            isOfKeys = lambda transaction : transaction.counterPartyAlias in aliases
+        else:
+            isOfKeys = lambda transaction : True
+
+        totals = Totals()
+        timeRange = filters.get("timeRange")
+        if timeRange is None:
+            for key in keys:
+                liquidityChange, capitalChange = self.dailyRollup.getTotals(key)
+                totals.liquidityChangeMinor += liquidityChange
+                totals.capitalChangeMinor += capitalChange
+            return totals
+        if timeRange.end < timeRange.start:
+            return totals
+
+        startDay = timeRange.start.toordinal()
+        endDay = timeRange.end.toordinal()
+        if startDay == endDay:
+            partialDays = [self.dateIndex.getTransactionsInRange(timeRange.start, timeRange.end)]
+        else:
+            for key in keys:
+                liquidityChange, capitalChange = self.dailyRollup.getTotals(key, startDay + 1, endDay - 1)
+                totals.liquidityChangeMinor += liquidityChange
+                totals.capitalChangeMinor += capitalChange
+            partialDays = [self.dateIndex.getHalfOpenRange(timeRange.start, datetime.datetime.fromordinal(startDay + 1)),
+                           self.dateIndex.getTransactionsInRange(datetime.datetime.fromordinal(endDay), timeRange.end)]
+        for transactions in partialDays:
+            for transaction in transactions:
+                if isOfKeys(transaction):
+                    totals.add(transaction)
+        return totals
+
+    # Totals over the trailing window of windowDays whole days ending on (and including)
+    # the day of end, of one category or counter party, or of the whole ledger. E.g. the
+    # grocery spending of the last 30 days:
+    #
+    #       Ledger().getRollingTotals(30, datetime.datetime.now(), requiredCategory = "groceries")
+    #
+    # Answered from the daily rollup, which is kept up to date as transactions are added,
+    # so no transactions are looked at.
+    @readLocked
+    def getRollingTotals(self, windowDays, end, requiredCategory = None, requiredCounterParty = None) -> Totals:
+        series = self.rolling(windowDays, end, end, requiredCategory, requiredCounterParty)
+        return Totals(series.getLiquidityChanges()[0], series.getCapitalChanges()[0])
+
+    # getRollingTotals for every day from the day of start up to and including the day of
+    # end, as a daily time series (see timeSeries.py). Windows are slid from one day to the
+    # next rather than summed from scratch, so this is O(1) per day after the first
+    @readLocked
+    def rolling(self, windowDays, start, end, requiredCategory = None, requiredCounterParty = None) -> TimeSeries:
+        if requiredCategory is not None and requiredCounterParty is not None:
+            raise RollingWindowError("Rolling totals are kept per category and per counter party, not for both at once")
+        keys = self.getRollupKeysOfFilters(requiredCategory, requiredCounterParty)
+        liquidityChanges, capitalChanges = self.dailyRollup.getRollingTotals(keys, windowDays, start.toordinal(), end.toordinal())
+        timeSeries = TimeSeries(DAY, getPeriods(start, end, DAY))
+        timeSeries.addSeries(None,
+                             [fromMinorUnits(liquidityChange) for liquidityChange in liquidityChanges],
+                             [fromMinorUnits(capitalChange) for capitalChange in capitalChanges])
+        return timeSeries
+
+    # Moving averages per day of the rolling totals (see rolling), i.e. the average daily
+    # change over the trailing window of windowDays ending on each day
+    @readLocked
+    def getMovingAverages(self, windowDays, start, end, requiredCategory = None, requiredCounterParty = None) -> TimeSeries:
+        rollingTotals = self.rolling(windowDays, start, end, requiredCategory, requiredCounterParty)
+        timeSeries = TimeSeries(DAY, rollingTotals.periods)
+        timeSeries.addSeries(None,
+                             [liquidityChange / windowDays for liquidityChange in rollingTotals.getLiquidityChanges()],
+                             [capitalChange / windowDays for capitalChange in rollingTotals.getCapitalChanges()])
+        return timeSeries
+
+    # The sketches (see sketches.py) keep the distribution of liquidity changes for the
+    # whole ledger, per category, per (stored) counter party alias and per month, and the
+    # distinct counter parties for the whole ledger, per category and per month
+    def addToSketches(self, sketchIndex, transaction):
+        date = transaction.getDate()
+        month = (MONTH, (date.year, date.month))
+        quantileKeys = self.getRollupKeys(transaction) + [month]
+        distinctCountKeys = [ALL_TRANSACTIONS, (CATEGORY, transaction.getCategory()), month]
+        sketchIndex.add(quantileKeys, distinctCountKeys, transaction.getLiquidityChange(), transaction.counterPartyAlias)
+
+    # The sketch index, rebuilt from the transactions in the ledger if it has gone stale.
+    # The new index replaces the old one in one go, so concurrent readers never see a
+    # half built index
+    def getSketchIndex(self) -> SketchIndex:
+        sketchIndex = self.sketchIndex
+        if sketchIndex.isStale():
+            logging.debug(f"Rebuilding stale sketches of {len(self.transactionSet)} transactions")
+            sketchIndex = SketchIndex(sketchIndex.k, sketchIndex.precision)
+            for transaction in self.transactionSet:
+                self.addToSketches(sketchIndex, transaction)
+            type(self).sketchIndex = sketchIndex
+        return sketchIndex
+
+    # Sketches can only be queried for the whole ledger or a single category, counter
+    # party or month (any date in it)
+    def getSketchKeys(self, requiredCategory, requiredCounterParty, month) -> list:
+        if sum(value is not None for value in (requiredCategory, requiredCounterParty, month)) > 1:
+            raise SketchError("Sketches are kept per category, per counter party and per month, not for combinations of them")
+        if month is not None:
+            return [(MONTH, (month.year, month.month))]
+        return self.getRollupKeysOfFilters(requiredCategory, requiredCounterParty)
+
+    # Approximate liquidity changes at the given quantiles (each between 0 and 1) of the
+    # transactions of the whole ledger, a category, a counter party or a month, from
+    # streaming sketches rather than by sorting the transactions. Expenses are negative, so
+    # e.g. the median and 95th percentile expense of a category are:
+    #
+    #       Ledger().getQuantiles([0.5, 0.05], requiredCategory = "groceries")
+    #
+    # Each value's rank is within about 1.7% of the number of transactions of the asked
+    # rank (see sketches.KllSketch). None for each quantile if there are no transactions
+    @readLocked
+    def getQuantiles(self, quantiles, requiredCategory = None, requiredCounterParty = None, month = None) -> list:
+        sketch = self.getSketchIndex().getQuantileSketch(self.getSketchKeys(requiredCategory, requiredCounterParty, month))
+        if sketch is None:
+            return [None for _ in quantiles]
+        return sketch.getQuantiles(quantiles)
+
+    def getQuantile(self, quantile, requiredCategory = None, requiredCounterParty = None, month = None):
+        return self.getQuantiles([quantile], requiredCategory, requiredCounterParty, month)[0]
+
+    # Approximate number of distinct counter parties of the transactions of the whole
+    # ledger, a category or a month, within about 1.6% (standard error, see
+    # sketches.HyperLogLog)
+    @readLocked
+    def getDistinctCounterPartyCount(self, requiredCategory = None, month = None) -> int:
+        sketch = self.getSketchIndex().getDistinctCountSketch(self.getSketchKeys(requiredCategory, None, month))
+        if sketch is None:
+            return 0
+        return sketch.getCount()
+
+    @readLocked
     def getTotalLiquidityChange(self, *args, **kwargs) -> list[Transaction]:
-        return sum([transaction.getLiquidityChange() for transaction in self.getTransactions(*args, **kwargs)])
+        return self.cachedQuery("getTotalLiquidityChange", lambda : self.computeTotalLiquidityChange(*args, **kwargs), args, kwargs)
 
+    @readLocked
     def getTotalCapitalChange(self, *args, **kwargs) -> list[Transaction]:
-        return sum([transaction.getCapitalChange() for transaction in self.getTransactions(*args, **kwargs)])
+        return self.cachedQuery("getTotalCapitalChange", lambda : self.computeTotalCapitalChange(*args, **kwargs), args, kwargs)
 
+    @readLocked
     def getTotalNetChange(self, *args, **kwargs) -> list[Transaction]:
-        return sum([transaction.getNetChange() for transaction in self.getTransactions(*args, **kwargs)])
+        return self.cachedQuery("getTotalNetChange", lambda : self.computeTotalNetChange(*args, **kwargs), args, kwargs)
+
+    def computeTotalLiquidityChange(self, *args, **kwargs) -> list[Transaction]:
+        totals = self.getTotalsFromRollup(*args, **kwargs)
+        if totals is not None:
+            return totals.getLiquidityChange()
+        if self.columnarStore is not None:
+            return self.columnarStore.getTotalLiquidityChange(self.getColumnarMask(*args, **kwargs))
+        totals = self.getTotalsInParallel(*args, **kwargs)
+        if totals is not None:
+            return totals.getLiquidityChange()
+        return fromMinorUnits(sum([transaction.getLiquidityChangeMinor() for transaction in self.planQuery(*args, **kwargs).iterate()]))
+
+    def computeTotalCapitalChange(self, *args, **kwargs) -> list[Transaction]:
+        totals = self.getTotalsFromRollup(*args, **kwargs)
+        if totals is not None:
+            return totals.getCapitalChange()
+        if self.columnarStore is not None:
+            return self.columnarStore.getTotalCapitalChange(self.getColumnarMask(*args, **kwargs))
+        totals = self.getTotalsInParallel(*args, **kwargs)
+        if totals is not None:
+            return totals.getCapitalChange()
+        return fromMinorUnits(sum([transaction.getCapitalChangeMinor() for transaction in self.planQuery(*args, **kwargs).iterate()]))
+
+    def computeTotalNetChange(self, *args, **kwargs) -> list[Transaction]:
+        totals = self.getTotalsFromRollup(*args, **kwargs)
+        if totals is not None:
+            return totals.getNetChange()
+        if self.columnarStore is not None:
+            return self.columnarStore.getTotalNetChange(self.getColumnarMask(*args, **kwargs))
+        totals = self.getTotalsInParallel(*args, **kwargs)
+        if totals is not None:
+            return totals.getNetChange()
+        return fromMinorUnits(sum([transaction.getNetChangeMinor() for transaction in self.planQuery(*args, **kwargs).iterate()]))
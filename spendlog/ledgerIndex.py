@@ -0,0 +1,259 @@
+from bisect import bisect_left, bisect_right
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+
+# Inverted index from some key (a category, a tag, a counter party alias, ...) to the
+# set of transactions that have that key. The ledger keeps one of these per field it
+# wants to be able to filter on without scanning every transaction.
+#
+# Buckets are never handed out directly (the ledger hands them to callers who are free
+# to mutate what they get), so get() returns a copy, while getBucket() returns the
+# bucket itself for internal use where we know it won't be modified.
+class TransactionIndex:
+    def __init__(self):
+        self.keyToTransactions = dict()
+
+    def add(self, key, transaction):
+        if key not in self.keyToTransactions:
+            self.keyToTransactions[key] = set()
+        self.keyToTransactions[key].add(transaction)
+
+    def remove(self, key, transaction):
+        bucket = self.keyToTransactions.get(key)
+        if bucket is None:
+            logging.warning(f"Tried to remove transaction from index key '{key}', which is not in the index")
+            return
+        bucket.discard(transaction)
+        if not bucket:
+            del self.keyToTransactions[key]
+
+    def get(self, key) -> set:
+        return self.getBucket(key).copy()
+
+    def getBucket(self, key) -> set:
+        return self.keyToTransactions.get(key, _EMPTY_BUCKET)
+
+    def getUnion(self, keys) -> set:
+        union = set()
+        for key in keys:
+            union |= self.getBucket(key)
+        return union
+
+    def getIntersection(self, keys) -> set:
+        buckets = sorted((self.getBucket(key) for key in keys), key = len)
+        intersection = buckets[0].copy()
+        for bucket in buckets[1:]:
+            intersection &= bucket
+        return intersection
+
+    def getKeys(self):
+        return self.keyToTransactions.keys()
+
+    def getSize(self, key) -> int:
+        return len(self.getBucket(key))
+
+    def clear(self):
+        self.keyToTransactions = dict()
+
+_EMPTY_BUCKET = frozenset()
+
+# Index of transactions sorted by date, so that the transactions in a time range can
+# be found by bisecting for the ends of the range, rather than by comparing the date
+# of every transaction in the ledger.
+#
+# dates and transactions are parallel lists: transactions[i] has date dates[i].
+class DateIndex:
+    def __init__(self):
+        self.dates = list()
+        self.transactions = list()
+
+    def add(self, transaction):
+        date = transaction.getDate()
+        position = bisect_right(self.dates, date)
+        self.dates.insert(position, date)
+        self.transactions.insert(position, transaction)
+
+    # Adding one by one costs O(n) per transaction (for moving the later entries), so many
+    # transactions are instead merged in with a single sort. The sort is stable and the
+    # existing entries are already sorted, so this is close to linear
+    def addAll(self, transactions):
+        if len(transactions) == 1:
+            self.add(transactions[0])
+            return
+        entries = list(zip(self.dates, self.transactions))
+        entries += [(transaction.getDate(), transaction) for transaction in transactions]
+        entries.sort(key = lambda entry : entry[0])
+        self.dates = [date for date, _ in entries]
+        self.transactions = [transaction for _, transaction in entries]
+
+    # The transaction is looked up by its date, unless given the date it was indexed
+    # under (if it has changed since)
+    def remove(self, transaction, date = None):
+        if date is None:
+            date = transaction.getDate()
+        start = bisect_left(self.dates, date)
+        end = bisect_right(self.dates, date)
+        for position in range(start, end):
+            if self.transactions[position] is transaction:
+                del self.dates[position]
+                del self.transactions[position]
+                return
+        logging.warning(f"Tried to remove transaction from date index, but it is not in the index: {transaction}")
+
+    def getRangeBounds(self, start, end) -> tuple[int, int]:
+        return bisect_left(self.dates, start), bisect_right(self.dates, end)
+
+    def getRange(self, start, end) -> set:
+        first, last = self.getRangeBounds(start, end)
+        return set(self.transactions[first:last])
+
+    def getTransactionsInRange(self, start, end) -> list:
+        first, last = self.getRangeBounds(start, end)
+        return self.transactions[first:last]
+
+    # The transactions from start up to, but not including, end
+    def getHalfOpenRange(self, start, end) -> list:
+        return self.transactions[bisect_left(self.dates, start):bisect_left(self.dates, end)]
+
+    def getRangeSize(self, start, end) -> int:
+        first, last = self.getRangeBounds(start, end)
+        return max(last - first, 0)
+
+    def clear(self):
+        self.dates = list()
+        self.transactions = list()
+
+MONTH = "month"
+YEAR = "year"
+PARTITION_GRANULARITIES = (MONTH, YEAR)
+
+class UnknownPartitionGranularityError(Exception):
+    pass
+
+# The transactions of one month (or year), along with what is needed to tell whether a
+# query can match any of them without looking at them: the first and last date, and how
+# many transactions have each category, (stored) counter party alias and tag.
+class Partition:
+    def __init__(self, key):
+        self.key = key
+        self.transactions = set()
+        self.categoryCounts = dict()
+        self.counterPartyAliasCounts = dict()
+        self.tagCounts = dict()
+        self.minDate = None
+        self.maxDate = None
+
+    def add(self, transaction):
+        self.transactions.add(transaction)
+        self.count(self.categoryCounts, transaction.getCategory(), 1)
+        self.count(self.counterPartyAliasCounts, transaction.counterPartyAlias, 1)
+        for tag in set(transaction.getTags()):
+            self.count(self.tagCounts, tag, 1)
+        date = transaction.getDate()
+        if self.minDate is None or date < self.minDate:
+            self.minDate = date
+        if self.maxDate is None or date > self.maxDate:
+            self.maxDate = date
+
+    def remove(self, transaction):
+        if transaction not in self.transactions:
+            logging.warning(f"Tried to remove transaction from partition {self.key}, but it is not in the partition: {transaction}")
+            return
+        self.transactions.discard(transaction)
+        self.count(self.categoryCounts, transaction.getCategory(), -1)
+        self.count(self.counterPartyAliasCounts, transaction.counterPartyAlias, -1)
+        for tag in set(transaction.getTags()):
+            self.count(self.tagCounts, tag, -1)
+        date = transaction.getDate()
+        if date == self.minDate or date == self.maxDate:
+            dates = [transaction.getDate() for transaction in self.transactions]
+            self.minDate = min(dates, default = None)
+            self.maxDate = max(dates, default = None)
+
+    def count(self, counts, key, delta):
+        counts[key] = counts.get(key, 0) + delta
+        if counts[key] == 0:
+            del counts[key]
+
+    def getSize(self) -> int:
+        return len(self.transactions)
+
+    # False if no transaction in the partition can match the given filters. The filters
+    # are those of Ledger.getTransactions, except that the counter party filters must
+    # already be resolved into the sets of stored counter party aliases they match.
+    # Forbidden and allowed tags are accepted, but never rule out a partition
+    def canMatch(self,
+                 timeRange = None,
+                 requiredCategory = None,
+                 forbiddenCategory = None,
+                 allowedCategories = None,
+                 requiredTags = None,
+                 forbiddenTags = None,
+                 allowedTags = None,
+                 requiredCounterPartyAliases = None,
+                 forbiddenCounterPartyAliases = None,
+                 allowedCounterPartyAliases = None) -> bool:
+        if not self.transactions:
+            return False
+        if timeRange is not None and (self.maxDate < timeRange.start or self.minDate > timeRange.end):
+            return False
+        if requiredCategory is not None and requiredCategory not in self.categoryCounts:
+            return False
+        if forbiddenCategory is not None and self.categoryCounts.keys() == {forbiddenCategory}:
+            return False
+        if allowedCategories is not None and self.categoryCounts.keys().isdisjoint(allowedCategories):
+            return False
+        if requiredTags and not all(tag in self.tagCounts for tag in requiredTags):
+            return False
+        if requiredCounterPartyAliases is not None and self.counterPartyAliasCounts.keys().isdisjoint(requiredCounterPartyAliases):
+            return False
+        if forbiddenCounterPartyAliases is not None and self.counterPartyAliasCounts.keys() <= forbiddenCounterPartyAliases:
+            return False
+        if allowedCounterPartyAliases is not None and self.counterPartyAliasCounts.keys().isdisjoint(allowedCounterPartyAliases):
+            return False
+        return True
+
+# The transactions split into one Partition per month or year (by date), so that
+# queries can skip whole partitions that can't match, rather than scan every year of
+# history.
+class PartitionIndex:
+    def __init__(self, granularity = MONTH):
+        if granularity not in PARTITION_GRANULARITIES:
+            raise UnknownPartitionGranularityError(f"Can't partition by '{granularity}'. Granularity must be one of {PARTITION_GRANULARITIES}")
+        self.granularity = granularity
+        self.clear()
+
+    def getKey(self, date) -> tuple:
+        if self.granularity == MONTH:
+            return date.year, date.month
+        return (date.year,)
+
+    def add(self, transaction):
+        key = self.getKey(transaction.getDate())
+        if key not in self.keyToPartition:
+            self.keyToPartition[key] = Partition(key)
+        self.keyToPartition[key].add(transaction)
+
+    def remove(self, transaction):
+        key = self.getKey(transaction.getDate())
+        partition = self.keyToPartition.get(key)
+        if partition is None:
+            logging.warning(f"Tried to remove transaction from partition {key}, which is not in the index")
+            return
+        partition.remove(transaction)
+        if not partition.transactions:
+            del self.keyToPartition[key]
+
+    def getPartition(self, key) -> Partition:
+        return self.keyToPartition.get(key)
+
+    def getPartitions(self) -> list[Partition]:
+        return [self.keyToPartition[key] for key in sorted(self.keyToPartition)]
+
+    # The partitions that may have transactions matching the given filters (see
+    # Partition.canMatch)
+    def getMatchingPartitions(self, **filters) -> list[Partition]:
+        return [partition for partition in self.keyToPartition.values() if partition.canMatch(**filters)]
+
+    def clear(self):
+        self.keyToPartition = dict()
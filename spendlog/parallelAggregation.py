@@ -0,0 +1,157 @@
+from spendlog.snapshot import Snapshot
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+DEFAULT_MINIMUM_SIZE = 100000
+
+# The snapshots opened by this (worker) process, by path
+openSnapshots = dict()
+
+def getSnapshot(path) -> Snapshot:
+    if path not in openSnapshots:
+        for snapshot in openSnapshots.values():
+            snapshot.close()
+        openSnapshots.clear()
+        openSnapshots[path] = Snapshot(path)
+    return openSnapshots[path]
+
+# Workers are never forked (see ParallelAggregator)
+def getWorkerContext():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+# Runs in a worker process. The partial totals (see Snapshot.aggregateRows) of the rows
+# firstRow up to, but not including, lastRow of the snapshot that match the filters
+def aggregateShard(path, firstRow, lastRow, filters, groupBy) -> dict:
+    snapshot = getSnapshot(path)
+    return snapshot.aggregateRows(snapshot.getMatchingRows(firstRow = firstRow, lastRow = lastRow, **filters), groupBy)
+
+# Aggregates a ledger in a pool of worker processes, and merges their partial totals.
+#
+# Rather than send the transactions to the workers with every query, the ledger is
+# written to a snapshot (see snapshot.py), which every worker memory maps. A query then
+# only sends its filters, and the range of rows each worker should aggregate. Rows are
+# sorted by date, so each worker gets a shard of contiguous dates (within the time range
+# of the query, if any).
+#
+# The snapshot is only written by a query that is run in parallel, and only if the
+# ledger has changed since it was last written. Writing it costs time proportional to
+# the whole ledger, so a stale snapshot isn't written again right away: queries run
+# serially (see prepareSnapshot) until the transactions they have gone through add up to
+# the size of the ledger, i.e. until they have done as much work as writing the
+# snapshot would. That way queries interleaved with ingest, which changes the ledger
+# between every query, don't each rewrite the snapshot, while a ledger that has stopped
+# changing is soon queried in parallel again.
+#
+# The pool is started the first time it is needed, and kept until shut down. Workers
+# are started with the forkserver (or spawn) method rather than forked from the ledger's
+# process, which may be threaded and a fork of which could inherit locks held by other
+# threads (e.g. the ledger's) and deadlock on them. Workers only need the path of the
+# snapshot, so nothing else is lost by not forking. Sending
+# queries to the workers is not free, so queries over fewer than minimumSize
+# transactions are not worth running in parallel, and the ledger runs them serially
+# instead (as it does if the pool can't be used, or the ledger can't be snapshotted).
+#
+# Concurrent queries share the pool and the snapshot, so they must hold lock while
+# updating the snapshot and aggregating.
+class ParallelAggregator:
+    def __init__(self, workers = None, minimumSize = DEFAULT_MINIMUM_SIZE):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.minimumSize = minimumSize
+        self.lock = threading.Lock()
+        self.executor = None
+        self.directory = None
+        self.snapshot = None
+        self.snapshotGeneration = None
+        # transactions gone through by queries run serially since the snapshot went stale
+        self.staleQuerySize = 0
+
+    def isWorthwhile(self, size) -> bool:
+        return self.workers > 1 and size >= self.minimumSize
+
+    # Whether a query over size of the transactions can run in parallel, after writing a
+    # new snapshot of them if the one written last is stale and it is time to write it
+    # again (see above). If not, the query should run serially instead
+    def prepareSnapshot(self, transactions, generation, size) -> bool:
+        if self.snapshot is not None and self.snapshotGeneration == generation:
+            return True
+        self.staleQuerySize += size
+        if self.staleQuerySize < len(transactions):
+            return False
+        self.updateSnapshot(transactions, generation)
+        return True
+
+    # Writes a new snapshot of the transactions, unless the one written last is of the
+    # same generation of the ledger. Every snapshot gets a new file, since workers may
+    # still have the previous one mapped
+    def updateSnapshot(self, transactions, generation):
+        if self.snapshot is not None and self.snapshotGeneration == generation:
+            return
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix = "spendlog-")
+        path = os.path.join(self.directory, f"ledger-{generation}.snapshot")
+        Snapshot.write(path, transactions)
+        self.closeSnapshot()
+        self.snapshot = Snapshot(path)
+        self.snapshotGeneration = generation
+        self.staleQuerySize = 0
+
+    def closeSnapshot(self):
+        if self.snapshot is None:
+            return
+        self.snapshot.close()
+        try:
+            os.remove(self.snapshot.path)
+        except OSError:
+            pass
+        self.snapshot = None
+
+    # Splits the rows within the time range (or all rows) into one contiguous shard per
+    # worker, of roughly equal size, as (first row, last row) pairs
+    def getShards(self, timeRange = None) -> list[tuple[int, int]]:
+        first, last = 0, self.snapshot.size
+        if timeRange is not None:
+            first = self.snapshot.getFirstRowAfter(timeRange.start)
+            last = max(self.snapshot.getLastRowBefore(timeRange.end), first)
+        shardSize = max(-(-(last - first) // self.workers), 1)
+        return [(start, min(start + shardSize, last)) for start in range(first, last, shardSize)]
+
+    # The merged totals of aggregateShard over all shards of the current snapshot, or
+    # None if they couldn't be computed in parallel
+    def aggregate(self, filters, groupBy = None) -> dict:
+        try:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers = self.workers, mp_context = getWorkerContext())
+            futures = [self.executor.submit(aggregateShard, self.snapshot.path, first, last, filters, groupBy)
+                       for first, last in self.getShards(filters.get("timeRange"))]
+            partials = [future.result() for future in futures]
+        except (BrokenProcessPool, OSError, NotImplementedError) as e:
+            logging.warning(f"Parallel aggregation failed, falling back to serial execution: {e!r}")
+            self.shutdown()
+            return None
+        totals = dict()
+        for partial in partials:
+            for key, (liquidityChange, capitalChange) in partial.items():
+                keyTotals = totals.get(key)
+                if keyTotals is None:
+                    keyTotals = totals[key] = [0, 0]
+                keyTotals[0] += liquidityChange
+                keyTotals[1] += capitalChange
+        return totals
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.closeSnapshot()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors = True)
+            self.directory = None
@@ -2,6 +2,8 @@ from spendlog.ledger import Ledger
 from spendlog.loggingProvider import LoggingProvider
 logging = LoggingProvider().logging
 import datetime
+import hashlib
+from decimal import Decimal
 
 DATE_TIME_FORMAT = "%Y-%m-%d"
 
@@ -11,6 +13,11 @@ ALIAS_INDEX = 0
 TRANSACTION_DATE_INDEX = 2
 LIQUIDITY_CHANGE_INDEX = 6
 
+# Python's hash of a string differs between runs, but fingerprints must stay the same
+# for transactions to be recognized as duplicates of ones stored by an earlier run
+def stableHash(string) -> int:
+    return int.from_bytes(hashlib.blake2b(string.encode("utf-8"), digest_size = 8).digest(), "big", signed = True)
+
 class Parser:
     def __init__(self):
         logging.info(f"This function has not been implemented in the parser class '{type(self).__name__}'!")
@@ -24,6 +31,7 @@ class Parser:
     def readFile(self, filename):
         logging.warning(f"This function has not been implemented in the parser class '{type(self).__name__}'!")
 
+    # Returns the transaction in the lines, as keyword arguments for Transaction
     def parseTransactionLines(self, transactionLines):
         logging.warning(f"This function has not been implemented in the parser class '{type(self).__name__}'!")
 
@@ -39,14 +47,17 @@ class InternetbankenParser(Parser):
         content = self.readFile(filename)
         self.parse(content)
 
+    # All transactions in the content are added to the ledger as one batch
     def parse(self, content):
         lines = content.split('\n')
         nLines = len(lines)
+        records = list()
         i = 0
         while i < nLines:
             transactionLines = lines[i:i+LINES_PER_TRANSACTION]
-            self.parseTransactionLines(transactionLines)
+            records.append(self.parseTransactionLines(transactionLines))
             i += LINES_PER_TRANSACTION
+        Ledger().addTransactions(records)
 
     def readFile(self, filename):
         with open(filename, 'r', encoding='utf-8') as fp:
@@ -58,11 +69,12 @@ class InternetbankenParser(Parser):
         rawLiquidityChange = transactionLines[LIQUIDITY_CHANGE_INDEX]
 
         transactionDate = datetime.datetime.strptime(rawTransactionDate, DATE_TIME_FORMAT)
-        liquidityChange = int(rawLiquidityChange.replace(' ','').split(',')[0])
+        # e.g. "-1 234,50", with the öre kept exact
+        liquidityChange = Decimal(rawLiquidityChange.replace(' ', '').replace(',', '.'))
 
-        fingerPrint = hash('\n'.join(transactionLines))
+        fingerPrint = stableHash('\n'.join(transactionLines))
 
-        Ledger().addTransaction(liquidityChange = liquidityChange,
-                                counterPartyAlias = alias,
-                                date = transactionDate,
-                                fingerPrint = fingerPrint)
+        return {"liquidityChange"   : liquidityChange,
+                "counterPartyAlias" : alias,
+                "date"              : transactionDate,
+                "fingerPrint"       : fingerPrint}
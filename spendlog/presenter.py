@@ -1,5 +1,4 @@
-from spendlog.ledger import Ledger, TimeRange
-from spendlog.counterParty import CounterPartyDataBase
+from spendlog.ledger import Ledger, TimeRange, Totals, CATEGORY, TAG, COUNTER_PARTY
 
 class Presenter:
     def __init__(self):
@@ -21,38 +20,43 @@ class BasicPresenter(Presenter):
 
         if presentAllTransactions:
             print("All transactions:")
-            transactions = list(Ledger().getTransactions(timeRange = self.timeRange))
-            transactions.sort(key = lambda x : (x.date, x.liquidityChange, x. capitalChange, x.counterPartyAlias))
+            transactions = Ledger().query(timeRange = self.timeRange).orderBy("date", "liquidityChange", "capitalChange", "counterPartyAlias")
             for transaction in transactions:
                 print("  " + str(transaction))
             print( "========================================================")
 
         print("Tags:")
+        tagTotals = Ledger().aggregateBy(TAG, timeRange = self.timeRange)
+        if presentCapitalChange:
+            # NOTE: capital change per tag is presented over the whole ledger, not just the time range
+            allTimeTagTotals = Ledger().aggregateBy(TAG)
         for tag in self.tags:
             print(f"  {tag}:")
-            print(f"    liquidity: {Ledger().getTotalLiquidityChange(timeRange = self.timeRange, requiredTags = [tag])}")
+            print(f"    liquidity: {tagTotals.get(tag, Totals()).getLiquidityChange()}")
             if presentCapitalChange:
-                print(f"    capital change: {Ledger().getTotalCapitalChange(requiredTags = [tag])}")
+                print(f"    capital change: {allTimeTagTotals.get(tag, Totals()).getCapitalChange()}")
         print( "========================================================")
 
         print("Categories:")
+        categoryTotals = Ledger().aggregateBy(CATEGORY, timeRange = self.timeRange)
         self.categories = list(self.categories)
-        self.categories.sort(key = lambda x : Ledger().getTotalLiquidityChange(timeRange = self.timeRange, requiredCategory = x))
+        self.categories.sort(key = lambda x : categoryTotals.get(x, Totals()).getLiquidityChange())
         for category in self.categories:
             print(f"  {category}:")
-            print(f"    liquidity: {Ledger().getTotalLiquidityChange(timeRange = self.timeRange, requiredCategory = category)}")
+            print(f"    liquidity: {categoryTotals.get(category, Totals()).getLiquidityChange()}")
             if presentCapitalChange:
-                print(f"    capital change: {Ledger().getTotalCapitalChange(timeRange = self.timeRange, requiredCategory = category)}")
+                print(f"    capital change: {categoryTotals.get(category, Totals()).getCapitalChange()}")
         print( "========================================================")
 
         print("Counter Parties:")
+        counterPartyTotals = Ledger().aggregateBy(COUNTER_PARTY, timeRange = self.timeRange)
         self.counterPartyAliases = list(self.counterPartyAliases)
-        self.counterPartyAliases.sort(key = lambda x : Ledger().getTotalLiquidityChange(timeRange = self.timeRange, requiredCounterParty = x))
+        self.counterPartyAliases.sort(key = lambda x : counterPartyTotals.get(x, Totals()).getLiquidityChange())
         for counterPartyAlias in self.counterPartyAliases:
             print(f"  {counterPartyAlias}:")
-            print(f"    liquidity: {Ledger().getTotalLiquidityChange(timeRange = self.timeRange, requiredCounterParty = counterPartyAlias)}")
+            print(f"    liquidity: {counterPartyTotals.get(counterPartyAlias, Totals()).getLiquidityChange()}")
             if presentCapitalChange:
-                print(f"    capital change: {Ledger().getTotalCapitalChange(timeRange = self.timeRange, requiredCounterParty = counterPartyAlias)}")
+                print(f"    capital change: {counterPartyTotals.get(counterPartyAlias, Totals()).getCapitalChange()}")
         print( "========================================================")
 
         print("Total:")
@@ -63,19 +67,19 @@ class BasicPresenter(Presenter):
 
 
     def fetchTags(self):
-        transactions = Ledger().getTransactions(self.timeRange)
+        transactions = Ledger().query(self.timeRange)
         self.tags = set()
         for transaction in transactions:
             self.tags |= set(transaction.getTags())
 
     def fetchCategories(self):
-        transactions = Ledger().getTransactions(self.timeRange)
+        transactions = Ledger().query(self.timeRange)
         self.categories = set()
         for transaction in transactions:
             self.categories.add(transaction.getCategory())
 
     def fetchCounterPartyAliases(self):
-        transactions = Ledger().getTransactions(self.timeRange)
+        transactions = Ledger().query(self.timeRange)
         self.counterPartyAliases = set()
         for transaction in transactions:
-            self.counterPartyAliases.add(CounterPartyDataBase().getCounterParty(transaction.counterPartyAlias).name)
+            self.counterPartyAliases.add(transaction.getCounterParty().name)
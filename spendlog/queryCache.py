@@ -0,0 +1,52 @@
+from collections import OrderedDict
+import threading
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+
+# Least recently used cache of query results.
+#
+# Every entry is stamped with the generation of the data it was computed from. Looking
+# up an entry with a different generation is a miss (and drops the stale entry), so the
+# owner of the cache only has to bump its generation whenever its data changes, rather
+# than figure out which entries are affected.
+#
+# Many queries may use the cache at the same time, so the entries are guarded by their
+# own lock. Values are computed without holding it, so that slow queries don't hold up
+# the others (two threads missing on the same key will both compute it).
+class QueryCache:
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation, compute):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1]
+            self.misses += 1
+        value = compute()
+        if self.maxSize > 0:
+            with self.lock:
+                self.entries[key] = (generation, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxSize:
+                    self.entries.popitem(last = False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+    def getStatistics(self) -> dict:
+        with self.lock:
+            return {"hits"    : self.hits,
+                    "misses"  : self.misses,
+                    "size"    : len(self.entries),
+                    "maxSize" : self.maxSize}
@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+import functools
+import threading
+
+class LockUpgradeError(Exception):
+    pass
+
+class LockNotHeldError(Exception):
+    pass
+
+# Lock that lets any number of threads read at the same time, while a writer has
+# exclusive access. Both are reentrant per thread, and a thread holding the write lock
+# may also read (but a reader can't start writing, since two readers trying to do that
+# at the same time would wait for each other forever).
+#
+# Writers are preferred: once a writer is waiting, threads that aren't already reading
+# wait for it before they start, so a steady stream of readers can't starve writers.
+class ReadWriteLock:
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readerDepths = dict()
+        self.writer = None
+        self.writerDepth = 0
+        self.nWaitingWriters = 0
+
+    def acquireRead(self):
+        thread = threading.get_ident()
+        with self.condition:
+            if self.writer == thread or thread in self.readerDepths:
+                self.readerDepths[thread] = self.readerDepths.get(thread, 0) + 1
+                return
+            while self.writer is not None or self.nWaitingWriters > 0:
+                self.condition.wait()
+            self.readerDepths[thread] = 1
+
+    def releaseRead(self):
+        thread = threading.get_ident()
+        with self.condition:
+            depth = self.readerDepths.get(thread)
+            if depth is None:
+                raise LockNotHeldError("Tried to release a read lock that isn't held by this thread")
+            if depth > 1:
+                self.readerDepths[thread] = depth - 1
+                return
+            del self.readerDepths[thread]
+            if not self.readerDepths:
+                self.condition.notify_all()
+
+    def acquireWrite(self):
+        thread = threading.get_ident()
+        with self.condition:
+            if self.writer == thread:
+                self.writerDepth += 1
+                return
+            if thread in self.readerDepths:
+                raise LockUpgradeError("Tried to acquire the write lock while holding a read lock")
+            self.nWaitingWriters += 1
+            try:
+                while self.writer is not None or self.readerDepths:
+                    self.condition.wait()
+            finally:
+                self.nWaitingWriters -= 1
+            self.writer = thread
+            self.writerDepth = 1
+
+    def releaseWrite(self):
+        with self.condition:
+            if self.writer != threading.get_ident():
+                raise LockNotHeldError("Tried to release a write lock that isn't held by this thread")
+            self.writerDepth -= 1
+            if self.writerDepth == 0:
+                self.writer = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def reading(self):
+        self.acquireRead()
+        try:
+            yield
+        finally:
+            self.releaseRead()
+
+    @contextmanager
+    def writing(self):
+        self.acquireWrite()
+        try:
+            yield
+        finally:
+            self.releaseWrite()
+
+# Decorators for methods (or classmethods) of a class with a ReadWriteLock in its lock
+# attribute, which run the whole method while holding the read or the write lock
+def readLocked(method):
+    @functools.wraps(method)
+    def lockedMethod(owner, *args, **kwargs):
+        with owner.lock.reading():
+            return method(owner, *args, **kwargs)
+    return lockedMethod
+
+def writeLocked(method):
+    @functools.wraps(method)
+    def lockedMethod(owner, *args, **kwargs):
+        with owner.lock.writing():
+            return method(owner, *args, **kwargs)
+    return lockedMethod
@@ -0,0 +1,169 @@
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+
+class RollingWindowError(Exception):
+    pass
+
+# Fenwick tree (binary indexed tree) over a fixed number of slots. Adding to a slot and
+# summing any prefix of slots are both O(log n).
+class FenwickTree:
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    # O(n) construction from the value of each slot
+    @classmethod
+    def fromValues(cls, values):
+        fenwickTree = cls(len(values))
+        tree = fenwickTree.tree
+        for index, value in enumerate(values, start = 1):
+            tree[index] += value
+            parent = index + (index & -index)
+            if parent <= fenwickTree.size:
+                tree[parent] += tree[index]
+        return fenwickTree
+
+    def add(self, slot, delta):
+        index = slot + 1
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    # sum of slots 0 up to and including slot
+    def prefixSum(self, slot):
+        total = 0
+        index = min(slot + 1, self.size)
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    # sum of slots first up to and including last
+    def rangeSum(self, first, last):
+        if last < first:
+            return 0
+        total = self.prefixSum(last)
+        if first > 0:
+            total -= self.prefixSum(first - 1)
+        return total
+
+# Prefix sums of liquidity and capital change per day, over a contiguous span of days
+class DailyPrefixSums:
+    def __init__(self, firstDay, buckets, size):
+        self.firstDay = firstDay
+        self.size = size
+        liquidityChanges = [0] * size
+        capitalChanges = [0] * size
+        for day, (liquidityChange, capitalChange) in buckets.items():
+            liquidityChanges[day - firstDay] = liquidityChange
+            capitalChanges[day - firstDay] = capitalChange
+        self.liquidityChanges = FenwickTree.fromValues(liquidityChanges)
+        self.capitalChanges = FenwickTree.fromValues(capitalChanges)
+
+    def covers(self, day):
+        return self.firstDay <= day < self.firstDay + self.size
+
+    def add(self, day, liquidityChange, capitalChange):
+        self.liquidityChanges.add(day - self.firstDay, liquidityChange)
+        self.capitalChanges.add(day - self.firstDay, capitalChange)
+
+    def getTotals(self, firstDay, lastDay):
+        first = max(firstDay - self.firstDay, 0)
+        last = min(lastDay - self.firstDay, self.size - 1)
+        return self.liquidityChanges.rangeSum(first, last), self.capitalChanges.rangeSum(first, last)
+
+# Liquidity and capital change per day (by ordinal), kept separately for any number of
+# keys (e.g. one per category). Totals over a range of days are answered from prefix
+# sums in O(log n), where n is the number of days the key spans.
+#
+# The per day buckets are always kept up to date. The prefix sums of a key are built the
+# first time the key is queried, and are updated along with the buckets from then on. If
+# a key gets a day outside of the span of its prefix sums, they are dropped, and rebuilt
+# (with room to grow in both directions) the next time the key is queried.
+class DailyRollup:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.keyToBuckets = dict()
+        self.keyToTotals = dict()
+        self.keyToPrefixSums = dict()
+
+    def add(self, key, day, liquidityChange, capitalChange):
+        buckets = self.keyToBuckets.setdefault(key, dict())
+        bucket = buckets.setdefault(day, [0, 0])
+        bucket[0] += liquidityChange
+        bucket[1] += capitalChange
+        totals = self.keyToTotals.setdefault(key, [0, 0])
+        totals[0] += liquidityChange
+        totals[1] += capitalChange
+
+        prefixSums = self.keyToPrefixSums.get(key)
+        if prefixSums is None:
+            return
+        if prefixSums.covers(day):
+            prefixSums.add(day, liquidityChange, capitalChange)
+        else:
+            del self.keyToPrefixSums[key]
+
+    def remove(self, key, day, liquidityChange, capitalChange):
+        if day not in self.keyToBuckets.get(key, dict()):
+            logging.warning(f"Tried to remove amounts from day {day} of rollup key '{key}', which has no amounts that day")
+            return
+        self.add(key, day, -liquidityChange, -capitalChange)
+
+    # Total (liquidity change, capital change) of the key over firstDay up to and including
+    # lastDay. Without days, the total over all days
+    def getTotals(self, key, firstDay = None, lastDay = None) -> tuple:
+        buckets = self.keyToBuckets.get(key)
+        if buckets is None:
+            return 0, 0
+        if firstDay is None and lastDay is None:
+            liquidityChange, capitalChange = self.keyToTotals[key]
+            return liquidityChange, capitalChange
+        if lastDay < firstDay:
+            return 0, 0
+        return self.getPrefixSums(key, buckets).getTotals(firstDay, lastDay)
+
+    def getPrefixSums(self, key, buckets) -> DailyPrefixSums:
+        prefixSums = self.keyToPrefixSums.get(key)
+        if prefixSums is None:
+            firstDay = min(buckets)
+            span = max(buckets) - firstDay + 1
+            prefixSums = DailyPrefixSums(firstDay - span, buckets, 3 * span)
+            self.keyToPrefixSums[key] = prefixSums
+        return prefixSums
+
+    # Totals of the keys over a trailing window of windowDays days ending on each day from
+    # firstDay up to and including lastDay, as (liquidity changes, capital changes) lists
+    # with one total per day. Only the first window is summed from the prefix sums; every
+    # later one slides the previous one by a day, adding the day entering the window and
+    # subtracting the day leaving it, so each day after the first is O(1)
+    def getRollingTotals(self, keys, windowDays, firstDay, lastDay) -> tuple[list, list]:
+        if windowDays < 1:
+            raise RollingWindowError(f"Window must be at least one day long, got {windowDays}")
+        liquidityChanges = list()
+        capitalChanges = list()
+        if lastDay < firstDay:
+            return liquidityChanges, capitalChanges
+        liquidityChange = capitalChange = 0
+        for key in keys:
+            keyLiquidityChange, keyCapitalChange = self.getTotals(key, firstDay - windowDays + 1, firstDay)
+            liquidityChange += keyLiquidityChange
+            capitalChange += keyCapitalChange
+        liquidityChanges.append(liquidityChange)
+        capitalChanges.append(capitalChange)
+        bucketsOfKeys = [self.keyToBuckets[key] for key in keys if key in self.keyToBuckets]
+        for day in range(firstDay + 1, lastDay + 1):
+            for buckets in bucketsOfKeys:
+                entering = buckets.get(day)
+                if entering is not None:
+                    liquidityChange += entering[0]
+                    capitalChange += entering[1]
+                leaving = buckets.get(day - windowDays)
+                if leaving is not None:
+                    liquidityChange -= leaving[0]
+                    capitalChange -= leaving[1]
+            liquidityChanges.append(liquidityChange)
+            capitalChanges.append(capitalChange)
+        return liquidityChanges, capitalChanges
@@ -0,0 +1,340 @@
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.transaction import Transaction, fromMinorUnits
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+from array import array
+from bisect import bisect_left, bisect_right
+import datetime
+import json
+import mmap
+import struct
+import sys
+
+MAGIC = b"SPNDLOG\0"
+VERSION = 2
+HEADER = struct.Struct("<8sIIQQQ")
+LITTLE_ENDIAN = 1
+BIG_ENDIAN = 2
+NO_CODE = -1
+HAS_FINGER_PRINT = 1
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds = 1)
+ALIGNMENT = 8
+GROUP_BY_CATEGORY = "category"
+GROUP_BY_TAG = "tag"
+GROUP_BY_COUNTER_PARTY_ALIAS = "counterPartyAlias"
+
+class SnapshotError(Exception):
+    pass
+
+def getByteOrder():
+    return LITTLE_ENDIAN if sys.byteorder == "little" else BIG_ENDIAN
+
+def getPadding(size):
+    return -size % ALIGNMENT
+
+# Binary, columnar snapshot of the transactions in the ledger, which is memory mapped
+# when loaded, so that it can be queried right away, without first creating a
+# Transaction object per row.
+#
+# The file is a header, a dictionary of every distinct string (counter party aliases,
+# categories and tags) as JSON, and then one fixed-width column per field:
+#
+#   liquidityChange, capitalChange (minor units), date (µs since 1970),
+#   fingerPrint                                                           int64 per row
+#   tagOffsets                                                            int64 per row + 1
+#   counterPartyAliasCode, categoryCode                                   int32 per row
+#   tagCodes                                                              int32 per tag
+#   flags                                                                 uint8 per row
+#
+# where codes are positions in the dictionary (-1 for None), the tags of row i are
+# tagCodes[tagOffsets[i]:tagOffsets[i + 1]], and the flags say whether the row has a
+# fingerprint. Rows are sorted by date, so time ranges are found by bisecting. Columns
+# are in native byte order, and the byte order is recorded in the header.
+#
+# Only integer (64 bit) fingerprints can be stored.
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            self.map = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, byteOrder, self.size, nTagCodes, dictionaryLength = HEADER.unpack_from(self.map)
+        errorString = ""
+        if magic != MAGIC:
+            errorString = f"'{path}' is not a spendlog snapshot"
+        elif version != VERSION:
+            errorString = f"Snapshot '{path}' has version {version}, but only version {VERSION} is supported"
+        elif byteOrder != getByteOrder():
+            errorString = f"Snapshot '{path}' was written on a machine with a different byte order"
+        if errorString:
+            self.map.close()
+            raise SnapshotError(errorString)
+
+        offset = HEADER.size
+        self.strings = json.loads(bytes(self.map[offset:offset + dictionaryLength]).decode("utf-8"))
+        self.codeOfString = {string : code for code, string in enumerate(self.strings)}
+        offset += dictionaryLength + getPadding(dictionaryLength)
+        self.view = memoryview(self.map)
+        self.columns = list()
+
+        def column(typeCode, length):
+            nonlocal offset
+            itemSize = struct.calcsize(typeCode)
+            values = self.view[offset:offset + length * itemSize].cast(typeCode)
+            self.columns.append(values)
+            offset += length * itemSize
+            return values
+
+        self.liquidityChanges = column("q", self.size)
+        self.capitalChanges = column("q", self.size)
+        self.dates = column("q", self.size)
+        self.fingerPrints = column("q", self.size)
+        self.tagOffsets = column("q", self.size + 1)
+        self.counterPartyAliasCodes = column("i", self.size)
+        self.categoryCodes = column("i", self.size)
+        self.tagCodes = column("i", nTagCodes)
+        self.flags = column("B", self.size)
+        self.counterPartyAliasCodeSet = None
+        logging.debug(f"Mapped snapshot '{path}' with {self.size} transactions")
+
+    def close(self):
+        for values in self.columns:
+            values.release()
+        self.view.release()
+        self.map.close()
+
+    @classmethod
+    def write(cls, path, transactions):
+        transactions = sorted(transactions, key = lambda transaction : transaction.getDate())
+        strings = list()
+        codeOfString = dict()
+
+        def encode(string):
+            if string is None:
+                return NO_CODE
+            if string not in codeOfString:
+                codeOfString[string] = len(strings)
+                strings.append(string)
+            return codeOfString[string]
+
+        def toInteger(value, name, transaction):
+            if int(value) != value or not -2**63 <= value < 2**63:
+                raise SnapshotError(f"Snapshots can only store whole 64 bit {name}s, got '{value}' in: {transaction}")
+            return int(value)
+
+        liquidityChanges = array("q")
+        capitalChanges = array("q")
+        dates = array("q")
+        fingerPrints = array("q")
+        tagOffsets = array("q", [0])
+        counterPartyAliasCodes = array("i")
+        categoryCodes = array("i")
+        tagCodes = array("i")
+        flags = array("B")
+        for transaction in transactions:
+            liquidityChanges.append(toInteger(transaction.getLiquidityChangeMinor(), "amount", transaction))
+            capitalChanges.append(toInteger(transaction.getCapitalChangeMinor(), "amount", transaction))
+            dates.append((transaction.getDate() - EPOCH) // MICROSECOND)
+            if transaction.fingerPrint is None:
+                fingerPrints.append(0)
+                flags.append(0)
+            else:
+                if not isinstance(transaction.fingerPrint, int):
+                    raise SnapshotError(f"Snapshots can only store integer fingerprints, got '{transaction.fingerPrint}' in: {transaction}")
+                fingerPrints.append(toInteger(transaction.fingerPrint, "fingerprint", transaction))
+                flags.append(HAS_FINGER_PRINT)
+            counterPartyAliasCodes.append(encode(transaction.counterPartyAlias))
+            categoryCodes.append(encode(transaction.getCategory()))
+            tagCodes.extend(encode(tag) for tag in set(transaction.getTags()))
+            tagOffsets.append(len(tagCodes))
+
+        dictionary = json.dumps(strings).encode("utf-8")
+        with open(path, "wb") as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, getByteOrder(), len(transactions), len(tagCodes), len(dictionary)))
+            fp.write(dictionary + bytes(getPadding(len(dictionary))))
+            for values in (liquidityChanges, capitalChanges, dates, fingerPrints, tagOffsets, counterPartyAliasCodes, categoryCodes, tagCodes, flags):
+                fp.write(values.tobytes())
+        logging.debug(f"Wrote snapshot '{path}' with {len(transactions)} transactions")
+
+    def decode(self, code):
+        if code == NO_CODE:
+            return None
+        return self.strings[code]
+
+    def getCode(self, string):
+        return self.codeOfString.get(string)
+
+    def getCodes(self, strings) -> set:
+        return {self.getCode(string) for string in strings} - {None}
+
+    def getTagCodesOfRow(self, row):
+        return self.tagCodes[self.tagOffsets[row]:self.tagOffsets[row + 1]]
+
+    # The aliases in the snapshot that currently resolve to any of the counter parties of
+    # the given aliases
+    def getAliasesOfCounterParties(self, counterPartyAliases) -> set:
+        if counterPartyAliases is None:
+            return None
+        if self.counterPartyAliasCodeSet is None:
+            self.counterPartyAliasCodeSet = set(self.counterPartyAliasCodes) - {NO_CODE}
+        counterPartyDataBase = CounterPartyDataBase()
+        counterParties = {counterPartyDataBase.getCounterParty(counterPartyAlias) for counterPartyAlias in counterPartyAliases}
+        aliases = (self.strings[code] for code in self.counterPartyAliasCodeSet)
+        return {alias for alias in aliases if counterPartyDataBase.getCounterParty(alias) in counterParties}
+
+    # The rows matching the given filters (same as for Ledger.getTransactions), in order
+    # of date. Only the columns are read; no Transaction objects are created
+    def getRows(self,
+                timeRange = None,
+                requiredCategory = None,
+                forbiddenCategory = None,
+                allowedCategories = None,
+                requiredTags = None,
+                forbiddenTags = None,
+                allowedTags = None,
+                requiredCounterParty = None,
+                forbiddenCounterParty = None,
+                allowedCounterParties = None):
+        return self.getMatchingRows(timeRange = timeRange,
+                                    requiredCategory = requiredCategory,
+                                    forbiddenCategory = forbiddenCategory,
+                                    allowedCategories = allowedCategories,
+                                    requiredTags = requiredTags,
+                                    forbiddenTags = forbiddenTags,
+                                    allowedTags = allowedTags,
+                                    requiredCounterPartyAliases = self.getAliasesOfCounterParties(None if requiredCounterParty is None else [requiredCounterParty]),
+                                    forbiddenCounterPartyAliases = self.getAliasesOfCounterParties(None if forbiddenCounterParty is None else [forbiddenCounterParty]),
+                                    allowedCounterPartyAliases = self.getAliasesOfCounterParties(allowedCounterParties))
+
+    # Same as getRows, except that the counter party filters must already be resolved into
+    # the sets of (stored) counter party aliases they match, so that no counter party
+    # database is needed. Only rows from firstRow up to, but not including, lastRow are
+    # considered
+    def getMatchingRows(self,
+                        timeRange = None,
+                        requiredCategory = None,
+                        forbiddenCategory = None,
+                        allowedCategories = None,
+                        requiredTags = None,
+                        forbiddenTags = None,
+                        allowedTags = None,
+                        requiredCounterPartyAliases = None,
+                        forbiddenCounterPartyAliases = None,
+                        allowedCounterPartyAliases = None,
+                        firstRow = 0,
+                        lastRow = None):
+        first, last = firstRow, self.size if lastRow is None else lastRow
+        if timeRange is not None:
+            first = max(first, self.getFirstRowAfter(timeRange.start))
+            last = min(last, self.getLastRowBefore(timeRange.end))
+
+        predicates = list()
+        categoryCodes = self.categoryCodes
+        counterPartyAliasCodes = self.counterPartyAliasCodes
+
+        if requiredCategory is not None:
+            requiredCategoryCode = self.getCode(requiredCategory)
+            predicates.append(lambda row : categoryCodes[row] == requiredCategoryCode)
+
+        if forbiddenCategory is not None:
+            forbiddenCategoryCode = self.getCode(forbiddenCategory)
+            predicates.append(lambda row : categoryCodes[row] != forbiddenCategoryCode)
+
+        if allowedCategories is not None:
+            allowedCategoryCodes = self.getCodes(allowedCategories)
+            predicates.append(lambda row : categoryCodes[row] in allowedCategoryCodes)
+
+        if requiredTags:
+            requiredTagCodes = self.getCodes(requiredTags)
+            if len(requiredTagCodes) < len(set(requiredTags)):
+                return range(0)
+            predicates.append(lambda row : requiredTagCodes.issubset(self.getTagCodesOfRow(row)))
+
+        if forbiddenTags is not None:
+            forbiddenTagCodes = self.getCodes(forbiddenTags)
+            predicates.append(lambda row : forbiddenTagCodes.isdisjoint(self.getTagCodesOfRow(row)))
+
+        if allowedTags is not None:
+            allowedTagCodes = self.getCodes(allowedTags)
+            predicates.append(lambda row : allowedTagCodes.issuperset(self.getTagCodesOfRow(row)))
+
+        if requiredCounterPartyAliases is not None:
+            requiredAliasCodes = self.getCodes(requiredCounterPartyAliases)
+            predicates.append(lambda row : counterPartyAliasCodes[row] in requiredAliasCodes)
+
+        if forbiddenCounterPartyAliases is not None:
+            forbiddenAliasCodes = self.getCodes(forbiddenCounterPartyAliases)
+            predicates.append(lambda row : counterPartyAliasCodes[row] not in forbiddenAliasCodes)
+
+        if allowedCounterPartyAliases is not None:
+            allowedAliasCodes = self.getCodes(allowedCounterPartyAliases)
+            predicates.append(lambda row : counterPartyAliasCodes[row] in allowedAliasCodes)
+
+        rows = range(max(first, 0), max(last, first))
+        if not predicates:
+            return rows
+        return [row for row in rows if all(predicate(row) for predicate in predicates)]
+
+    # The first row dated at or after date, and the row after the last one dated at or
+    # before date
+    def getFirstRowAfter(self, date) -> int:
+        return bisect_left(self.dates, (date - EPOCH) // MICROSECOND)
+
+    def getLastRowBefore(self, date) -> int:
+        return bisect_right(self.dates, (date - EPOCH) // MICROSECOND)
+
+    # (liquidity change, capital change), in minor units, of the given rows, per category,
+    # tag or counter party alias (see GROUP_BY_*), or all under None if not grouped. Rows
+    # count towards each of their tags when grouped by tag
+    def aggregateRows(self, rows, groupBy = None) -> dict:
+        if groupBy is None:
+            return {None : [self.getTotal(self.liquidityChanges, rows), self.getTotal(self.capitalChanges, rows)]}
+        if groupBy == GROUP_BY_CATEGORY:
+            getCodes = lambda row : (self.categoryCodes[row],)
+        elif groupBy == GROUP_BY_TAG:
+            getCodes = self.getTagCodesOfRow
+        else:
+            getCodes = lambda row : (self.counterPartyAliasCodes[row],)
+        totals = dict()
+        for row in rows:
+            liquidityChange = self.liquidityChanges[row]
+            capitalChange = self.capitalChanges[row]
+            for code in getCodes(row):
+                codeTotals = totals.get(code)
+                if codeTotals is None:
+                    codeTotals = totals[code] = [0, 0]
+                codeTotals[0] += liquidityChange
+                codeTotals[1] += capitalChange
+        return {self.decode(code) : codeTotals for code, codeTotals in totals.items()}
+
+    def getTotal(self, column, rows) -> int:
+        if isinstance(rows, range) and rows.step == 1:
+            return sum(column[rows.start:rows.stop])
+        return sum(column[row] for row in rows)
+
+    def getTotalLiquidityChange(self, *args, **kwargs):
+        return fromMinorUnits(self.getTotal(self.liquidityChanges, self.getRows(*args, **kwargs)))
+
+    def getTotalCapitalChange(self, *args, **kwargs):
+        return fromMinorUnits(self.getTotal(self.capitalChanges, self.getRows(*args, **kwargs)))
+
+    def getTotalNetChange(self, *args, **kwargs):
+        rows = self.getRows(*args, **kwargs)
+        return fromMinorUnits(self.getTotal(self.liquidityChanges, rows) + self.getTotal(self.capitalChanges, rows))
+
+    # Transactions are recreated with Transaction.fromFields, since their counter party
+    # has already been resolved and their modifier already applied
+    def getTransaction(self, row) -> Transaction:
+        return Transaction.fromFields(self.liquidityChanges[row],
+                                      self.capitalChanges[row],
+                                      self.decode(self.counterPartyAliasCodes[row]),
+                                      {self.strings[code] for code in self.getTagCodesOfRow(row)},
+                                      self.decode(self.categoryCodes[row]),
+                                      EPOCH + self.dates[row] * MICROSECOND,
+                                      self.fingerPrints[row] if self.flags[row] & HAS_FINGER_PRINT else None)
+
+    def getTransactions(self, *args, **kwargs) -> set[Transaction]:
+        return {self.getTransaction(row) for row in self.getRows(*args, **kwargs)}
+
+    def getAllTransactions(self) -> list[Transaction]:
+        return [self.getTransaction(row) for row in range(self.size)]
@@ -0,0 +1,294 @@
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.transaction import Transaction, fromMinorUnits
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+import ast
+import datetime
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    fingerPrint UNIQUE,
+    liquidityChangeMinor INTEGER,
+    capitalChangeMinor INTEGER,
+    counterPartyAlias TEXT,
+    category TEXT,
+    date TEXT
+);
+CREATE TABLE IF NOT EXISTS transactionTags (
+    transactionId INTEGER REFERENCES transactions(id) ON DELETE CASCADE,
+    tag TEXT
+);
+CREATE TABLE IF NOT EXISTS counterParties (
+    alias TEXT PRIMARY KEY,
+    name TEXT,
+    category TEXT
+);
+CREATE TABLE IF NOT EXISTS counterPartyTags (
+    name TEXT,
+    tag TEXT,
+    UNIQUE (name, tag)
+);
+CREATE INDEX IF NOT EXISTS transactionsByDate ON transactions(date);
+CREATE INDEX IF NOT EXISTS transactionsByCategory ON transactions(category);
+CREATE INDEX IF NOT EXISTS transactionsByCounterPartyAlias ON transactions(counterPartyAlias);
+CREATE INDEX IF NOT EXISTS transactionTagsByTag ON transactionTags(tag, transactionId);
+CREATE INDEX IF NOT EXISTS transactionTagsByTransaction ON transactionTags(transactionId);
+"""
+
+TRANSACTION_COLUMNS = "id, fingerPrint, liquidityChangeMinor, capitalChangeMinor, counterPartyAlias, category, date"
+
+# Range of the integers SQLite stores natively
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+class SqliteStoreError(Exception):
+    pass
+
+def dateToText(date):
+    return date.isoformat(timespec = "microseconds")
+
+# Fingerprints that are strings or 64 bit ints are stored as they are. Any other
+# fingerprint (e.g. a tuple) is stored as the bytes of its repr, and read back with
+# ast.literal_eval, so it must be a Python literal that reads back equal to itself.
+# Raises SqliteStoreError for fingerprints that can't be stored
+def encodeFingerPrint(fingerPrint):
+    if fingerPrint is None or type(fingerPrint) is str:
+        return fingerPrint
+    if type(fingerPrint) is int and MIN_INTEGER <= fingerPrint <= MAX_INTEGER:
+        return fingerPrint
+    encoded = repr(fingerPrint)
+    try:
+        isLiteral = ast.literal_eval(encoded) == fingerPrint
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        isLiteral = False
+    if not isLiteral:
+        raise SqliteStoreError(f"Can't store fingerprint '{encoded}'. Fingerprints must be strings, ints or other Python literals")
+    return encoded.encode("utf-8")
+
+def decodeFingerPrint(value):
+    if type(value) is bytes:
+        return ast.literal_eval(value.decode("utf-8"))
+    return value
+
+# Persists transactions, with their (already resolved) counter party alias, tags and
+# category, in a local SQLite file, along with the counter parties of the counter party
+# database. Attach it to the ledger with Ledger.attachStore, after which every
+# transaction added to or removed from the ledger is written through to the file, so
+# that later runs can start from what is stored and only add new transactions.
+# Amounts are stored as integer minor units (see transaction.py).
+#
+# The transactions in the file can also be queried directly, with the same filters as
+# Ledger.getTransactions. The filters are translated into SQL and answered using the
+# indexes on date, category, counter party alias and tag. Counter party filters are
+# resolved through the counter party database at query time, same as in the ledger.
+# Only these methods query the file: an attached ledger holds every stored transaction
+# in memory and answers its own queries from there, so a history too large to load
+# should be queried through a store that isn't attached.
+#
+# Transaction modifiers are code and can't be stored, so counter parties are stored
+# without them (transactions are stored with modifiers already applied). Neither are
+# alias rules, which, like modifiers, are expected to be set up by the code that
+# populates the counter party database.
+class SqliteStore:
+    def __init__(self, path):
+        self.path = path
+        # the ledger writes through from whichever thread changes it (one at a time)
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        # row id of each saved or loaded transaction (by id, along with the transaction
+        # itself, which keeps the id from being reused)
+        self.rowIdOfTransaction = dict()
+        logging.debug(f"Opened SQLite store '{path}'")
+
+    def close(self):
+        self.connection.close()
+
+    # Every fingerprint is checked before anything is written, so a batch with one that
+    # can't be stored (see encodeFingerPrint) writes nothing
+    def saveTransactions(self, transactions):
+        fingerPrints = [encodeFingerPrint(transaction.fingerPrint) for transaction in transactions]
+        with self.connection:
+            for transaction, fingerPrint in zip(transactions, fingerPrints):
+                if fingerPrint is not None:
+                    self.connection.execute("DELETE FROM transactions WHERE fingerPrint = ?", (fingerPrint,))
+                cursor = self.connection.execute("INSERT INTO transactions (fingerPrint, liquidityChangeMinor, capitalChangeMinor, counterPartyAlias, category, date) VALUES (?, ?, ?, ?, ?, ?)",
+                                                 (fingerPrint,
+                                                  transaction.getLiquidityChangeMinor(),
+                                                  transaction.getCapitalChangeMinor(),
+                                                  transaction.counterPartyAlias,
+                                                  transaction.getCategory(),
+                                                  dateToText(transaction.getDate())))
+                rowId = cursor.lastrowid
+                self.connection.executemany("INSERT INTO transactionTags (transactionId, tag) VALUES (?, ?)",
+                                            [(rowId, tag) for tag in set(transaction.getTags())])
+                self.rowIdOfTransaction[id(transaction)] = (rowId, transaction)
+
+    def deleteTransaction(self, transaction):
+        rowId, _ = self.rowIdOfTransaction.pop(id(transaction), (None, None))
+        with self.connection:
+            if rowId is not None:
+                self.connection.execute("DELETE FROM transactions WHERE id = ?", (rowId,))
+            elif transaction.fingerPrint is not None:
+                self.connection.execute("DELETE FROM transactions WHERE fingerPrint = ?", (encodeFingerPrint(transaction.fingerPrint),))
+            else:
+                logging.warning(f"Tried to delete transaction from SQLite store, but it is not in the store: {transaction}")
+
+    def loadTransactions(self) -> list[Transaction]:
+        transactions, rowIds = self.selectTransactions("", list())
+        for transaction, rowId in zip(transactions, rowIds):
+            self.rowIdOfTransaction[id(transaction)] = (rowId, transaction)
+        return transactions
+
+    # Transactions are recreated with Transaction.fromFields, since their counter party
+    # has already been resolved and their modifier already applied before being stored.
+    # Returns the transactions and their row ids
+    def selectTransactions(self, whereClause, parameters) -> tuple[list[Transaction], list[int]]:
+        rows = self.connection.execute(f"SELECT {TRANSACTION_COLUMNS} FROM transactions {whereClause}", parameters).fetchall()
+        rowIds = [row[0] for row in rows]
+        tagsOfRow = {rowId : set() for rowId in rowIds}
+        if rows:
+            for rowId, tag in self.connection.execute(f"SELECT transactionId, tag FROM transactionTags WHERE transactionId IN (SELECT id FROM transactions {whereClause})", parameters):
+                tagsOfRow[rowId].add(tag)
+        transactions = list()
+        for rowId, fingerPrint, liquidityChangeMinor, capitalChangeMinor, counterPartyAlias, category, date in rows:
+            transaction = Transaction.fromFields(liquidityChangeMinor,
+                                                 capitalChangeMinor,
+                                                 counterPartyAlias,
+                                                 tagsOfRow[rowId],
+                                                 category,
+                                                 datetime.datetime.fromisoformat(date),
+                                                 decodeFingerPrint(fingerPrint))
+            transactions.append(transaction)
+        return transactions, rowIds
+
+    def getSize(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    def getTransactions(self, *args, **kwargs) -> set[Transaction]:
+        whereClause, parameters = self.getWhereClause(*args, **kwargs)
+        transactions, _ = self.selectTransactions(whereClause, parameters)
+        return set(transactions)
+
+    def getTotalLiquidityChange(self, *args, **kwargs):
+        return self.getTotal("liquidityChangeMinor", *args, **kwargs)
+
+    def getTotalCapitalChange(self, *args, **kwargs):
+        return self.getTotal("capitalChangeMinor", *args, **kwargs)
+
+    def getTotalNetChange(self, *args, **kwargs):
+        return self.getTotal("liquidityChangeMinor + capitalChangeMinor", *args, **kwargs)
+
+    def getTotal(self, expression, *args, **kwargs):
+        whereClause, parameters = self.getWhereClause(*args, **kwargs)
+        return fromMinorUnits(self.connection.execute(f"SELECT COALESCE(SUM({expression}), 0) FROM transactions {whereClause}", parameters).fetchone()[0])
+
+    # The stored counter party aliases that currently resolve to any of the counter
+    # parties of the given aliases
+    def getStoredAliasesOfCounterParties(self, counterPartyAliases) -> list:
+        counterPartyDataBase = CounterPartyDataBase()
+        counterParties = {counterPartyDataBase.getCounterParty(counterPartyAlias) for counterPartyAlias in counterPartyAliases}
+        storedAliases = [row[0] for row in self.connection.execute("SELECT DISTINCT counterPartyAlias FROM transactions")]
+        return [alias for alias in storedAliases if counterPartyDataBase.getCounterParty(alias) in counterParties]
+
+    # Translates the filters of Ledger.getTransactions into a WHERE clause (and its
+    # parameters) over the transactions table
+    def getWhereClause(self,
+                       timeRange = None,
+                       requiredCategory = None,
+                       forbiddenCategory = None,
+                       allowedCategories = None,
+                       requiredTags = None,
+                       forbiddenTags = None,
+                       allowedTags = None,
+                       requiredCounterParty = None,
+                       forbiddenCounterParty = None,
+                       allowedCounterParties = None) -> tuple[str, list]:
+        conditions = list()
+        parameters = list()
+
+        def placeholders(values):
+            return ", ".join("?" for _ in values)
+
+        if timeRange is not None:
+            conditions.append("date BETWEEN ? AND ?")
+            parameters += [dateToText(timeRange.start), dateToText(timeRange.end)]
+
+        if requiredCategory is not None:
+            conditions.append("category IS ?")
+            parameters.append(requiredCategory)
+
+        if forbiddenCategory is not None:
+            conditions.append("category IS NOT ?")
+            parameters.append(forbiddenCategory)
+
+        if allowedCategories is not None:
+            allowedCategories = list(set(allowedCategories))
+            conditions.append(f"category IN ({placeholders(allowedCategories)})")
+            parameters += allowedCategories
+
+        if requiredTags:
+            for tag in set(requiredTags):
+                conditions.append("EXISTS (SELECT 1 FROM transactionTags WHERE transactionId = transactions.id AND tag = ?)")
+                parameters.append(tag)
+
+        if forbiddenTags is not None:
+            forbiddenTags = list(set(forbiddenTags))
+            conditions.append(f"NOT EXISTS (SELECT 1 FROM transactionTags WHERE transactionId = transactions.id AND tag IN ({placeholders(forbiddenTags)}))")
+            parameters += forbiddenTags
+
+        if allowedTags is not None:
+            allowedTags = list(set(allowedTags))
+            conditions.append(f"NOT EXISTS (SELECT 1 FROM transactionTags WHERE transactionId = transactions.id AND tag NOT IN ({placeholders(allowedTags)}))")
+            parameters += allowedTags
+
+        if requiredCounterParty is not None:
+            aliases = self.getStoredAliasesOfCounterParties([requiredCounterParty])
+            conditions.append(f"counterPartyAlias IN ({placeholders(aliases)})")
+            parameters += aliases
+
+        if forbiddenCounterParty is not None:
+            aliases = self.getStoredAliasesOfCounterParties([forbiddenCounterParty])
+            conditions.append(f"counterPartyAlias NOT IN ({placeholders(aliases)})")
+            parameters += aliases
+
+        if allowedCounterParties is not None:
+            aliases = self.getStoredAliasesOfCounterParties(allowedCounterParties)
+            conditions.append(f"counterPartyAlias IN ({placeholders(aliases)})")
+            parameters += aliases
+
+        if not conditions:
+            return "", parameters
+        return "WHERE " + " AND ".join(conditions), parameters
+
+    # Stores every alias in the counter party database, along with the name, tags and
+    # category of its counter party. Aliases already in the store are replaced
+    def saveCounterParties(self):
+        aliasToCounterPartyMap = CounterPartyDataBase().aliasToCounterPartyMap
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO counterParties (alias, name, category) VALUES (?, ?, ?)",
+                                        [(alias, counterParty.name, counterParty.category) for alias, counterParty in aliasToCounterPartyMap.items()])
+            names = list({counterParty.name for counterParty in aliasToCounterPartyMap.values()})
+            self.connection.execute(f"DELETE FROM counterPartyTags WHERE name IN ({', '.join('?' for _ in names)})", names)
+            self.connection.executemany("INSERT OR IGNORE INTO counterPartyTags (name, tag) VALUES (?, ?)",
+                                        [(counterParty.name, tag) for counterParty in set(aliasToCounterPartyMap.values()) for tag in counterParty.tags])
+
+    # Adds the stored counter parties to the counter party database. Aliases that are
+    # already in the database are left as they are, so a populated database takes
+    # precedence over what is stored
+    def loadCounterParties(self):
+        counterPartyDataBase = CounterPartyDataBase()
+        tagsOfName = dict()
+        for name, tag in self.connection.execute("SELECT name, tag FROM counterPartyTags"):
+            tagsOfName.setdefault(name, set()).add(tag)
+        aliasesOfName = dict()
+        categoryOfName = dict()
+        for alias, name, category in self.connection.execute("SELECT alias, name, category FROM counterParties ORDER BY alias = name DESC"):
+            if alias in counterPartyDataBase.aliasToCounterPartyMap:
+                continue
+            aliasesOfName.setdefault(name, list()).append(alias)
+            categoryOfName[name] = category
+        for name, aliases in aliasesOfName.items():
+            counterPartyDataBase.addCounterParty(aliases, tags = tagsOfName.get(name, set()), category = categoryOfName[name])
@@ -0,0 +1,120 @@
+from spendlog.ledgerIndex import MONTH, YEAR
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+import datetime
+
+DAY = "day"
+WEEK = "week"
+FREQUENCIES = (DAY, WEEK, MONTH, YEAR)
+
+class UnknownFrequencyError(Exception):
+    pass
+
+def checkFrequency(frequency):
+    if frequency not in FREQUENCIES:
+        raise UnknownFrequencyError(f"Can't resample by '{frequency}'. Frequency must be one of {FREQUENCIES}")
+
+# The start (midnight) of the day, week (starting on Monday), month or year of the date
+def getPeriodStart(date, frequency) -> datetime.datetime:
+    checkFrequency(frequency)
+    if frequency == YEAR:
+        return datetime.datetime(date.year, 1, 1)
+    if frequency == MONTH:
+        return datetime.datetime(date.year, date.month, 1)
+    day = datetime.datetime(date.year, date.month, date.day)
+    if frequency == WEEK:
+        return day - datetime.timedelta(days = day.weekday())
+    return day
+
+def getNextPeriodStart(periodStart, frequency) -> datetime.datetime:
+    checkFrequency(frequency)
+    if frequency == YEAR:
+        return periodStart.replace(year = periodStart.year + 1)
+    if frequency == MONTH:
+        if periodStart.month == 12:
+            return periodStart.replace(year = periodStart.year + 1, month = 1)
+        return periodStart.replace(month = periodStart.month + 1)
+    if frequency == WEEK:
+        return periodStart + datetime.timedelta(days = 7)
+    return periodStart + datetime.timedelta(days = 1)
+
+# The starts of every period from the one containing start up to and including the one
+# containing end (none if end is before start)
+def getPeriods(start, end, frequency) -> list[datetime.datetime]:
+    periods = list()
+    if end < start:
+        return periods
+    periodStart = getPeriodStart(start, frequency)
+    while periodStart <= end:
+        periods.append(periodStart)
+        periodStart = getNextPeriodStart(periodStart, frequency)
+    return periods
+
+# Liquidity and capital change per period, as returned by Ledger.resample(). Periods are
+# contiguous (periods without transactions have zero totals), and given by their start,
+# so the lists can be plotted against periods directly, e.g.
+#
+#       series = Ledger().resample(MONTH, CATEGORY)
+#       pyplot.plot(series.periods, series.getLiquidityChanges("booze"))
+#
+# A series is kept per key of the dimension it is split by (category, tag or counter
+# party name), or under None if it isn't split. A transaction with several tags counts
+# towards the series of each of its tags.
+class TimeSeries:
+    def __init__(self, frequency, periods, dimension = None):
+        self.frequency = frequency
+        self.periods = periods
+        self.dimension = dimension
+        self.keyToLiquidityChanges = dict()
+        self.keyToCapitalChanges = dict()
+        if dimension is None:
+            self.getKeyLists(None)
+
+    def __str__(self):
+        return f"TimeSeries of {len(self.periods)} {self.frequency}s by {self.dimension}: {sorted(self.keyToLiquidityChanges, key = str)}"
+
+    def __repr__(self):
+        return str(self)
+
+    def __eq__(self, other):
+        return (self.frequency == other.frequency and
+                self.periods == other.periods and
+                self.dimension == other.dimension and
+                self.keyToLiquidityChanges == other.keyToLiquidityChanges and
+                self.keyToCapitalChanges == other.keyToCapitalChanges)
+
+    def getKeyLists(self, key):
+        if key not in self.keyToLiquidityChanges:
+            self.keyToLiquidityChanges[key] = [0] * len(self.periods)
+            self.keyToCapitalChanges[key] = [0] * len(self.periods)
+        return self.keyToLiquidityChanges[key], self.keyToCapitalChanges[key]
+
+    def add(self, key, period, liquidityChange, capitalChange):
+        liquidityChanges, capitalChanges = self.getKeyLists(key)
+        liquidityChanges[period] += liquidityChange
+        capitalChanges[period] += capitalChange
+
+    # Adds whole series (one amount per period) to the series of the key
+    def addSeries(self, key, liquidityChanges, capitalChanges):
+        keyLiquidityChanges, keyCapitalChanges = self.getKeyLists(key)
+        for period, (liquidityChange, capitalChange) in enumerate(zip(liquidityChanges, capitalChanges)):
+            keyLiquidityChanges[period] += liquidityChange
+            keyCapitalChanges[period] += capitalChange
+
+    def getKeys(self) -> list:
+        return list(self.keyToLiquidityChanges)
+
+    def getLiquidityChanges(self, key = None) -> list:
+        return list(self.keyToLiquidityChanges.get(key, [0] * len(self.periods)))
+
+    def getCapitalChanges(self, key = None) -> list:
+        return list(self.keyToCapitalChanges.get(key, [0] * len(self.periods)))
+
+    def getNetChanges(self, key = None) -> list:
+        return [liquidityChange + capitalChange for liquidityChange, capitalChange in zip(self.getLiquidityChanges(key), self.getCapitalChanges(key))]
+
+    def copy(self):
+        timeSeries = TimeSeries(self.frequency, list(self.periods), self.dimension)
+        for key in self.keyToLiquidityChanges:
+            timeSeries.addSeries(key, self.keyToLiquidityChanges[key], self.keyToCapitalChanges[key])
+        return timeSeries
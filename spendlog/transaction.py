@@ -2,22 +2,116 @@ from spendlog.counterParty import CounterPartyDataBase
 from spendlog.loggingProvider import LoggingProvider
 logging = LoggingProvider().logging
 import datetime
+import sys
 from typing import Hashable
 
+# Amounts are kept in minor units (öre), of which there are this many per major unit
+MINOR_UNITS = 100
+
 class FingerprintMismatchError(Exception):
     pass
 
+class AmountPrecisionError(Exception):
+    pass
+
+# Whole minor units of an amount in major units. Floats are rounded to the nearest minor
+# unit (they can't be exact anyway), while exact amounts (int, Decimal, Fraction) must
+# be whole minor units
+def toMinorUnits(amount) -> int:
+    if isinstance(amount, int):
+        return amount * MINOR_UNITS
+    if isinstance(amount, float):
+        return int(round(amount * MINOR_UNITS))
+    minorUnits = amount * MINOR_UNITS
+    if minorUnits != int(minorUnits):
+        raise AmountPrecisionError(f"Amounts must be whole minor units (1/{MINOR_UNITS}), got '{amount}'")
+    return int(minorUnits)
+
+# The amount in major units: an int when it is whole, otherwise the nearest float, the
+# same types amounts had before they were kept in minor units, so that e.g. transaction
+# modifiers can keep doing float arithmetic on them. Converting back with toMinorUnits
+# gives the same minor units. Sums should be taken in minor units and converted once
+# (as the ledger does), since floats don't add up exactly
+def fromMinorUnits(minorUnits):
+    if minorUnits % MINOR_UNITS == 0:
+        return minorUnits // MINOR_UNITS
+    return minorUnits / MINOR_UNITS
+
+# Transactions share equal dates, tag sets and strings, rather than each holding copies
+# of their own. Tags are interned as frozensets, so they can't be changed through one of
+# the transactions sharing them (use setTags). Only dates of whole days (e.g. as parsed
+# from statements) are interned, as there are only so many of them. The interned
+# values are kept for good, so interning timestamps (e.g. the default of now), which
+# are mostly unique, would only grow the table
+internedDates = dict()
+internedTags = dict()
+MIDNIGHT = datetime.time()
+
+def internDate(date):
+    if type(date) is datetime.datetime and date.time() != MIDNIGHT:
+        return date
+    return internedDates.setdefault(date, date)
+
+def internTags(tags):
+    tags = frozenset(tags)
+    return internedTags.setdefault(tags, tags)
+
+def internString(string):
+    if type(string) is str:
+        return sys.intern(string)
+    return string
+
+# A transaction has no instance __dict__, only the slots below. Amounts are stored as
+# ints of minor units (see toMinorUnits), so the ledger can add them up exactly, and
+# read and written in major units through the getters and setters (and the
+# liquidityChange and capitalChange properties). They read as an int or float (see
+# fromMinorUnits), and can be written as any number, with floats rounded to the nearest
+# minor unit. Dates, tags, categories and aliases are interned
+# (see above) when set. Fields must be changed through the setters (or properties), as
+# they drop the cached hash (see __hash__).
+#
+# A transaction also keeps what it was constructed from (its source), so that it can be
+# derived again when its counter party changes (see rederive). Most transactions are
+# constructed from just an alias and amounts that the transaction modifier leaves as they
+# are, so then the source is just the alias as given, and the amounts and date are read
+# from the transaction itself (until changed through a setter, which first expands the
+# source to hold them). Otherwise it is a tuple of the alias, tags and category as given
+# (None if not given), followed by the amounts (in minor units) and date before the
+# modifier, if the modifier changed them. The generation of the counter party database
+# the fields were derived in is kept along with the source (see isStale).
+# Transactions recreated with fromFields have no source, and can't be derived again.
 class Transaction:
+    __slots__ = ("_liquidityChangeMinor",
+                 "_capitalChangeMinor",
+                 "_counterPartyAlias",
+                 "_tags",
+                 "_category",
+                 "_date",
+                 "_fingerPrint",
+                 "_hash",
+                 "_source",
+                 "_derivedGeneration",
+                 "counterParty",
+                 "counterPartyGeneration")
 
+    # The hash is computed once, and only computed again after one of the fields it is
+    # computed from has been set (every setter drops it). Without a fingerprint, it is
+    # computed from the fields, with the tags as a frozenset, so it doesn't depend on
+    # the order the tags were given in
     def __hash__(self):
-        if self.fingerPrint is not None:
-            return hash(self.fingerPrint)
-        return hash((self.liquidityChange,
-                     self.capitalChange,
-                     self.counterPartyAlias,
-                     self.date,
-                     tuple(self.tags),
-                     self.category))
+        hashValue = self._hash
+        if hashValue is None:
+            if self._fingerPrint is not None:
+                hashValue = hash(self._fingerPrint)
+            else:
+                hashValue = hash((self._liquidityChangeMinor,
+                                  self._capitalChangeMinor,
+                                  self._counterPartyAlias,
+                                  self._date,
+                                  self._tags,
+                                  self._category))
+            self._hash = hashValue
+        return hashValue
 
     def __eq__(self, other):
         if self.fingerPrint is None or other.fingerPrint is None:
@@ -25,10 +119,10 @@ class Transaction:
         if self.fingerPrint == other.fingerPrint:
             anyDiffer = False
             errorString = ""
-            if self.liquidityChange != other.liquidityChange:
+            if self._liquidityChangeMinor != other._liquidityChangeMinor:
                 anyDiffer = True
                 errorString +=f"\nFingerprint matches but liquidityChange differs!\nself: '{self.liquidityChange}',\nother: '{other.liquidityChange}'"
-            if self.capitalChange != other.capitalChange:
+            if self._capitalChangeMinor != other._capitalChangeMinor:
                 anyDiffer = True
                 errorString +=f"\nFingerprint matches but capitalChange differs!\nself: '{self.capitalChange}',\nother: '{other.capitalChange}'"
             if self.counterPartyAlias != other.counterPartyAlias:
@@ -49,70 +143,260 @@ class Transaction:
         return False
 
     def __str__(self):
-        return f"Money spent: {self.liquidityChange}; Capital gain: {self.capitalChange}; Counter Party:{self.counterPartyAlias}; transaction date: {self.date}; tags: {self.tags}; category: {self.category}"
+        return f"Money spent: {self.liquidityChange}; Capital gain: {self.capitalChange}; Counter Party:{self.counterPartyAlias}; transaction date: {self.date}; tags: {set(self.tags)}; category: {self.category}"
 
     def __repr__(self):
         return str(self)
 
     def __init__(self, liquidityChange = None, capitalChange = None, counterPartyAlias = None, tags = None, category = None, date = None, fingerPrint = None):
-        if liquidityChange is None:
-            self.liquidityChange = 0
-        else:
-            self.liquidityChange = liquidityChange
-
-        if capitalChange is None:
-            self.capitalChange = 0
-        else:
-            self.capitalChange = capitalChange
-
-        if counterPartyAlias is None:
-            counterPartyAlias = ""
-        else:
-            self.counterPartyAlias = CounterPartyDataBase().getCounterParty(counterPartyAlias).name
-
-        if tags is None:
-            self.tags = self.getCounterParty().tags
-        else:
-            self.tags = tags
+        self.initialize(CounterPartyDataBase(), liquidityChange, capitalChange, counterPartyAlias, tags, category, date, fingerPrint)
+        if fingerPrint is None:
+            logging.warning("Instantiating transaction without fingerprint! This can be risky!")
 
-        self.category = category
-        if category is None:
-            self.category = self.getCounterParty().category
-        if self.category is None:
-            self.category = "uncategorized"
+    # Sets the fields, with the tags and category defaulting to those of the counter party,
+    # and then applies its transaction modifier. The counter party is resolved once, and
+    # kept as the cached one (see getCounterParty)
+    def initialize(self, counterPartyDataBase, liquidityChange = None, capitalChange = None, counterPartyAlias = None, tags = None, category = None, date = None, fingerPrint = None):
+        with CounterPartyDataBase.lock:
+            counterParty = counterPartyDataBase.getCounterParty("" if counterPartyAlias is None else counterPartyAlias)
+            generation = CounterPartyDataBase.generation
+        self.initializeResolved(counterParty, generation, liquidityChange, capitalChange, counterPartyAlias, tags, category, date, fingerPrint)
+
+    # Same as initialize, with the counter party the alias resolved to in the given
+    # generation of the counter party database
+    def initializeResolved(self, counterParty, generation, liquidityChange = None, capitalChange = None, counterPartyAlias = None, tags = None, category = None, date = None, fingerPrint = None):
+        counterPartyAlias = internString("" if counterPartyAlias is None else counterPartyAlias)
+        self._source = None
+        self._derivedGeneration = generation
+        self.liquidityChange = 0 if liquidityChange is None else liquidityChange
+        self.capitalChange = 0 if capitalChange is None else capitalChange
+        self.counterPartyAlias = counterParty.name
+        self.counterParty = counterParty
+        self.counterPartyGeneration = generation
+        self.tags = counterParty.tags if tags is None else tags
 
-        if date is None:
-            self.date = datetime.datetime.now()
-        else:
-            self.date = date
+        resolvedCategory = counterParty.category if category is None else category
+        self.category = "uncategorized" if resolvedCategory is None else resolvedCategory
 
-        self.getCounterParty().transactionModifier(self)
+        self.date = datetime.datetime.now() if date is None else date
+
+        source = (counterPartyAlias,
+                  None if tags is None else internTags(tags),
+                  None if category is None else internString(category),
+                  self._liquidityChangeMinor,
+                  self._capitalChangeMinor,
+                  self._date)
+        counterParty.transactionModifier(self)
+        if source[3:] == (self._liquidityChangeMinor, self._capitalChangeMinor, self._date):
+            source = counterPartyAlias if tags is None and category is None else source[:3]
+        self._source = source
         assert isinstance(fingerPrint, Hashable), "Transaction fingerprint must be hashable!"
-        if fingerPrint is None:
-            logging.warning("Instantiating transaction without fingerprint! This can be risky!")
         self.fingerPrint = fingerPrint
 
+    # Derives the fields again from the source, the same as when the transaction was
+    # constructed, but with the counter party the alias resolves to now, and its current
+    # tags, category and transaction modifier. Changes made through the setters since
+    # are lost. Returns False (and changes nothing) if the transaction has no source.
+    #
+    # The hash may change, so the transaction must not be in any set or index meanwhile
+    def rederive(self) -> bool:
+        source = self._source
+        if source is None:
+            return False
+        if type(source) is str:
+            source = (source, None, None)
+        if len(source) == 3:
+            source += (self._liquidityChangeMinor, self._capitalChangeMinor, self._date)
+        counterPartyAlias, tags, category, liquidityChangeMinor, capitalChangeMinor, date = source
+        self.initialize(CounterPartyDataBase(),
+                        fromMinorUnits(liquidityChangeMinor),
+                        fromMinorUnits(capitalChangeMinor),
+                        counterPartyAlias,
+                        tags,
+                        category,
+                        date,
+                        self._fingerPrint)
+        return True
+
+    # Whether the counter party database has changed since the fields were derived, so
+    # that rederive may give different fields. Never for a transaction without a source
+    def isStale(self) -> bool:
+        return self._source is not None and self._derivedGeneration != CounterPartyDataBase.generation
+
+    # The alias the transaction was constructed with (before resolving it to the name of
+    # its counter party), or None if it has no source
+    def getSourceAlias(self):
+        source = self._source
+        if type(source) is str:
+            return source
+        return None if source is None else source[0]
+
+    # Called before the amounts or date change, while the source relies on them
+    def expandSource(self):
+        source = self._source
+        if type(source) is str:
+            source = (source, None, None)
+        if source is not None and len(source) == 3:
+            self._source = source + (self._liquidityChangeMinor, self._capitalChangeMinor, self._date)
+
+    # Constructs a batch of transactions, each given as a mapping of the keyword arguments
+    # for Transaction, the same as Transaction(**record) would. The distinct aliases of the
+    # batch are resolved first, in one go, and missing fingerprints are warned about once
+    # for the whole batch rather than once per transaction. The counter party database is
+    # only locked while the aliases are resolved, not while the transactions are
+    # constructed and their modifiers run, so a large batch doesn't block other threads
+    # resolving counter parties for long. This is the path parsers and bulk ingest
+    # should take
+    @classmethod
+    def fromRecords(cls, records) -> list:
+        counterPartyDataBase = CounterPartyDataBase()
+        records = list(records)
+        aliases = ["" if record.get("counterPartyAlias") is None else record["counterPartyAlias"] for record in records]
+        with CounterPartyDataBase.lock:
+            counterPartyOfAlias = {alias : counterPartyDataBase.getCounterParty(alias) for alias in set(aliases)}
+            generation = CounterPartyDataBase.generation
+        transactions = list()
+        nWithoutFingerPrint = 0
+        for record, alias in zip(records, aliases):
+            transaction = cls.__new__(cls)
+            transaction.initializeResolved(counterPartyOfAlias[alias], generation, **record)
+            if transaction.fingerPrint is None:
+                nWithoutFingerPrint += 1
+            transactions.append(transaction)
+        if nWithoutFingerPrint:
+            logging.warning(f"Instantiating {nWithoutFingerPrint} of {len(transactions)} transactions without fingerprint! This can be risky!")
+        return transactions
+
+    # Recreates a transaction from values that have already been resolved once (e.g. ones
+    # that were persisted), without looking up defaults in the counter party database or
+    # applying the transaction modifier of the counter party again. Amounts are in minor
+    # units, as stored
+    @classmethod
+    def fromFields(cls, liquidityChangeMinor, capitalChangeMinor, counterPartyAlias, tags, category, date, fingerPrint):
+        transaction = cls.__new__(cls)
+        transaction._source = None
+        transaction._derivedGeneration = None
+        transaction._liquidityChangeMinor = liquidityChangeMinor
+        transaction._capitalChangeMinor = capitalChangeMinor
+        transaction._hash = None
+        transaction.counterPartyAlias = counterPartyAlias
+        transaction.tags = tags
+        transaction.category = category
+        transaction.date = date
+        transaction.fingerPrint = fingerPrint
+        transaction.counterParty = None
+        transaction.counterPartyGeneration = None
+        return transaction
+
+    @property
+    def liquidityChange(self):
+        return fromMinorUnits(self._liquidityChangeMinor)
+
+    @liquidityChange.setter
+    def liquidityChange(self, liquidityChange):
+        self.expandSource()
+        self._liquidityChangeMinor = toMinorUnits(liquidityChange)
+        self._hash = None
+
+    @property
+    def capitalChange(self):
+        return fromMinorUnits(self._capitalChangeMinor)
+
+    @capitalChange.setter
+    def capitalChange(self, capitalChange):
+        self.expandSource()
+        self._capitalChangeMinor = toMinorUnits(capitalChange)
+        self._hash = None
+
+    @property
+    def fingerPrint(self):
+        return self._fingerPrint
+
+    @fingerPrint.setter
+    def fingerPrint(self, fingerPrint):
+        self._fingerPrint = fingerPrint
+        self._hash = None
+
+    # Changing the alias drops the cached counter party (see getCounterParty)
+    @property
+    def counterPartyAlias(self):
+        return self._counterPartyAlias
+
+    @counterPartyAlias.setter
+    def counterPartyAlias(self, counterPartyAlias):
+        self._counterPartyAlias = internString(counterPartyAlias)
+        self.counterPartyGeneration = None
+        self._hash = None
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = internTags(tags)
+        self._hash = None
+
+    @property
+    def category(self):
+        return self._category
+
+    @category.setter
+    def category(self, category):
+        self._category = internString(category)
+        self._hash = None
+
+    @property
+    def date(self):
+        return self._date
+
+    @date.setter
+    def date(self, date):
+        self.expandSource()
+        self._date = internDate(date)
+        self._hash = None
 
     def getLiquidityChange(self):
-        return self.liquidityChange
+        return fromMinorUnits(self._liquidityChangeMinor)
 
     def getCapitalChange(self):
-        return self.capitalChange
+        return fromMinorUnits(self._capitalChangeMinor)
 
     def getNetChange(self):
-        return self.liquidityChange + self.capitalChange
+        return fromMinorUnits(self._liquidityChangeMinor + self._capitalChangeMinor)
+
+    def getLiquidityChangeMinor(self) -> int:
+        return self._liquidityChangeMinor
+
+    def getCapitalChangeMinor(self) -> int:
+        return self._capitalChangeMinor
 
+    def getNetChangeMinor(self) -> int:
+        return self._liquidityChangeMinor + self._capitalChangeMinor
+
+    # The counter party the alias resolves to is cached, along with the generation of the
+    # counter party database it was resolved in, and only resolved again once the
+    # database has changed
     def getCounterParty(self):
-        return CounterPartyDataBase().getCounterParty(self.counterPartyAlias)
+        if self.counterPartyGeneration != CounterPartyDataBase.generation:
+            with CounterPartyDataBase.lock:
+                self.counterParty = CounterPartyDataBase().getCounterParty(self.counterPartyAlias)
+                self.counterPartyGeneration = CounterPartyDataBase.generation
+        return self.counterParty
+
+    # Integer id of the counter party (see CounterPartyDataBase), for comparing counter
+    # parties by identity
+    def getCounterPartyId(self) -> int:
+        return self.getCounterParty().id
 
     def getTags(self):
-        return self.tags
+        return self._tags
 
     def getCategory(self):
-        return self.category
+        return self._category
 
     def getDate(self):
-        return self.date
+        return self._date
 
     def setLiquidityChange(self, liquidityChange):
         self.liquidityChange = liquidityChange
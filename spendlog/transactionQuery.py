@@ -0,0 +1,161 @@
+from spendlog.loggingProvider import LoggingProvider
+logging = LoggingProvider().logging
+from spendlog.transaction import fromMinorUnits
+from itertools import groupby, islice
+import heapq
+
+LIQUIDITY_CHANGE = "liquidityChange"
+CAPITAL_CHANGE = "capitalChange"
+NET_CHANGE = "netChange"
+AMOUNTS = (LIQUIDITY_CHANGE, CAPITAL_CHANGE, NET_CHANGE)
+
+# What each amount is read from on a transaction, in minor units, for summing exactly
+AMOUNTS_IN_MINOR_UNITS = {LIQUIDITY_CHANGE : lambda transaction : transaction.getLiquidityChangeMinor(),
+                          CAPITAL_CHANGE   : lambda transaction : transaction.getCapitalChangeMinor(),
+                          NET_CHANGE       : lambda transaction : transaction.getNetChangeMinor()}
+
+# What each key that a query can be ordered by is read from on a transaction
+ORDER_KEYS = {"date"              : lambda transaction : transaction.getDate(),
+              LIQUIDITY_CHANGE    : lambda transaction : transaction.getLiquidityChange(),
+              CAPITAL_CHANGE      : lambda transaction : transaction.getCapitalChange(),
+              NET_CHANGE          : lambda transaction : transaction.getNetChange(),
+              "counterPartyAlias" : lambda transaction : transaction.counterPartyAlias,
+              "category"          : lambda transaction : transaction.getCategory()}
+
+class UnknownOrderKeyError(Exception):
+    pass
+
+class UnknownAmountError(Exception):
+    pass
+
+class InvalidLimitError(Exception):
+    pass
+
+# Lazy query over the ledger, taking the same filters as Ledger.getTransactions (see
+# Ledger.query). Nothing is looked up until the query is used, and then only as much as
+# needed: count() and sum() never collect the matching transactions, and a limited
+# query stops looking once it has found enough. materialize() collects them into a
+# list, in order.
+#
+# orderBy and limit return new queries, so a query can be refined without changing it.
+# Queries ordered by date stream from the date index; any other order has to see every
+# matching transaction before it knows the first, but with a limit only the first n are
+# kept at a time.
+#
+# Iterating a query copies the candidates of its plan (e.g. the slice of the date index
+# in its time range) under the read lock, and then filters them lazily, outside the
+# lock. So a paused or abandoned iteration never blocks writers, and the ledger can be
+# changed while iterating, even from the same thread (see readWriteLock.py).
+# Which transactions are candidates is decided when an iteration starts, so ones added
+# later aren't seen by it, but the filters that the candidates don't already satisfy by
+# construction are applied to each candidate as it is reached.
+class TransactionQuery:
+    def __init__(self, ledger, filters, orderKeys = (), descending = False, maxCount = None):
+        self.ledger = ledger
+        self.filters = filters
+        self.orderKeys = orderKeys
+        self.descending = descending
+        self.maxCount = maxCount
+
+    # Orders by one or more keys, each either the name of a field (see ORDER_KEYS) or a
+    # function from transaction to key. Later keys break ties of earlier ones
+    def orderBy(self, *keys, descending = False):
+        for key in keys:
+            if not callable(key) and key not in ORDER_KEYS:
+                raise UnknownOrderKeyError(f"Can't order by '{key}'. Key must be a function or one of {tuple(ORDER_KEYS)}")
+        return TransactionQuery(self.ledger, self.filters, tuple(keys), descending, self.maxCount)
+
+    # At most maxCount transactions, which must not be negative. A limit of 0 matches
+    # nothing, without looking at the ledger
+    def limit(self, maxCount):
+        if maxCount < 0:
+            raise InvalidLimitError(f"Can't limit a query to {maxCount} transactions. The limit must not be negative")
+        if self.maxCount is not None:
+            maxCount = min(maxCount, self.maxCount)
+        return TransactionQuery(self.ledger, self.filters, self.orderKeys, self.descending, maxCount)
+
+    def __iter__(self):
+        if self.maxCount == 0:
+            return iter(())
+        with self.ledger.lock.reading():
+            plan = self.planQuery().copy()
+        return self.iterate(plan)
+
+    def planQuery(self):
+        return self.ledger.planQuery(**self.filters, orderedByDate = bool(self.orderKeys) and self.orderKeys[0] == "date")
+
+    # Iterates the plan of the query. Unless the sources of the plan are copies, the
+    # ledger must be read locked until done
+    def iterate(self, plan):
+        if not self.orderKeys:
+            transactions = plan.iterate()
+        elif self.orderKeys[0] == "date":
+            transactions = self.iterateByDate(plan)
+        elif self.maxCount is not None:
+            transactions = self.getSmallest(plan.iterate(), self.maxCount)
+        else:
+            transactions = sorted(plan.iterate(), key = self.getSortKey(), reverse = self.descending)
+        if self.maxCount is not None:
+            transactions = islice(transactions, self.maxCount)
+        return transactions
+
+    # The date index is already sorted, so only transactions on the same date need to
+    # be sorted by the remaining keys
+    def iterateByDate(self, plan):
+        transactions = plan.iterate()
+        if self.descending:
+            transactions = (transaction for source in plan.sources for transaction in reversed(source)
+                            if all(predicate(transaction) for predicate in plan.predicates))
+        if len(self.orderKeys) == 1:
+            yield from transactions
+            return
+        sortKey = self.getSortKey(self.orderKeys[1:])
+        for _, sameDateTransactions in groupby(transactions, key = lambda transaction : transaction.getDate()):
+            yield from sorted(sameDateTransactions, key = sortKey, reverse = self.descending)
+
+    def getSmallest(self, transactions, n) -> list:
+        if self.descending:
+            return heapq.nlargest(n, transactions, key = self.getSortKey())
+        return heapq.nsmallest(n, transactions, key = self.getSortKey())
+
+    def getSortKey(self, orderKeys = None):
+        if orderKeys is None:
+            orderKeys = self.orderKeys
+        getters = [key if callable(key) else ORDER_KEYS[key] for key in orderKeys]
+        if len(getters) == 1:
+            return getters[0]
+        return lambda transaction : tuple(getter(transaction) for getter in getters)
+
+    def count(self) -> int:
+        if self.maxCount == 0:
+            return 0
+        with self.ledger.lock.reading():
+            plan = self.ledger.planQuery(**self.filters)
+            if plan.predicates:
+                count = sum(1 for _ in plan.iterate())
+            else:
+                # sources never overlap, so no need to look at what's in them
+                count = sum(len(source) for source in plan.sources)
+        if self.maxCount is not None:
+            return min(count, self.maxCount)
+        return count
+
+    # Total liquidity, capital or net change (see AMOUNTS) of the matching transactions.
+    # Unless the query is limited, this is the same as Ledger.getTotal*
+    def sum(self, amount = LIQUIDITY_CHANGE):
+        if amount not in AMOUNTS:
+            raise UnknownAmountError(f"Can't sum '{amount}'. Amount must be one of {AMOUNTS}")
+        if self.maxCount is None:
+            if amount == LIQUIDITY_CHANGE:
+                return self.ledger.getTotalLiquidityChange(**self.filters)
+            if amount == CAPITAL_CHANGE:
+                return self.ledger.getTotalCapitalChange(**self.filters)
+            return self.ledger.getTotalNetChange(**self.filters)
+        getAmount = AMOUNTS_IN_MINOR_UNITS[amount]
+        return fromMinorUnits(sum(getAmount(transaction) for transaction in self))
+
+    def materialize(self) -> list:
+        if self.maxCount == 0:
+            return list()
+        with self.ledger.lock.reading():
+            return list(self.iterate(self.planQuery()))
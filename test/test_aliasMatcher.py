@@ -0,0 +1,57 @@
+from test.test_spendlog import TestSpendlog
+from spendlog.aliasMatcher import AliasMatcher, AliasRuleError, getRegexLiteralPrefix, getWildcardLiteralPrefix
+
+class TestAliasMatcher(TestSpendlog):
+
+    def testLiteralPrefixes(self):
+        self.assertEqual(getWildcardLiteralPrefix("ICA NARA*"), "ICA NARA")
+        self.assertEqual(getWildcardLiteralPrefix("Henkes Keba?"), "Henkes Keba")
+        self.assertEqual(getWildcardLiteralPrefix("*KEBAB*"), "")
+        self.assertEqual(getRegexLiteralPrefix("ICA NARA [0-9]+ .*"), "ICA NARA ")
+        self.assertEqual(getRegexLiteralPrefix("SYSTEMBOLAGET?"), "SYSTEMBOLAGE")
+        self.assertEqual(getRegexLiteralPrefix("AB{2}"), "A")
+        self.assertEqual(getRegexLiteralPrefix("ICA|COOP"), "")
+        self.assertEqual(getRegexLiteralPrefix("(?i:ica).*"), "")
+
+    def testMatch(self):
+        matcher = AliasMatcher()
+        self.assertIsNone(matcher.match("ICA NARA 1234 STOCKHOLM"))
+        matcher.addPrefix("ICA", "ica")
+        matcher.addPrefix("ICA NARA", "ica nara")
+        matcher.addWildcard("ICA*GOTEBORG", "ica goteborg")
+        matcher.addWildcard("Henkes Keba?", "henkes")
+        matcher.addWildcard("*KEBAB*", "kebab")
+        matcher.addRegex(r"SL [0-9]{4}", "sl")
+        matcher.addRegex(r"(?i:coop)( [a-z]+)*", "coop")
+
+        # the longest literal prefix wins
+        self.assertEqual(matcher.match("ICA NARA 1234 STOCKHOLM"), "ica nara")
+        self.assertEqual(matcher.match("ICA MAXI 99 STOCKHOLM"), "ica")
+        self.assertEqual(matcher.match("ICA MAXI 99 GOTEBORG"), "ica goteborg")
+        self.assertEqual(matcher.match("ICA NARA 99 GOTEBORG"), "ica nara")
+        self.assertEqual(matcher.match("ICA"), "ica")
+        self.assertIsNone(matcher.match("IC"))
+
+        # wildcards and regexes match the whole alias
+        self.assertEqual(matcher.match("Henkes Keba*"), "henkes")
+        self.assertIsNone(matcher.match("Henkes Kebab 1"))
+        self.assertEqual(matcher.match("KEBAB KUNGEN"), "kebab")
+        self.assertEqual(matcher.match("BEST KEBAB"), "kebab")
+        self.assertEqual(matcher.match("SL 1234"), "sl")
+        self.assertIsNone(matcher.match("SL 12345"))
+        self.assertEqual(matcher.match("COOP forum"), "coop")
+        self.assertEqual(matcher.match("Coop"), "coop")
+        self.assertIsNone(matcher.match("COOP FORUM"))
+
+        # among rules with the same literal prefix, the first one added wins
+        matcher.addWildcard("SL *", "sl wildcard")
+        self.assertEqual(matcher.match("SL 1234"), "sl")
+        self.assertEqual(matcher.match("SL 12345"), "sl wildcard")
+
+    def testInvalidRegexes(self):
+        matcher = AliasMatcher()
+        for regex in ["ICA (", "(?i)ica", "(?P<store>ICA)", r"(ICA)\1"]:
+            with self.assertRaises(AliasRuleError):
+                matcher.addRegex(regex, "ica")
+        matcher.addRegex(r"(ICA) \\1", "ica")
+        self.assertEqual(matcher.match("ICA \\1"), "ica")
@@ -0,0 +1,73 @@
+import unittest
+from decimal import Decimal
+from test.test_spendlog import TestSpendlog
+from spendlog.columnarStore import ColumnarStore, numpy
+from spendlog.ledger import TimeRange
+from spendlog.transaction import Transaction
+from spendlog.transactionQuery import LIQUIDITY_CHANGE
+
+@unittest.skipIf(numpy is None, "columnar storage requires numpy")
+class TestColumnarStore(TestSpendlog):
+
+    def testAddRemoveAndGrow(self):
+        store = ColumnarStore()
+        transactions = [Transaction(i, -i, f"alias {i % 3}", [f"tag {i % 100}"], "booze", self.strToDateTime("2025-01-24"), i) for i in range(3000)]
+        for transaction in transactions:
+            store.add(transaction)
+
+        # more rows than the initial capacity, and more tags than fit in one word
+        self.assertEqual(store.size, len(transactions))
+        self.assertEqual(store.tagMasks.shape[1], 2)
+
+        mask = store.getMask()
+        self.assertEqual(store.getTotalLiquidityChange(mask), sum(range(3000)))
+        self.assertEqual(store.getTotalCapitalChange(mask), -sum(range(3000)))
+        self.assertEqual(store.getTransactions(mask), set(transactions))
+
+        mask = store.getMask(requiredTags = ["tag 99"])
+        self.assertEqual(store.getTransactions(mask), {transaction for transaction in transactions if transaction.tags == {"tag 99"}})
+        mask = store.getMask(requiredTags = ["tag 99", "unknown tag"])
+        self.assertEqual(store.getTransactions(mask), set())
+        mask = store.getMask(allowedTags = ["tag 1", "tag 70"])
+        self.assertEqual(store.getTotalLiquidityChange(mask), sum(i for i in range(3000) if i % 100 in (1, 70)))
+
+        # removed rows are never matched
+        store.remove(transactions[1])
+        mask = store.getMask(requiredCounterPartyAliases = ["alias 1"])
+        self.assertEqual(store.getTotalLiquidityChange(mask), sum(i for i in range(3000) if i % 3 == 1) - 1)
+        self.assertNotIn(transactions[1], store.getTransactions(store.getMask()))
+
+        mask = store.getMask(timeRange = TimeRange(self.strToDateTime("2025-01-25"), self.strToDateTime("2025-01-26")))
+        self.assertEqual(store.getTransactions(mask), set())
+
+    def testMinorUnitAmounts(self):
+        store = ColumnarStore()
+        store.add(Transaction(1.5, 0, "alias", [], "booze", self.strToDateTime("2025-01-24"), 1))
+        store.add(Transaction(Decimal("-0.25"), Decimal("0.01"), "alias", [], "booze", self.strToDateTime("2025-01-24"), 2))
+        mask = store.getMask()
+        self.assertEqual(store.getTotalLiquidityChange(mask), 1.25)
+        self.assertEqual(store.getTotalCapitalChange(mask), 0.01)
+
+    def testCompactsDeadRows(self):
+        store = ColumnarStore()
+        transactions = [Transaction(i, 0, f"alias {i % 3}", [f"tag {i % 2}"], "booze", self.strToDateTime("2025-01-24"), i) for i in range(100)]
+        store.addAll(transactions)
+        # removing and adding back the same transactions (as when reclassifying them) keeps
+        # the store from growing past a fraction of dead rows
+        for _ in range(10):
+            for transaction in transactions[:50]:
+                store.remove(transaction)
+            store.addAll(transactions[:50])
+            self.assertLessEqual(store.nDeadRows, store.size * 0.25)
+            self.assertLessEqual(store.size, 150)
+
+        self.assertEqual(store.getTransactions(store.getMask()), set(transactions))
+        self.assertEqual(store.getTotalLiquidityChange(store.getMask()), sum(range(100)))
+        mask = store.getMask(requiredTags = ["tag 1"], requiredCounterPartyAliases = ["alias 2"])
+        self.assertEqual(store.getTotalLiquidityChange(mask), sum(i for i in range(100) if i % 2 == 1 and i % 3 == 2))
+        self.assertEqual(store.getTopTransactions(store.getMask(), LIQUIDITY_CHANGE, 3), transactions[:-4:-1])
+
+        # every live row can still be removed after compacting
+        for transaction in transactions:
+            store.remove(transaction)
+        self.assertEqual(store.getTransactions(store.getMask()), set())
@@ -1,5 +1,8 @@
 from test.test_spendlog import TestSpendlog
+from spendlog.aliasMatcher import AliasRuleError
 from spendlog.counterParty import CounterParty, CounterPartyDataBase, NameMismatchError
+from spendlog.ledger import Ledger
+from spendlog.transaction import Transaction
 
 class TestCounterParty(TestSpendlog):
 
@@ -125,3 +128,99 @@ class TestCounterPartyDataBase(TestSpendlog):
         self.assertIsNot(counterPartyA, counterPartyASecond)
         with self.assertRaises(NameMismatchError):
             counterPartyASecond == counterPartyA
+
+    def testCounterPartyIds(self):
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"])
+        counterParty = CounterPartyDataBase().getCounterParty("alias")
+        self.assertIsNotNone(counterParty.id)
+        self.assertEqual(CounterPartyDataBase().getCounterParty("alias alias").id, counterParty.id)
+        self.assertNotEqual(CounterPartyDataBase().getCounterParty("other alias").id, counterParty.id)
+        self.assertIsNone(CounterParty("alias").id)
+
+        # the transaction resolves its counter party once, until the database changes
+        transaction = Transaction(1, counterPartyAlias = "alias alias", fingerPrint = 1)
+        self.assertIs(transaction.getCounterParty(), counterParty)
+        self.assertEqual(transaction.getCounterPartyId(), counterParty.id)
+        CounterPartyDataBase().aliasToCounterPartyMap["alias"] = CounterParty("sneaky")
+        self.assertIs(transaction.getCounterParty(), counterParty)
+        CounterPartyDataBase().addCounterParty(["alias", "new alias"])
+        self.assertIsNot(transaction.getCounterParty(), counterParty)
+        self.assertEqual(transaction.getCounterParty().name, "alias")
+
+        # only changing what an already resolved alias resolves to bumps the generation
+        generation = CounterPartyDataBase.generation
+        CounterPartyDataBase().getCounterParty("auto-added alias")
+        CounterPartyDataBase().addCounterParty(["unseen alias"], prefixes = ["unseen "])
+        self.assertEqual(CounterPartyDataBase.generation, generation)
+        CounterPartyDataBase().addCounterParty(["auto-added alias"], category = "booze")
+        self.assertEqual(CounterPartyDataBase.generation, generation + 1)
+        CounterPartyDataBase().getCounterParty("unseen 1")
+        CounterPartyDataBase().addCounterParty(["unseen 1 rule"], prefixes = ["unseen 1"])
+        self.assertEqual(CounterPartyDataBase.generation, generation + 2)
+
+        # ids are never reused, and a reset database never looks like the one a
+        # transaction resolved its counter party in
+        generation = CounterPartyDataBase.generation
+        CounterPartyDataBase().reset()
+        self.assertNotEqual(CounterPartyDataBase().generation, generation)
+        newCounterParty = CounterPartyDataBase().getCounterParty("alias")
+        self.assertNotEqual(newCounterParty.id, counterParty.id)
+        self.assertIs(transaction.getCounterParty(), newCounterParty)
+
+    def testAliasRules(self):
+        CounterPartyDataBase().addCounterParty(["ICA"], tags = {"food"}, category = "groceries", prefixes = ["ICA "])
+        CounterPartyDataBase().addCounterParty(["Henkes"], wildcards = ["Henkes Keba?"], regexes = [r"HENKES [0-9]+"])
+        ica = CounterPartyDataBase().getCounterParty("ICA")
+        henkes = CounterPartyDataBase().getCounterParty("Henkes")
+        self.assertIs(CounterPartyDataBase().getCounterParty("ICA NARA 1234 STOCKHOLM"), ica)
+        self.assertIs(CounterPartyDataBase().getCounterParty("Henkes Keba*"), henkes)
+        self.assertIs(CounterPartyDataBase().getCounterParty("HENKES 12"), henkes)
+        self.assertIsNone(CounterPartyDataBase().findCounterParty("HENKES KEBAB"))
+        # matched aliases are remembered, but not added as aliases
+        self.assertIs(CounterPartyDataBase().matchedAliases["ICA NARA 1234 STOCKHOLM"], ica)
+        self.assertEqual(CounterPartyDataBase().getAllCounterPartyAliases(), {"ICA", "Henkes"})
+
+        # transactions take the counter party, and its defaults, from the rule
+        transaction = Transaction(-100, counterPartyAlias = "ICA MAXI 99", fingerPrint = 1)
+        self.assertEqual(transaction.counterPartyAlias, "ICA")
+        self.assertEqual(transaction.getCategory(), "groceries")
+        self.assertEqual(transaction.getTags(), {"food"})
+
+        # aliases that didn't match any rule were added, but give way to later rules
+        coop = CounterPartyDataBase().getCounterParty("COOP FORUM 12")
+        self.assertEqual(coop.name, "COOP FORUM 12")
+        Ledger().addTransaction(-200, counterPartyAlias = "COOP FORUM 12", fingerPrint = 2)
+        CounterPartyDataBase().addCounterParty(["COOP"], category = "groceries", wildcards = ["COOP *"])
+        self.assertIs(CounterPartyDataBase().getCounterParty("COOP FORUM 12"), CounterPartyDataBase().getCounterParty("COOP"))
+        self.assertNotIn("COOP FORUM 12", CounterPartyDataBase().getAllCounterPartyAliases())
+        self.assertEqual(Ledger().getTotalLiquidityChange(requiredCounterParty = "COOP"), -200)
+        # but aliases added explicitly don't
+        CounterPartyDataBase().addCounterParty(["COOP KONSUM"])
+        CounterPartyDataBase().addCounterParty(["COOP 2"], wildcards = ["COOP K*"])
+        self.assertEqual(CounterPartyDataBase().getCounterParty("COOP KONSUM").name, "COOP KONSUM")
+        self.assertEqual(CounterPartyDataBase().getCounterParty("COOP KVARNHOLMEN").name, "COOP 2")
+
+        # nothing is added if a rule is invalid
+        with self.assertRaises(AliasRuleError):
+            CounterPartyDataBase().addCounterParty(["SL"], regexes = ["SL [0-9]+", "SL ("])
+        self.assertIsNone(CounterPartyDataBase().findCounterParty("SL"))
+        self.assertIsNone(CounterPartyDataBase().findCounterParty("SL 1"))
+
+        CounterPartyDataBase().reset()
+        self.assertIsNone(CounterPartyDataBase().findCounterParty("ICA NARA 1234 STOCKHOLM"))
+
+    def testChangeListeners(self):
+        changes = list()
+        CounterPartyDataBase.addChangeListener(changes.append)
+        self.addCleanup(CounterPartyDataBase.removeChangeListener, changes.append)
+        CounterPartyDataBase().addCounterParty(["ICA"], prefixes = ["ICA "])
+        CounterPartyDataBase().getCounterParty("ICA NARA 1")
+        CounterPartyDataBase().getCounterParty("COOP 1")
+        CounterPartyDataBase().getCounterParty("SL")
+        # nothing had been resolved yet, and resolving adds nothing that was resolved
+        self.assertEqual(changes, [])
+
+        CounterPartyDataBase().addCounterParty(["ICA", "ICA NARA 1"], category = "food")
+        CounterPartyDataBase().addCounterParty(["COOP"], wildcards = ["COOP *", "SL*"])
+        CounterPartyDataBase().addCounterParty(["ICA 2"], prefixes = ["ICA N"])
+        self.assertEqual(changes, [{"ICA", "ICA NARA 1"}, {"COOP 1", "SL"}])
@@ -1,7 +1,18 @@
 from test.test_spendlog import TestSpendlog
+import random
+import threading
+import datetime
+import unittest
 
-from spendlog.ledger import Ledger, TimeRange
+from spendlog.ledger import Ledger, TimeRange, Totals, UnknownDimensionError, CATEGORY, TAG, COUNTER_PARTY, DIMENSIONS
 from spendlog.transaction import Transaction, FingerprintMismatchError
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.columnarStore import numpy
+from spendlog.ledgerIndex import MONTH, YEAR, UnknownPartitionGranularityError
+from spendlog.transactionQuery import LIQUIDITY_CHANGE, CAPITAL_CHANGE, NET_CHANGE, UnknownAmountError
+from spendlog.timeSeries import DAY, WEEK, getNextPeriodStart, UnknownFrequencyError
+from spendlog.rollup import RollingWindowError
+from spendlog.sketches import SketchError
 
 
 initList = list()
@@ -590,4 +601,803 @@ class TestLedger(TestSpendlog):
 
         self.assertEqual(Ledger().getTotalLiquidityChange(), sum(liquidityChanges))
         self.assertEqual(Ledger().getTotalCapitalChange(), sum(capitalChanges))
-        self.assertEqual(Ledger().getTotalNetChange(), sum(capitalChanges) + sum(liquidityChanges))
\ No newline at end of file
+        self.assertEqual(Ledger().getTotalNetChange(), sum(capitalChanges) + sum(liquidityChanges))
+
+    def testIndexesFollowLedger(self):
+        kwargs1 = {
+            "liquidityChange"     : 1,
+            "capitalChange"       : 2,
+            "counterPartyAlias"   : "alias",
+            "tags"                : ["tag 1", "tag 2"],
+            "category"            : "booze",
+            "date"                : self.strToDateTime("2025-01-24"),
+            "fingerPrint"         : self.getNewFingerPrint()}
+        Ledger().addTransaction(**kwargs1)
+        self.assertEqual(Ledger().categoryIndex.getSize("booze"), 1)
+        self.assertEqual(Ledger().tagIndex.getSize("tag 1"), 1)
+        self.assertEqual(Ledger().counterPartyIndex.getSize("alias"), 1)
+
+        # adding a duplicate doesn't add it to the indexes twice
+        Ledger().addTransaction(**kwargs1)
+        self.assertEqual(Ledger().categoryIndex.getSize("booze"), 1)
+
+        # replacing a transaction (same fingerprint, new data) moves it in the indexes
+        kwargs2 = dict(kwargs1)
+        kwargs2["category"] = "weed"
+        kwargs2["tags"] = ["tag 3"]
+        kwargs2["counterPartyAlias"] = "alias2"
+        Ledger().addTransaction(**kwargs2)
+        self.assertEqual(Ledger().categoryIndex.getSize("booze"), 0)
+        self.assertEqual(Ledger().categoryIndex.getSize("weed"), 1)
+        self.assertEqual(Ledger().tagIndex.getSize("tag 1"), 0)
+        self.assertEqual(Ledger().tagIndex.getSize("tag 3"), 1)
+        self.assertEqual(Ledger().counterPartyIndex.getSize("alias"), 0)
+        self.assertEqual(Ledger().counterPartyIndex.getSize("alias2"), 1)
+
+        # filters answered from the indexes
+        self.assertEqual(Ledger().getTransactions(requiredCategory = "booze"), set())
+        self.assertEqual(Ledger().getTransactions(requiredCategory = "weed"), Ledger().transactionSet)
+        self.assertEqual(Ledger().getTransactions(allowedTags = ["tag 3"]), Ledger().transactionSet)
+        self.assertEqual(Ledger().getTransactions(allowedTags = ["tag 1"]), set())
+        self.assertEqual(Ledger().getTransactions(requiredCounterParty = "alias2"), Ledger().transactionSet)
+
+        # reset clears the indexes
+        Ledger().reset()
+        self.assertEqual(Ledger().categoryIndex.getSize("weed"), 0)
+
+    def testDateIndex(self):
+        dates = ["2025-01-01", "2025-01-10", "2025-01-10", "2025-01-20", "2024-12-31", "2025-02-01"]
+        for date in dates:
+            Ledger().addTransaction(liquidityChange = 1,
+                                    counterPartyAlias = "alias",
+                                    date = self.strToDateTime(date),
+                                    fingerPrint = self.getNewFingerPrint())
+
+        # the index is sorted by date, regardless of insertion order
+        self.assertEqual(Ledger().dateIndex.dates, sorted(Ledger().dateIndex.dates))
+        self.assertEqual(len(Ledger().dateIndex.transactions), len(dates))
+
+        # range bounds are inclusive
+        timeRange = TimeRange(self.strToDateTime("2025-01-01"), self.strToDateTime("2025-01-20"))
+        transactionsInRange = Ledger().getTransactions(timeRange = timeRange)
+        self.assertEqual(len(transactionsInRange), 4)
+        self.assertEqual(transactionsInRange, {transaction for transaction in Ledger().transactionSet if timeRange.start <= transaction.getDate() <= timeRange.end})
+
+        # range with no transactions
+        timeRange = TimeRange(self.strToDateTime("2025-01-11"), self.strToDateTime("2025-01-19"))
+        self.assertEqual(Ledger().getTransactions(timeRange = timeRange), set())
+
+        # replacing a transaction removes the old one from the index
+        Ledger().addTransaction(liquidityChange = 2,
+                                counterPartyAlias = "alias",
+                                date = self.strToDateTime("2025-03-01"),
+                                fingerPrint = self.previousFingerprint)
+        self.assertEqual(len(Ledger().dateIndex.transactions), len(dates))
+        self.assertEqual(Ledger().dateIndex.dates[-1], self.strToDateTime("2025-03-01"))
+
+    def addRandomTransactions(self, nTransactions, seed = 0):
+        rng = random.Random(seed)
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], category = "booze")
+        for _ in range(nTransactions):
+            Ledger().addTransaction(liquidityChange = rng.randint(-1000, 1000),
+                                    capitalChange = rng.randint(-10, 10),
+                                    counterPartyAlias = rng.choice(["alias", "alias alias", "alias2", "alias3"]),
+                                    tags = rng.sample(["tag 1", "tag 2", "tag 3", "tag 4"], rng.randint(0, 3)),
+                                    category = rng.choice([None, "booze", "weed", "cake"]),
+                                    date = self.strToDateTime(f"2025-0{rng.randint(1, 3)}-{rng.randint(10, 28)}"),
+                                    fingerPrint = self.getNewFingerPrint())
+        return rng
+
+    def getRandomFilters(self, rng):
+        filters = {
+            "timeRange"             : TimeRange(self.strToDateTime("2025-01-20"), self.strToDateTime(f"2025-0{rng.randint(1, 3)}-15")),
+            "requiredCategory"      : rng.choice(["booze", "weed", "uncategorized"]),
+            "forbiddenCategory"     : rng.choice(["booze", "cake"]),
+            "allowedCategories"     : rng.sample(["booze", "weed", "cake", "uncategorized"], 2),
+            "requiredTags"          : rng.sample(["tag 1", "tag 2", "tag 3"], rng.randint(0, 2)),
+            "forbiddenTags"         : rng.sample(["tag 1", "tag 2", "tag 3"], 1),
+            "allowedTags"           : rng.sample(["tag 1", "tag 2", "tag 3", "tag 4"], 3),
+            "requiredCounterParty"  : rng.choice(["alias", "alias alias", "alias2"]),
+            "forbiddenCounterParty" : rng.choice(["alias", "alias3"]),
+            "allowedCounterParties" : rng.sample(["alias", "alias2", "alias3"], 2)}
+        return {name : value for name, value in filters.items() if rng.random() < 0.3}
+
+    # the filters as they were before the ledger had indexes; every query is a full scan
+    def getTransactionsByScanning(self, filters):
+        def counterParty(alias):
+            return CounterPartyDataBase().getCounterParty(alias)
+        transactions = set()
+        for transaction in Ledger().transactionSet:
+            timeRange = filters.get("timeRange")
+            if timeRange is not None and not timeRange.start <= transaction.getDate() <= timeRange.end:
+                continue
+            if "requiredCategory" in filters and transaction.getCategory() != filters["requiredCategory"]:
+                continue
+            if "forbiddenCategory" in filters and transaction.getCategory() == filters["forbiddenCategory"]:
+                continue
+            if "allowedCategories" in filters and transaction.getCategory() not in filters["allowedCategories"]:
+                continue
+            if "requiredTags" in filters and not set(filters["requiredTags"]) <= set(transaction.tags):
+                continue
+            if "forbiddenTags" in filters and set(filters["forbiddenTags"]) & set(transaction.tags):
+                continue
+            if "allowedTags" in filters and not set(transaction.tags) <= set(filters["allowedTags"]):
+                continue
+            if "requiredCounterParty" in filters and counterParty(transaction.counterPartyAlias) != counterParty(filters["requiredCounterParty"]):
+                continue
+            if "forbiddenCounterParty" in filters and counterParty(transaction.counterPartyAlias) == counterParty(filters["forbiddenCounterParty"]):
+                continue
+            if "allowedCounterParties" in filters and counterParty(transaction.counterPartyAlias) not in {counterParty(alias) for alias in filters["allowedCounterParties"]}:
+                continue
+            transactions.add(transaction)
+        return transactions
+
+    def testQueryPlannerMatchesFullScan(self):
+        rng = self.addRandomTransactions(300)
+        for _ in range(300):
+            filters = self.getRandomFilters(rng)
+            self.assertEqual(Ledger().getTransactions(**filters), self.getTransactionsByScanning(filters), filters)
+
+        # no filters at all returns (a copy of) the whole ledger
+        transactions = Ledger().getTransactions()
+        self.assertEqual(transactions, Ledger().transactionSet)
+        self.assertIsNot(transactions, Ledger().transactionSet)
+
+    def testQueryPlan(self):
+        self.addRandomTransactions(100)
+        # the most selective index-backed filter is used as the source
+        plan = Ledger().planQuery(requiredCategory = "booze",
+                                  timeRange = TimeRange(self.strToDateTime("2025-01-01"), self.strToDateTime("2025-12-31")))
+        self.assertEqual(plan.sourceSize, Ledger().categoryIndex.getSize("booze"))
+        self.assertEqual(len(plan.predicates), 1)
+
+        # a filter that can't match anything short-circuits the plan
+        plan = Ledger().planQuery(requiredCategory = "no such category", forbiddenTags = ["tag 1"])
+        self.assertEqual(plan.sourceSize, 0)
+        self.assertEqual(plan.execute(), set())
+
+    def testPartitionPruning(self):
+        self.addCleanup(Ledger.setPartitionGranularity, MONTH)
+        rng = self.addRandomTransactions(300)
+        Ledger().addTransaction(-10, 0, "alias4", ["tag 5"], "tax", self.strToDateTime("2024-12-31"), self.getNewFingerPrint())
+
+        partitions = Ledger().partitionIndex.getPartitions()
+        self.assertEqual([partition.key for partition in partitions], [(2024, 12), (2025, 1), (2025, 2), (2025, 3)])
+        self.assertEqual(sum(partition.getSize() for partition in partitions), len(Ledger().transactionSet))
+        self.assertEqual(partitions[0].minDate, self.strToDateTime("2024-12-31"))
+        self.assertEqual(partitions[0].categoryCounts, {"tax" : 1})
+
+        # filters that are only checked as predicates still skip partitions that can't match
+        plan = Ledger().planQuery(forbiddenCategory = "tax", forbiddenTags = ["tag 1"])
+        self.assertEqual(plan.sourceSize, 300)
+        plan = Ledger().planQuery(forbiddenCategory = "booze", forbiddenCounterParty = "alias")
+        self.assertEqual(plan.sourceSize, 301)
+        plan = Ledger().planQuery(forbiddenCategory = "booze", allowedCounterParties = ["alias4"])
+        self.assertEqual(plan.sourceSize, 1)
+
+        for granularity in (YEAR, MONTH):
+            Ledger.setPartitionGranularity(granularity)
+            for _ in range(100):
+                filters = self.getRandomFilters(rng)
+                self.assertEqual(Ledger().getTransactions(**filters), self.getTransactionsByScanning(filters), filters)
+        self.assertEqual(len(Ledger().partitionIndex.getPartitions()), 4)
+
+        # partitions follow transactions being replaced
+        oldTransaction = Ledger().getTransactionByFingerPrint(self.previousFingerprint)
+        Ledger().addTransaction(-10, 0, "alias4", ["tag 5"], "tax", self.strToDateTime("2025-01-31"), self.previousFingerprint)
+        newTransaction = Ledger().getTransactionByFingerPrint(self.previousFingerprint)
+        self.assertIsNot(newTransaction, oldTransaction)
+        self.assertEqual(Ledger().partitionIndex.getPartition((2025, 1)).categoryCounts["tax"], 1)
+        self.assertIsNone(Ledger().partitionIndex.getPartition((2024, 12)))
+
+        with self.assertRaises(UnknownPartitionGranularityError):
+            Ledger.setPartitionGranularity("week")
+
+    def testConcurrentIngestAndQuery(self):
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], category = "booze")
+        nWriters = 4
+        nBatches = 50
+        errors = list()
+        writersDone = threading.Event()
+
+        # every batch is balanced, so unless a query sees a half added batch, the totals
+        # are always zero and the number of transactions even
+        def write(writer):
+            rng = random.Random(writer)
+            for batch in range(nBatches):
+                records = list()
+                for pair in range(rng.randint(1, 5)):
+                    amount = rng.randint(1, 1000)
+                    category = rng.choice(["booze", "cake", None])
+                    alias = rng.choice(["alias", "alias alias", f"alias {writer}"])
+                    date = self.strToDateTime(f"2025-0{rng.randint(1, 3)}-{rng.randint(10, 28)}")
+                    for sign in (1, -1):
+                        records.append({"liquidityChange"   : sign * amount,
+                                        "capitalChange"     : -sign * pair,
+                                        "counterPartyAlias" : alias,
+                                        "tags"              : ["tag 1"] if pair % 2 else [],
+                                        "category"          : category,
+                                        "date"              : date,
+                                        "fingerPrint"       : (writer, batch, pair, sign)})
+                Ledger().addTransactions(records)
+                if batch % 10 == 0:
+                    CounterPartyDataBase().addCounterParty([f"new alias {writer} {batch}"])
+
+        def read():
+            while not writersDone.is_set():
+                try:
+                    transactions = Ledger().getTransactions()
+                    if len(transactions) % 2 != 0:
+                        errors.append(f"odd number of transactions: {len(transactions)}")
+                    if Ledger().getTotalNetChange() != 0:
+                        errors.append("unbalanced total")
+                    if Ledger().getTotalLiquidityChange(requiredCounterParty = "alias") != 0:
+                        errors.append("unbalanced total for counter party")
+                    if sum(totals.getNetChange() for totals in Ledger().aggregateBy(CATEGORY).values()) != 0:
+                        errors.append("unbalanced aggregate")
+                except Exception as e:
+                    errors.append(repr(e))
+
+        writers = [threading.Thread(target = write, args = (writer,)) for writer in range(nWriters)]
+        readers = [threading.Thread(target = read) for _ in range(4)]
+        for thread in writers + readers:
+            thread.start()
+        for writer in writers:
+            writer.join()
+        writersDone.set()
+        for reader in readers:
+            reader.join()
+
+        self.assertEqual(errors, list())
+        self.assertEqual(len(Ledger().getTransactions()), len(Ledger().fingerPrintIndex))
+        self.assertEqual(Ledger().getTotalNetChange(), 0)
+        self.assertEqual(len(Ledger().getTransactions(timeRange = TimeRange(self.strToDateTime("2025-01-01"), self.strToDateTime("2025-12-31")))),
+                         len(Ledger().transactionSet))
+
+    def testParallelAggregation(self):
+        self.addCleanup(Ledger.disableParallelAggregation)
+        rng = self.addRandomTransactions(300)
+        filterCombinations = [self.getRandomFilters(rng) for _ in range(20)]
+        expectedTotals = [(Ledger().getTotalLiquidityChange(**filters),
+                           Ledger().getTotalCapitalChange(**filters),
+                           Ledger().getTotalNetChange(**filters),
+                           {dimension : Ledger().aggregateBy(dimension, **filters) for dimension in (CATEGORY, TAG, COUNTER_PARTY)})
+                          for filters in filterCombinations]
+
+        # too small a ledger to be worth it; the workers are never started
+        Ledger.enableParallelAggregation(workers = 2)
+        self.assertEqual(Ledger().getTotalNetChange(forbiddenCategory = "cake"), Ledger().getTotalNetChange(forbiddenCategory = "cake"))
+        self.assertIsNone(Ledger().parallelAggregator.executor)
+
+        Ledger.enableParallelAggregation(workers = 2, minimumSize = 0)
+        # the results computed above would otherwise just be returned from the cache
+        self.addCleanup(Ledger.setQueryCacheSize, Ledger.queryCacheSize)
+        Ledger.setQueryCacheSize(0)
+        for filters, (liquidityChange, capitalChange, netChange, aggregates) in zip(filterCombinations, expectedTotals):
+            self.assertEqual(Ledger().getTotalLiquidityChange(**filters), liquidityChange, filters)
+            self.assertEqual(Ledger().getTotalCapitalChange(**filters), capitalChange, filters)
+            self.assertEqual(Ledger().getTotalNetChange(**filters), netChange, filters)
+            for dimension, totals in aggregates.items():
+                self.assertEqual(Ledger().aggregateBy(dimension, **filters), totals, (dimension, filters))
+        self.assertIsNotNone(Ledger().parallelAggregator.executor)
+        self.assertEqual(Ledger().parallelAggregator.getShards(), [(0, 150), (150, 300)])
+
+    def testParallelAggregationDuringIngest(self):
+        self.addCleanup(Ledger.disableParallelAggregation)
+        self.addCleanup(Ledger.setQueryCacheSize, Ledger.queryCacheSize)
+        Ledger.setQueryCacheSize(0)
+        self.addRandomTransactions(300)
+        Ledger.enableParallelAggregation(workers = 2, minimumSize = 0)
+        aggregator = Ledger().parallelAggregator
+        timeRange = TimeRange(self.strToDateTime("2025-01-01"), self.strToDateTime("2025-01-31"))
+
+        # the first query over the whole ledger pays for writing the snapshot
+        self.assertEqual(Ledger().getTotalNetChange(forbiddenCategory = "cake"), sum(transaction.getNetChange() for transaction in Ledger().transactionSet if transaction.getCategory() != "cake"))
+        self.assertEqual(aggregator.snapshotGeneration, Ledger().generation)
+
+        # queries interleaved with ingest run serially rather than rewriting the snapshot
+        # every time, until they have done as much work as rewriting it
+        writtenGeneration = aggregator.snapshotGeneration
+        for _ in range(2):
+            Ledger().addTransaction(1, 0, "alias2", [], "booze", self.strToDateTime("2025-01-10"), self.getNewFingerPrint())
+            expected = sum(transaction.getLiquidityChange() for transaction in Ledger().dateIndex.getRange(timeRange.start, timeRange.end))
+            self.assertEqual(Ledger().getTotalLiquidityChange(timeRange = timeRange, forbiddenTags = ["no such tag"]), expected)
+            self.assertEqual(aggregator.snapshotGeneration, writtenGeneration)
+        Ledger().getTotalLiquidityChange(forbiddenTags = ["no such tag"])
+        self.assertEqual(aggregator.snapshotGeneration, Ledger().generation)
+
+        # adding nothing but duplicates doesn't change the ledger, so the snapshot stays
+        Ledger().insertTransactions(list(Ledger().transactionSet)[:10])
+        self.assertEqual(aggregator.snapshotGeneration, Ledger().generation)
+
+    def testParallelAggregationAfterReset(self):
+        self.addCleanup(Ledger.disableParallelAggregation)
+        self.addCleanup(Ledger.setQueryCacheSize, Ledger.queryCacheSize)
+        Ledger.setQueryCacheSize(0)
+        Ledger.enableParallelAggregation(workers = 2, minimumSize = 1)
+        for _ in range(10):
+            Ledger().addTransaction(100, 0, "alias2", [], "booze", self.strToDateTime("2025-01-10"), self.getNewFingerPrint())
+        self.assertEqual(Ledger().getTotalLiquidityChange(forbiddenTags = ["no such tag"]), 1000)
+
+        # the rebuilt ledger is as many changes in as the old one, but mustn't be
+        # aggregated from the snapshot of the old one
+        Ledger.reset()
+        for _ in range(10):
+            Ledger().addTransaction(7, 0, "alias2", [], "booze", self.strToDateTime("2025-01-10"), self.getNewFingerPrint())
+        self.assertEqual(Ledger().getTotalLiquidityChange(forbiddenTags = ["no such tag"]), 70)
+
+    def testTopTransactions(self):
+        rng = self.addRandomTransactions(300)
+        useColumnarStorage = [False] if numpy is None else [False, True]
+        self.addCleanup(Ledger.disableColumnarStorage)
+        for columnar in useColumnarStorage:
+            if columnar:
+                Ledger.enableColumnarStorage()
+            for _ in range(30):
+                filters = self.getRandomFilters(rng)
+                transactions = self.getTransactionsByScanning(filters)
+                for key, getKey in [(LIQUIDITY_CHANGE, Transaction.getLiquidityChange),
+                                    (NET_CHANGE, Transaction.getNetChange),
+                                    (lambda transaction : transaction.fingerPrint, lambda transaction : transaction.fingerPrint)]:
+                    for largest in (True, False):
+                        top = Ledger().topTransactions(7, key, largest = largest, **filters)
+                        expected = sorted(transactions, key = getKey, reverse = largest)[:7]
+                        # compare the keys; transactions that tie may come in any order
+                        self.assertEqual([getKey(transaction) for transaction in top], [getKey(transaction) for transaction in expected], (filters, columnar))
+                        self.assertTrue(set(top) <= transactions)
+        self.assertEqual(Ledger().topTransactions(0), list())
+
+    def testTopGroups(self):
+        rng = self.addRandomTransactions(300)
+        for _ in range(30):
+            filters = self.getRandomFilters(rng)
+            for dimension in (CATEGORY, TAG, COUNTER_PARTY):
+                totals = Ledger().aggregateBy(dimension, **filters)
+                for metric, getMetric in [(LIQUIDITY_CHANGE, Totals.getLiquidityChange), (CAPITAL_CHANGE, Totals.getCapitalChange)]:
+                    top = Ledger().topGroups(2, dimension, metric, largest = False, **filters)
+                    expected = sorted(totals.items(), key = lambda keyAndTotals : getMetric(keyAndTotals[1]))[:2]
+                    self.assertEqual([getMetric(totals) for _, totals in top], [getMetric(totals) for _, totals in expected])
+                    for key, keyTotals in top:
+                        self.assertEqual(keyTotals, totals[key])
+        with self.assertRaises(UnknownAmountError):
+            Ledger().topGroups(2, CATEGORY, "spend")
+
+    def testResample(self):
+        rng = self.addRandomTransactions(300)
+        useColumnarStorage = [False] if numpy is None else [False, True]
+        self.addCleanup(Ledger.disableColumnarStorage)
+        for columnar in useColumnarStorage:
+            if columnar:
+                Ledger.enableColumnarStorage()
+            for _ in range(20):
+                filters = self.getRandomFilters(rng)
+                frequency = rng.choice([DAY, WEEK, MONTH, YEAR])
+                timeSeries = Ledger().resample(frequency, **filters)
+                self.assertEqual(timeSeries.periods, sorted(timeSeries.periods))
+                if "timeRange" not in filters and self.getTransactionsByScanning(filters):
+                    self.assertTrue(timeSeries.periods)
+                # every period should total the same as querying the period on its own
+                for period, periodStart in enumerate(timeSeries.periods):
+                    periodEnd = getNextPeriodStart(periodStart, frequency) - datetime.timedelta(microseconds = 1)
+                    timeRange = filters.get("timeRange")
+                    if timeRange is not None:
+                        periodStart, periodEnd = max(periodStart, timeRange.start), min(periodEnd, timeRange.end)
+                    periodFilters = dict(filters, timeRange = TimeRange(periodStart, periodEnd))
+                    transactions = self.getTransactionsByScanning(periodFilters)
+                    self.assertEqual(timeSeries.getLiquidityChanges()[period], sum(transaction.getLiquidityChange() for transaction in transactions), (filters, columnar))
+                    self.assertEqual(timeSeries.getCapitalChanges()[period], sum(transaction.getCapitalChange() for transaction in transactions))
+
+                # split by a dimension, the periods of every key should sum to the totals of aggregateBy
+                for dimension in (CATEGORY, TAG, COUNTER_PARTY):
+                    splitTimeSeries = Ledger().resample(frequency, dimension, **filters)
+                    totals = Ledger().aggregateBy(dimension, **filters)
+                    self.assertEqual(set(splitTimeSeries.getKeys()), set(totals))
+                    for key, keyTotals in totals.items():
+                        self.assertEqual(sum(splitTimeSeries.getLiquidityChanges(key)), keyTotals.liquidityChange)
+                        self.assertEqual(sum(splitTimeSeries.getNetChanges(key)), keyTotals.getNetChange())
+                        self.assertEqual(len(splitTimeSeries.getLiquidityChanges(key)), len(timeSeries.periods))
+
+        # results are copies, so changing them doesn't change the cached result
+        timeSeries = Ledger().resample(MONTH, CATEGORY)
+        timeSeries.add("booze", 0, 1000, 0)
+        self.assertNotEqual(Ledger().resample(MONTH, CATEGORY), timeSeries)
+
+        self.assertEqual(Ledger().resample(MONTH, timeRange = TimeRange(self.strToDateTime("2024-01-01"), self.strToDateTime("2024-02-01"))).getLiquidityChanges(), [0, 0])
+        with self.assertRaises(UnknownFrequencyError):
+            Ledger().resample("fortnight")
+        with self.assertRaises(UnknownDimensionError):
+            Ledger().resample(MONTH, "alias")
+
+    def testAggregateBy(self):
+        self.addRandomTransactions(200)
+        timeRange = TimeRange(self.strToDateTime("2025-01-20"), self.strToDateTime("2025-02-20"))
+
+        categoryTotals = Ledger().aggregateBy(CATEGORY, timeRange = timeRange)
+        self.assertEqual(set(categoryTotals.keys()), {"booze", "weed", "cake", "uncategorized"})
+        for category, totals in categoryTotals.items():
+            self.assertEqual(totals.getLiquidityChange(), Ledger().getTotalLiquidityChange(timeRange = timeRange, requiredCategory = category))
+            self.assertEqual(totals.getCapitalChange(), Ledger().getTotalCapitalChange(timeRange = timeRange, requiredCategory = category))
+            self.assertEqual(totals.getNetChange(), Ledger().getTotalNetChange(timeRange = timeRange, requiredCategory = category))
+
+        tagTotals = Ledger().aggregateBy(TAG, timeRange = timeRange, forbiddenCategory = "cake")
+        self.assertEqual(set(tagTotals.keys()), {"tag 1", "tag 2", "tag 3", "tag 4"})
+        for tag, totals in tagTotals.items():
+            self.assertEqual(totals.getNetChange(), Ledger().getTotalNetChange(timeRange = timeRange, forbiddenCategory = "cake", requiredTags = [tag]))
+
+        # counter parties are aggregated by name, so aliases of the same counter party are added up
+        counterPartyTotals = Ledger().aggregateBy(COUNTER_PARTY)
+        self.assertEqual(set(counterPartyTotals.keys()), {"alias", "alias2", "alias3"})
+        for counterParty, totals in counterPartyTotals.items():
+            self.assertEqual(totals.getLiquidityChange(), Ledger().getTotalLiquidityChange(requiredCounterParty = counterParty))
+
+        with self.assertRaises(UnknownDimensionError):
+            Ledger().aggregateBy("month")
+
+    @unittest.skipIf(numpy is None, "columnar storage requires numpy")
+    def testColumnarStorage(self):
+        self.addCleanup(Ledger.disableColumnarStorage)
+        rng = self.addRandomTransactions(150)
+        queries = [self.getRandomFilters(rng) for _ in range(200)]
+        expectedTotals = [(Ledger().getTotalLiquidityChange(**filters),
+                           Ledger().getTotalCapitalChange(**filters),
+                           Ledger().getTotalNetChange(**filters)) for filters in queries]
+        expectedAggregates = [Ledger().aggregateBy(dimension, **filters) for dimension in (CATEGORY, TAG, COUNTER_PARTY) for filters in queries[:20]]
+
+        # enabling columnar storage loads the existing transactions, and gives the same results
+        Ledger.enableColumnarStorage()
+        self.assertIsNotNone(Ledger().columnarStore)
+        totals = [(Ledger().getTotalLiquidityChange(**filters),
+                   Ledger().getTotalCapitalChange(**filters),
+                   Ledger().getTotalNetChange(**filters)) for filters in queries]
+        self.assertEqual(totals, expectedTotals)
+        aggregates = [Ledger().aggregateBy(dimension, **filters) for dimension in (CATEGORY, TAG, COUNTER_PARTY) for filters in queries[:20]]
+        self.assertEqual(aggregates, expectedAggregates)
+
+        # transactions added (and replaced) afterwards are stored in the columns too
+        Ledger().addTransaction(liquidityChange = 1000000,
+                                counterPartyAlias = "alias2",
+                                category = "weed",
+                                date = self.strToDateTime("2025-02-01"),
+                                fingerPrint = self.previousFingerprint)
+        self.assertEqual(Ledger().getTotalLiquidityChange(), sum(transaction.getLiquidityChange() for transaction in Ledger().transactionSet))
+        self.assertEqual(Ledger().aggregateBy(CATEGORY)["weed"].getLiquidityChange(),
+                         sum(transaction.getLiquidityChange() for transaction in Ledger().transactionSet if transaction.getCategory() == "weed"))
+
+        # the mode survives resets, until it is disabled
+        Ledger().reset()
+        self.assertIsNotNone(Ledger().columnarStore)
+        Ledger.disableColumnarStorage()
+        self.assertIsNone(Ledger().columnarStore)
+
+    def testQueryCache(self):
+        self.addCleanup(Ledger.setQueryCacheSize, Ledger.queryCacheSize)
+        self.addRandomTransactions(100)
+        timeRange = TimeRange(self.strToDateTime("2025-01-20"), self.strToDateTime("2025-02-20"))
+        statistics = Ledger().getQueryCacheStatistics()
+        self.assertEqual((statistics["hits"], statistics["misses"]), (0, 0))
+
+        # repeated queries are hits, also when the filters are given in another way
+        total = Ledger().getTotalLiquidityChange(timeRange = timeRange, allowedCategories = ["booze", "weed"])
+        self.assertEqual(Ledger().getTotalLiquidityChange(timeRange, allowedCategories = ["weed", "booze"]), total)
+        self.assertEqual(Ledger().getTotalLiquidityChange(timeRange = TimeRange(timeRange.start, timeRange.end), allowedCategories = ("booze", "weed")), total)
+        statistics = Ledger().getQueryCacheStatistics()
+        self.assertEqual((statistics["hits"], statistics["misses"], statistics["size"]), (2, 1, 1))
+
+        # cached transaction sets and aggregates are copies, so callers can't corrupt the cache
+        transactions = Ledger().getTransactions(requiredCategory = "booze")
+        transactions.clear()
+        self.assertNotEqual(Ledger().getTransactions(requiredCategory = "booze"), set())
+        Ledger().aggregateBy(CATEGORY)["booze"].liquidityChange += 1
+        self.assertEqual(Ledger().aggregateBy(CATEGORY)["booze"].getLiquidityChange(), Ledger().getTotalLiquidityChange(requiredCategory = "booze"))
+
+        # adding a transaction invalidates the cache
+        Ledger().addTransaction(liquidityChange = 1000000,
+                                counterPartyAlias = "alias",
+                                category = "booze",
+                                date = self.strToDateTime("2025-02-01"),
+                                fingerPrint = self.getNewFingerPrint())
+        self.assertEqual(Ledger().getTotalLiquidityChange(timeRange = timeRange, allowedCategories = ["booze", "weed"]), total + 1000000)
+
+        # so does changing the counter party database
+        total3 = Ledger().getTotalLiquidityChange(requiredCounterParty = "alias3")
+        total2 = Ledger().getTotalLiquidityChange(requiredCounterParty = "alias2")
+        CounterPartyDataBase().addCounterParty(["alias3", "alias2"])
+        self.assertEqual(Ledger().getTotalLiquidityChange(requiredCounterParty = "alias3"), total2 + total3)
+
+        # least recently used entries are evicted
+        Ledger.setQueryCacheSize(2)
+        Ledger().getTotalLiquidityChange(requiredCategory = "booze")
+        Ledger().getTotalLiquidityChange(requiredCategory = "weed")
+        Ledger().getTotalLiquidityChange(requiredCategory = "booze")
+        Ledger().getTotalLiquidityChange(requiredCategory = "cake")
+        self.assertEqual(Ledger().getQueryCacheStatistics()["size"], 2)
+        Ledger().getTotalLiquidityChange(requiredCategory = "booze")
+        self.assertEqual(Ledger().getQueryCacheStatistics()["hits"], 2)
+        Ledger().getTotalLiquidityChange(requiredCategory = "weed")
+        self.assertEqual(Ledger().getQueryCacheStatistics()["misses"], 4)
+
+        # a size of 0 disables the cache
+        Ledger.setQueryCacheSize(0)
+        Ledger().getTotalLiquidityChange(requiredCategory = "booze")
+        Ledger().getTotalLiquidityChange(requiredCategory = "booze")
+        statistics = Ledger().getQueryCacheStatistics()
+        self.assertEqual((statistics["hits"], statistics["misses"], statistics["size"]), (0, 2, 0))
+
+    def testTotalsFromRollup(self):
+        rng = random.Random(1)
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"])
+        for _ in range(300):
+            Ledger().addTransaction(liquidityChange = rng.randint(-1000, 1000),
+                                    capitalChange = rng.randint(-10, 10),
+                                    counterPartyAlias = rng.choice(["alias", "alias alias", "alias2"]),
+                                    category = rng.choice(["booze", "weed"]),
+                                    date = datetime.datetime(2025, 1, 1) + datetime.timedelta(hours = rng.randrange(24 * 60)),
+                                    fingerPrint = self.getNewFingerPrint())
+
+        def getTotalsByScanning(filters):
+            transactions = self.getTransactionsByScanning(filters)
+            return (sum(transaction.getLiquidityChange() for transaction in transactions),
+                    sum(transaction.getCapitalChange() for transaction in transactions),
+                    sum(transaction.getNetChange() for transaction in transactions))
+
+        for _ in range(200):
+            start = datetime.datetime(2025, 1, 1) + datetime.timedelta(hours = rng.randrange(-48, 24 * 60), minutes = rng.choice([0, 30]))
+            end = start + datetime.timedelta(hours = rng.randrange(-24, 24 * 30))
+            filters = rng.choice([{},
+                                  {"requiredCategory" : "booze"},
+                                  {"requiredCounterParty" : "alias"},
+                                  {"requiredCounterParty" : "alias2"}])
+            if rng.random() < 0.9:
+                filters["timeRange"] = TimeRange(start, end)
+            self.assertIsNotNone(Ledger().getTotalsFromRollup(**filters))
+            totals = (Ledger().getTotalLiquidityChange(**filters),
+                      Ledger().getTotalCapitalChange(**filters),
+                      Ledger().getTotalNetChange(**filters))
+            self.assertEqual(totals, getTotalsByScanning(filters), filters)
+
+        # other filters aren't answered from the rollup
+        self.assertIsNone(Ledger().getTotalsFromRollup(forbiddenCategory = "booze"))
+        self.assertIsNone(Ledger().getTotalsFromRollup(requiredCategory = "booze", requiredCounterParty = "alias"))
+
+    def testRollingTotals(self):
+        rng = random.Random(2)
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"])
+        def addTransaction():
+            Ledger().addTransaction(liquidityChange = rng.randint(-1000, 1000),
+                                    capitalChange = rng.randint(-10, 10),
+                                    counterPartyAlias = rng.choice(["alias", "alias alias", "alias2"]),
+                                    category = rng.choice(["booze", "weed"]),
+                                    date = datetime.datetime(2025, 1, 1) + datetime.timedelta(hours = rng.randrange(24 * 120)),
+                                    fingerPrint = self.getNewFingerPrint())
+
+        def getWindowTotals(windowDays, end, filters):
+            start = datetime.datetime(end.year, end.month, end.day) - datetime.timedelta(days = windowDays - 1)
+            end = datetime.datetime(end.year, end.month, end.day, 23, 59, 59, 999999)
+            return Totals(Ledger().getTotalLiquidityChange(timeRange = TimeRange(start, end), **filters),
+                          Ledger().getTotalCapitalChange(timeRange = TimeRange(start, end), **filters))
+
+        for _ in range(10):
+            # the windows should follow the ledger as transactions are added
+            for _ in range(30):
+                addTransaction()
+            windowDays = rng.choice([1, 7, 30, 90])
+            filters = rng.choice([{}, {"requiredCategory" : "booze"}, {"requiredCounterParty" : "alias alias"}, {"requiredCounterParty" : "alias2"}])
+            start = datetime.datetime(2025, 1, 1) + datetime.timedelta(days = rng.randrange(-10, 120), hours = 12)
+            end = start + datetime.timedelta(days = rng.randrange(20))
+            rollingTotals = Ledger().rolling(windowDays, start, end, **filters)
+            averages = Ledger().getMovingAverages(windowDays, start, end, **filters)
+            self.assertEqual(len(rollingTotals.periods), (end - start).days + 1)
+            for day, period in enumerate(rollingTotals.periods):
+                totals = getWindowTotals(windowDays, period, filters)
+                self.assertEqual(Totals(rollingTotals.getLiquidityChanges()[day], rollingTotals.getCapitalChanges()[day]), totals)
+                self.assertEqual(Ledger().getRollingTotals(windowDays, period, **filters), totals)
+                self.assertAlmostEqual(averages.getNetChanges()[day], totals.getNetChange() / windowDays)
+
+        with self.assertRaises(RollingWindowError):
+            Ledger().rolling(0, start, end)
+        with self.assertRaises(RollingWindowError):
+            Ledger().rolling(30, start, end, requiredCategory = "booze", requiredCounterParty = "alias")
+
+    def testSketches(self):
+        rng = random.Random(3)
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"])
+        for _ in range(3000):
+            Ledger().addTransaction(liquidityChange = rng.randint(-1000, 100),
+                                    counterPartyAlias = rng.choice(["alias", "alias alias"] + [f"alias{i}" for i in range(40)]),
+                                    category = rng.choice(["booze", "weed"]),
+                                    date = datetime.datetime(2025, 1, 1) + datetime.timedelta(hours = rng.randrange(24 * 90)),
+                                    fingerPrint = self.getNewFingerPrint())
+
+        def assertQuantiles(filters, transactions):
+            values = sorted(transaction.getLiquidityChange() for transaction in transactions)
+            quantiles = [0.05, 0.5, 0.95]
+            for quantile, value in zip(quantiles, Ledger().getQuantiles(quantiles, **filters)):
+                rank = sum(1 for other in values if other <= value) / len(values)
+                self.assertAlmostEqual(rank, quantile, delta = 0.03, msg = filters)
+
+        def assertDistinctCount(filters, transactions):
+            counterParties = {CounterPartyDataBase().getCounterParty(transaction.counterPartyAlias).name for transaction in transactions}
+            self.assertAlmostEqual(Ledger().getDistinctCounterPartyCount(**filters), len(counterParties), delta = 2)
+
+        def inMonth(transaction, month):
+            return (transaction.getDate().year, transaction.getDate().month) == (month.year, month.month)
+
+        def assertSketches():
+            transactions = Ledger().transactionSet
+            assertQuantiles({}, transactions)
+            assertQuantiles({"requiredCategory" : "booze"}, [transaction for transaction in transactions if transaction.getCategory() == "booze"])
+            assertQuantiles({"requiredCounterParty" : "alias"}, [transaction for transaction in transactions if transaction.counterPartyAlias in ("alias", "alias alias")])
+            month = datetime.datetime(2025, 2, 14)
+            assertQuantiles({"month" : month}, [transaction for transaction in transactions if inMonth(transaction, month)])
+            assertDistinctCount({}, transactions)
+            assertDistinctCount({"requiredCategory" : "weed"}, [transaction for transaction in transactions if transaction.getCategory() == "weed"])
+            assertDistinctCount({"month" : month}, [transaction for transaction in transactions if inMonth(transaction, month)])
+
+        assertSketches()
+        sketchIndex = Ledger().sketchIndex
+
+        # removing transactions makes the sketches stale, so they are rebuilt
+        for transaction in [transaction for transaction in Ledger().transactionSet if transaction.getLiquidityChange() < -500]:
+            Ledger().unindexTransaction(transaction)
+            Ledger().transactionSet.remove(transaction)
+        assertSketches()
+        self.assertIsNot(Ledger().sketchIndex, sketchIndex)
+        sketchIndex = Ledger().sketchIndex
+
+        # new counter parties don't, but moving aliases between counter parties does
+        CounterPartyDataBase().addCounterParty(["new alias"])
+        assertSketches()
+        self.assertIs(Ledger().sketchIndex, sketchIndex)
+        CounterPartyDataBase().addCounterParty([f"alias{i}" for i in range(10)])
+        assertSketches()
+        self.assertIsNot(Ledger().sketchIndex, sketchIndex)
+
+        self.assertEqual(Ledger().getQuantiles([0.5], requiredCategory = "cake"), [None])
+        self.assertEqual(Ledger().getDistinctCounterPartyCount(month = datetime.datetime(2024, 1, 1)), 0)
+        with self.assertRaises(SketchError):
+            Ledger().getQuantile(0.5, requiredCategory = "booze", month = datetime.datetime(2025, 1, 1))
+
+    def testAddTransactionConstructsOnce(self):
+        calls = list()
+        CounterPartyDataBase().addCounterParty(["alias"], transactionModifier = lambda transaction : calls.append(transaction))
+        Ledger().addTransaction(liquidityChange = 1, counterPartyAlias = "alias", fingerPrint = 1)
+        self.assertEqual(len(calls), 1)
+        self.assertIs(Ledger().getTransactionByFingerPrint(1), calls[0])
+        self.assertIn(calls[0], Ledger().transactionSet)
+
+        # duplicates keep the old transaction, mismatches replace it
+        Ledger().addTransaction(liquidityChange = 1, counterPartyAlias = "alias", date = calls[0].getDate(), fingerPrint = 1)
+        self.assertEqual(len(calls), 2)
+        self.assertIs(Ledger().getTransactionByFingerPrint(1), calls[0])
+        Ledger().addTransaction(liquidityChange = 2, counterPartyAlias = "alias", date = calls[0].getDate(), fingerPrint = 1)
+        self.assertEqual(len(calls), 3)
+        self.assertIs(Ledger().getTransactionByFingerPrint(1), calls[2])
+        self.assertEqual(len(Ledger().transactionSet), 1)
+        self.assertIsNone(Ledger().getTransactionByFingerPrint(None))
+
+    def testAddTransactions(self):
+        Ledger().addTransaction(liquidityChange = 1, counterPartyAlias = "alias", date = self.strToDateTime("2025-01-10"), fingerPrint = 1)
+        Ledger().addTransaction(liquidityChange = 2, counterPartyAlias = "alias", date = self.strToDateTime("2025-01-20"), fingerPrint = 2)
+        records = [
+            {"liquidityChange" : 1, "counterPartyAlias" : "alias", "date" : self.strToDateTime("2025-01-10"), "fingerPrint" : 1},     # duplicate of ledger
+            {"liquidityChange" : 3, "counterPartyAlias" : "alias", "date" : self.strToDateTime("2025-01-20"), "fingerPrint" : 2},     # replaces ledger
+            {"liquidityChange" : 4, "counterPartyAlias" : "alias", "date" : self.strToDateTime("2025-01-15"), "fingerPrint" : 3},
+            {"liquidityChange" : 4, "counterPartyAlias" : "alias", "date" : self.strToDateTime("2025-01-15"), "fingerPrint" : 3},     # duplicate within batch
+            {"liquidityChange" : 5, "counterPartyAlias" : "alias", "date" : self.strToDateTime("2025-01-05"), "fingerPrint" : 4},
+            {"liquidityChange" : 6, "counterPartyAlias" : "alias", "date" : self.strToDateTime("2025-01-05"), "fingerPrint" : 4},     # replaces within batch
+            {"liquidityChange" : 7, "counterPartyAlias" : "alias", "date" : self.strToDateTime("2025-01-01"), "fingerPrint" : 2},     # replaces replacement
+        ]
+        Ledger().addTransactions(records)
+
+        self.assertEqual(sorted(transaction.getLiquidityChange() for transaction in Ledger().transactionSet), [1, 4, 6, 7])
+        self.assertEqual(Ledger().dateIndex.dates, [self.strToDateTime(date) for date in ["2025-01-01", "2025-01-05", "2025-01-10", "2025-01-15"]])
+        self.assertEqual(Ledger().getTransactionByFingerPrint(2).getLiquidityChange(), 7)
+        self.assertEqual(Ledger().getTotalLiquidityChange(timeRange = TimeRange(self.strToDateTime("2025-01-02"), self.strToDateTime("2025-01-31"))), 11)
+        self.assertEqual(Ledger().categoryIndex.getSize("uncategorized"), 4)
+
+    def testReclassifyOnCounterPartyChange(self):
+        records = [{"liquidityChange" : -100, "counterPartyAlias" : "ICA NARA 1", "date" : self.strToDateTime("2025-01-10"), "fingerPrint" : 1},
+                   {"liquidityChange" : -200, "counterPartyAlias" : "ICA MAXI 2", "date" : self.strToDateTime("2025-01-11"), "fingerPrint" : 2},
+                   {"liquidityChange" : -300, "counterPartyAlias" : "ICA", "category" : "party", "date" : self.strToDateTime("2025-01-12"), "fingerPrint" : 3},
+                   {"liquidityChange" : -400, "counterPartyAlias" : "Systembolaget", "date" : self.strToDateTime("2025-01-13"), "fingerPrint" : 4},
+                   {"liquidityChange" : -500, "counterPartyAlias" : "COOP 1", "date" : self.strToDateTime("2025-02-14")},
+                   {"liquidityChange" : -600, "counterPartyAlias" : "other", "date" : self.strToDateTime("2025-02-15"), "fingerPrint" : 6}]
+        useColumnarStorage = [False] if numpy is None else [False, True]
+        self.addCleanup(Ledger.disableColumnarStorage)
+        for columnar in useColumnarStorage:
+            self.resetSingletons()
+            if columnar:
+                Ledger.enableColumnarStorage()
+            CounterPartyDataBase().addCounterParty(["ICA"], category = "groceries", prefixes = ["ICA "])
+            CounterPartyDataBase().addCounterParty(["Systembolaget"], tags = {"booze"})
+            Ledger().addTransactions(records)
+            other = Ledger().getTransactionByFingerPrint(6)
+            self.assertEqual(Ledger().getTotalLiquidityChange(requiredCategory = "groceries"), -300)
+            self.assertEqual(Ledger().getTotalLiquidityChange(requiredCounterParty = "ICA"), -600)
+
+            # a new category and tags for a counter party, and a modifier for another
+            CounterPartyDataBase().addCounterParty(["ICA"], tags = {"weekly"}, category = "food", prefixes = ["ICA "])
+            CounterPartyDataBase().addCounterParty(["Systembolaget"], tags = {"booze"}, transactionModifier = lambda transaction : transaction.setCapitalChange(-transaction.getLiquidityChange()))
+            CounterPartyDataBase().addCounterParty(["Systembolaget"], tags = {"booze"}, transactionModifier = lambda transaction : transaction.setCapitalChange(-2 * transaction.getLiquidityChange()))
+            # a rule for an alias that was added as a counter party of its own
+            CounterPartyDataBase().addCounterParty(["COOP"], category = "food", wildcards = ["COOP *"])
+
+            self.assertEqual(Ledger().getTotalLiquidityChange(requiredCategory = "groceries"), 0)
+            self.assertEqual(Ledger().getTotalLiquidityChange(requiredCategory = "food"), -800)
+            self.assertEqual(Ledger().getTotalLiquidityChange(requiredCategory = "party"), -300)
+            self.assertEqual(Ledger().getTotalLiquidityChange(requiredTags = ["weekly"]), -600)
+            self.assertEqual(Ledger().getTotalCapitalChange(requiredCounterParty = "Systembolaget"), 800)
+            self.assertEqual(Ledger().getTotalLiquidityChange(requiredCounterParty = "COOP"), -500)
+            self.assertEqual(Ledger().getTransactionByFingerPrint(1).getTags(), {"weekly"})
+            self.assertIs(Ledger().getTransactionByFingerPrint(6), other)
+
+            # the same as a ledger built from scratch with the changed counter parties
+            reclassified = {dimension : Ledger().aggregateBy(dimension) for dimension in DIMENSIONS}
+            indexSizes = [Ledger().categoryIndex.getSize(category) for category in ("food", "party", "uncategorized")]
+            Ledger().reset()
+            Ledger().addTransactions(records)
+            self.assertEqual({dimension : Ledger().aggregateBy(dimension) for dimension in DIMENSIONS}, reclassified)
+            self.assertEqual([Ledger().categoryIndex.getSize(category) for category in ("food", "party", "uncategorized")], indexSizes)
+
+    def testReclassifyTransactionsConstructedBeforeChange(self):
+        # the interleaving of another thread changing the counter parties between the
+        # construction and insertion of a batch
+        records = [{"liquidityChange" : -100, "counterPartyAlias" : "ICA NARA 1", "date" : self.strToDateTime("2025-01-24"), "fingerPrint" : 1}]
+        transactions = Transaction.fromRecords(records)
+        CounterPartyDataBase().addCounterParty(["ICA"], category = "food", prefixes = ["ICA "])
+        Ledger().insertTransactions(transactions)
+        Ledger().addTransactions([dict(records[0], fingerPrint = 2)])
+        self.assertEqual([transaction.getCategory() for transaction in Ledger().transactionSet], ["food", "food"])
+        self.assertEqual(Ledger().getTotalLiquidityChange(requiredCategory = "food"), -200)
+
+        # and of a single transaction
+        transaction = Transaction(-300, 0, "ICA MAXI 2", None, None, self.strToDateTime("2025-01-25"), 3)
+        CounterPartyDataBase().addCounterParty(["ICA MAXI"], category = "groceries", prefixes = ["ICA MAXI "])
+        Ledger().insertTransaction(transaction)
+        self.assertEqual(transaction.getCategory(), "groceries")
+        self.assertEqual(transaction.counterPartyAlias, "ICA MAXI")
+        self.assertEqual(Ledger().getTotalLiquidityChange(requiredCounterParty = "ICA MAXI"), -300)
+
+    def testReclassifyWhileReading(self):
+        Ledger().addTransaction(-100, counterPartyAlias = "alias", fingerPrint = 1)
+        with self.assertLogs(level = "WARNING"):
+            with Ledger().lock.reading():
+                CounterPartyDataBase().addCounterParty(["alias"], category = "booze")
+        self.assertEqual(Ledger().getTotalLiquidityChange(requiredCategory = "booze"), 0)
+        Ledger().addTransaction(-200, counterPartyAlias = "alias", fingerPrint = 2)
+        self.assertEqual(Ledger().getTotalLiquidityChange(requiredCategory = "booze"), -300)
+
+    def testFractionalAmountsAddUpExactly(self):
+        for fingerPrint in range(10):
+            Ledger().addTransaction(0.1, 0.01, "alias", ["tag 1"], "booze", self.strToDateTime("2025-01-24"), fingerPrint)
+        timeRange = TimeRange(self.strToDateTime("2025-01-01"), self.strToDateTime("2025-01-31"))
+        self.assertEqual(Ledger().getTotalLiquidityChange(), 1)
+        self.assertEqual(Ledger().getTotalLiquidityChange(timeRange = timeRange, forbiddenTags = ["tag 2"]), 1)
+        self.assertEqual(Ledger().getTotalNetChange(requiredCategory = "booze"), 1.1)
+        self.assertEqual(Ledger().aggregateBy(TAG)["tag 1"], Totals(1, 0.1))
+        self.assertEqual(Ledger().query().limit(10).sum(NET_CHANGE), 1.1)
+        self.assertEqual(Ledger().getRollingTotals(7, self.strToDateTime("2025-01-24")).getLiquidityChange(), 1)
+
+    @unittest.skipIf(numpy is None, "columnar storage requires numpy")
+    def testColumnarFractionalAmounts(self):
+        self.addCleanup(Ledger.disableColumnarStorage)
+        self.addCleanup(Ledger.setQueryCacheSize, Ledger.queryCacheSize)
+        Ledger.setQueryCacheSize(0)
+        Ledger().addTransaction(0.1, 0.2, "alias", ["tag 1"], "booze", self.strToDateTime("2025-01-24"), 1)
+        for fingerPrint in range(2, 12):
+            Ledger().addTransaction(0.07, 0.01, "alias2", ["tag 2"], "cake", self.strToDateTime("2025-01-25"), fingerPrint)
+        filterCombinations = [{"forbiddenTags" : ["tag 2"]}, {"forbiddenTags" : ["tag 1"]}, {"allowedTags" : ["tag 1", "tag 2"]}]
+        serialTotals = [Ledger().getTotalNetChange(**filters) for filters in filterCombinations]
+        self.assertEqual(serialTotals, [0.3, 0.8, 1.1])
+        Ledger.enableColumnarStorage()
+        self.assertEqual([Ledger().getTotalNetChange(**filters) for filters in filterCombinations], serialTotals)
+
+    @unittest.skipIf(numpy is None, "columnar storage requires numpy")
+    def testSwitchingColumnarStorageBypassesCache(self):
+        self.addCleanup(Ledger.disableColumnarStorage)
+        Ledger().addTransaction(-100, 0, "alias", ["tag 1"], "booze", self.strToDateTime("2025-01-24"), 1)
+        for switchMode in (lambda : None, Ledger.enableColumnarStorage, Ledger.disableColumnarStorage):
+            switchMode()
+            Ledger().getTotalNetChange(forbiddenTags = ["tag 2"])
+        self.assertEqual(Ledger().getQueryCacheStatistics()["hits"], 0)
+        self.assertEqual(Ledger().getQueryCacheStatistics()["misses"], 3)
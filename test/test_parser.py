@@ -1,5 +1,5 @@
 from test.test_spendlog import TestSpendlog
-from spendlog.parser import InternetbankenParser
+from spendlog.parser import InternetbankenParser, stableHash
 from spendlog.ledger import Ledger
 from spendlog.transaction import Transaction
 
@@ -9,24 +9,24 @@ class TestParser(TestSpendlog):
         parser = InternetbankenParser()
         parser.parseFromFilename("transactions_template.txt")
 
-        fingerprint1 = hash("Systembolaget\n\n" +
+        fingerprint1 = stableHash("Systembolaget\n\n" +
                      "2025-03-25\n\n" +
                      "2025-03-25\n\n" +
                      "-100,00\n\n" +
                      "24 900,00")
-        fingerprint2 = hash(
+        fingerprint2 = stableHash(
                      "ICA SUPERMARKET\n\n" +
                      "2025-03-24\n\n" +
                      "2025-03-24\n\n" +
                      "-300,00\n\n" +
                      "25 000,00")
-        fingerprint3 = hash(
+        fingerprint3 = stableHash(
                      "SALARY SYSTEM\n\n" +
                      "2025-03-25\n\n" +
                      "2025-03-24\n\n" +
                      "25 000,00\n\n" +
                      "25 300,00")
-        fingerprint4 = hash(
+        fingerprint4 = stableHash(
                      "Henkes Keba*\n\n" +
                      "2025-03-24\n\n" +
                      "2025-03-24\n\n" +
@@ -2,6 +2,7 @@ from test.test_spendlog import TestSpendlog
 from spendlog.parser import InternetbankenParser
 from counterPartyDatabaseTemplate import populateCounterPartyDatabase
 from spendlog.presenter import BasicPresenter
+from spendlog.counterParty import CounterPartyDataBase
 from unittest import mock
 from unittest.mock import patch
 
@@ -93,3 +94,16 @@ class TestPresenter(TestSpendlog):
              mock.call("  net change: 24900")]
         BasicPresenter(self.strToDateTime("2025-03-25"), self.strToDateTime("2025-03-25")).present(False, True)
         mock_print.assert_has_calls(calls)
+
+    @patch('builtins.print')
+    def testBasicPresenterTags(self, mock_print):
+        populateCounterPartyDatabase()
+        CounterPartyDataBase().addCounterParty(["Systembolaget"], tags = {"fun"}, category = "alcohol")
+        CounterPartyDataBase().addCounterParty(["ICA SUPERMARKET"], tags = {"fun", "food"}, category = "groceries")
+        InternetbankenParser().parseFromFilename("transactions_template.txt")
+        BasicPresenter(self.strToDateTime("2025-03-24"), self.strToDateTime("2025-03-25")).present(True)
+
+        mock_print.assert_any_call("  fun:")
+        mock_print.assert_any_call("    liquidity: -400")
+        mock_print.assert_any_call("  food:")
+        mock_print.assert_any_call("    liquidity: -300")
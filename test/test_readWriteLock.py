@@ -0,0 +1,45 @@
+import threading
+from test.test_spendlog import TestSpendlog
+from spendlog.readWriteLock import ReadWriteLock, LockUpgradeError, LockNotHeldError
+
+class TestReadWriteLock(TestSpendlog):
+
+    def testReentrancy(self):
+        lock = ReadWriteLock()
+        with lock.writing():
+            with lock.writing():
+                with lock.reading():
+                    pass
+        with lock.reading():
+            with lock.reading():
+                with self.assertRaises(LockUpgradeError):
+                    lock.acquireWrite()
+        with self.assertRaises(LockNotHeldError):
+            lock.releaseRead()
+        with self.assertRaises(LockNotHeldError):
+            lock.releaseWrite()
+
+    def testReadersShareAndWritersExclude(self):
+        lock = ReadWriteLock()
+        bothReading = threading.Barrier(2, timeout = 5)
+        def read():
+            with lock.reading():
+                bothReading.wait()
+        # both readers must hold the lock at the same time to get past the barrier
+        readers = [threading.Thread(target = read) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        self.assertFalse(bothReading.broken)
+
+        events = list()
+        lock.acquireRead()
+        writer = threading.Thread(target = lambda : (lock.acquireWrite(), events.append("write"), lock.releaseWrite()))
+        writer.start()
+        writer.join(0.1)
+        self.assertTrue(writer.is_alive())
+        events.append("read")
+        lock.releaseRead()
+        writer.join()
+        self.assertEqual(events, ["read", "write"])
@@ -0,0 +1,70 @@
+import random
+from test.test_spendlog import TestSpendlog
+from spendlog.rollup import FenwickTree, DailyRollup, RollingWindowError
+
+class TestRollup(TestSpendlog):
+
+    def testFenwickTree(self):
+        rng = random.Random(0)
+        values = [rng.randint(-100, 100) for _ in range(50)]
+        fenwickTree = FenwickTree.fromValues(values)
+        for _ in range(100):
+            slot = rng.randrange(len(values))
+            delta = rng.randint(-10, 10)
+            values[slot] += delta
+            fenwickTree.add(slot, delta)
+            first = rng.randrange(len(values))
+            last = rng.randrange(len(values))
+            self.assertEqual(fenwickTree.prefixSum(last), sum(values[:last + 1]))
+            self.assertEqual(fenwickTree.rangeSum(first, last), sum(values[first:last + 1]))
+
+    def testDailyRollup(self):
+        rollup = DailyRollup()
+        self.assertEqual(rollup.getTotals("key"), (0, 0))
+        self.assertEqual(rollup.getTotals("key", 10, 20), (0, 0))
+
+        rollup.add("key", 10, 1, 2)
+        rollup.add("key", 12, 10, 20)
+        rollup.add("other key", 12, 100, 200)
+        self.assertEqual(rollup.getTotals("key"), (11, 22))
+        self.assertEqual(rollup.getTotals("key", 10, 11), (1, 2))
+        self.assertEqual(rollup.getTotals("key", 11, 12), (10, 20))
+        self.assertEqual(rollup.getTotals("key", 0, 100), (11, 22))
+        self.assertEqual(rollup.getTotals("key", 12, 11), (0, 0))
+
+        # days added after the prefix sums have been built, within and outside of their span
+        rollup.add("key", 11, 1000, 2000)
+        self.assertEqual(rollup.getTotals("key", 11, 11), (1000, 2000))
+        rollup.add("key", 1000, 5, 5)
+        rollup.add("key", -1000, 7, 7)
+        self.assertEqual(rollup.getTotals("key", -1000, 10), (8, 9))
+        self.assertEqual(rollup.getTotals("key", 12, 5000), (15, 25))
+
+        rollup.remove("key", 12, 10, 20)
+        self.assertEqual(rollup.getTotals("key", 12, 12), (0, 0))
+        self.assertEqual(rollup.getTotals("key"), (1013, 2014))
+        self.assertEqual(rollup.getTotals("other key", 11, 13), (100, 200))
+
+    def testRollingTotals(self):
+        rng = random.Random(0)
+        rollup = DailyRollup()
+        days = {"key" : dict(), "other key" : dict()}
+        for _ in range(200):
+            key = rng.choice(list(days))
+            day = rng.randint(0, 100)
+            rollup.add(key, day, 1, 2)
+            days[key][day] = days[key].get(day, 0) + 1
+        for _ in range(20):
+            keys = rng.sample(list(days), rng.randint(1, 2))
+            windowDays = rng.randint(1, 40)
+            firstDay = rng.randint(-20, 120)
+            lastDay = firstDay + rng.randint(0, 50)
+            liquidityChanges, capitalChanges = rollup.getRollingTotals(keys, windowDays, firstDay, lastDay)
+            expected = [sum(days[key].get(day, 0) for key in keys for day in range(end - windowDays + 1, end + 1)) for end in range(firstDay, lastDay + 1)]
+            self.assertEqual(liquidityChanges, expected)
+            self.assertEqual(capitalChanges, [2 * total for total in expected])
+
+        self.assertEqual(rollup.getRollingTotals(["key"], 7, 10, 9), ([], []))
+        self.assertEqual(rollup.getRollingTotals(["missing key"], 7, 10, 11), ([0, 0], [0, 0]))
+        with self.assertRaises(RollingWindowError):
+            rollup.getRollingTotals(["key"], 0, 10, 20)
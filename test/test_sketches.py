@@ -0,0 +1,58 @@
+import random
+from bisect import bisect_left, bisect_right
+from test.test_spendlog import TestSpendlog
+from spendlog.sketches import KllSketch, HyperLogLog, SketchError
+
+class TestSketches(TestSpendlog):
+
+    def assertRankWithin(self, values, value, quantile, tolerance):
+        # any rank the value could have among (possibly equal) values
+        low = bisect_left(values, value) / len(values)
+        high = bisect_right(values, value) / len(values)
+        self.assertTrue(low - tolerance <= quantile <= high + tolerance, (value, quantile, low, high))
+
+    def testKllSketch(self):
+        rng = random.Random(0)
+        sketch = KllSketch()
+        otherSketch = KllSketch()
+        values = list()
+        for _ in range(20000):
+            value = rng.randint(-100000, 1000)
+            values.append(value)
+            sketch.add(value)
+        for _ in range(10000):
+            value = int(rng.gauss(0, 100))
+            values.append(value)
+            otherSketch.add(value)
+        sketch.merge(otherSketch)
+        values.sort()
+
+        self.assertEqual(sketch.n, len(values))
+        self.assertLess(sketch.size, 1000)
+        quantiles = [0, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 1]
+        for quantile, value in zip(quantiles, sketch.getQuantiles(quantiles)):
+            self.assertRankWithin(values, value, quantile, 0.02)
+        self.assertEqual(sketch.getQuantiles([0, 1]), [values[0], values[-1]])
+
+        self.assertEqual(KllSketch().getQuantiles([0.5]), [None])
+        with self.assertRaises(SketchError):
+            sketch.getQuantile(1.5)
+
+    def testHyperLogLog(self):
+        sketch = HyperLogLog()
+        otherSketch = HyperLogLog()
+        self.assertEqual(sketch.getCount(), 0)
+        for value in range(20):
+            sketch.add(f"counter party {value}")
+            sketch.add(f"counter party {value}")
+        self.assertEqual(sketch.getCount(), 20)
+
+        for value in range(50000):
+            sketch.add(f"counter party {value}")
+        for value in range(25000, 100000):
+            otherSketch.add(f"counter party {value}")
+        sketch.merge(otherSketch)
+        self.assertAlmostEqual(sketch.getCount(), 100000, delta = 100000 * 0.05)
+
+        with self.assertRaises(SketchError):
+            sketch.merge(HyperLogLog(precision = 10))
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from test.test_spendlog import TestSpendlog
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.ledger import Ledger, TimeRange
+from spendlog.snapshot import Snapshot, SnapshotError
+from decimal import Decimal
+
+class TestSnapshot(TestSpendlog):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "ledger.snapshot")
+
+    def loadSnapshot(self, materialize = True) -> Snapshot:
+        snapshot = Ledger.loadSnapshot(self.path, materialize = materialize)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def addTransactions(self):
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], tags = {"tag 1"}, category = "booze")
+        Ledger().addTransaction(-100, 0, "alias alias", None, None, self.strToDateTime("2025-01-24"), 1)
+        Ledger().addTransaction(-200, 5, "alias2", {"tag 2", "tag 3"}, "cake", self.strToDateTime("2025-01-26"), -2**63)
+        Ledger().addTransaction(-300, 0, "alias", set(), None, self.strToDateTime("2025-01-25"), 2**63 - 1)
+        Ledger().addTransaction(-400, 1, "alias3", {"tag 3", "tägg"}, None, self.strToDateTime("2025-02-25"), 4)
+
+    def testSaveAndLoad(self):
+        self.addTransactions()
+        expectedTransactions = Ledger().getTransactions()
+        Ledger.saveSnapshot(self.path)
+
+        self.resetSingletons()
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], tags = {"tag 1"}, category = "booze")
+        snapshot = self.loadSnapshot()
+        self.assertEqual(snapshot.size, 4)
+        self.assertEqual(Ledger().getTransactions(), expectedTransactions)
+
+    def testQueryBeforeMaterializing(self):
+        self.addTransactions()
+        Ledger.saveSnapshot(self.path)
+        filterCombinations = [dict(),
+                              {"timeRange" : TimeRange(self.strToDateTime("2025-01-25"), self.strToDateTime("2025-02-01"))},
+                              {"requiredCounterParty" : "alias"},
+                              {"forbiddenCounterParty" : "alias", "requiredTags" : ["tag 3"]},
+                              {"requiredTags" : ["tag 1", "unknown tag"]},
+                              {"allowedTags" : ["tag 1"], "allowedCategories" : ["booze", "cake"]},
+                              {"forbiddenTags" : ["tag 1"], "forbiddenCategory" : "cake"}]
+        expectedTotals = [(Ledger().getTotalLiquidityChange(**filters),
+                           Ledger().getTotalCapitalChange(**filters),
+                           Ledger().getTransactions(**filters)) for filters in filterCombinations]
+
+        self.resetSingletons()
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], tags = {"tag 1"}, category = "booze")
+        snapshot = self.loadSnapshot(materialize = False)
+        self.assertEqual(Ledger().getTransactions(), set())
+        for filters, (liquidityChange, capitalChange, transactions) in zip(filterCombinations, expectedTotals):
+            self.assertEqual(snapshot.getTotalLiquidityChange(**filters), liquidityChange, filters)
+            self.assertEqual(snapshot.getTotalCapitalChange(**filters), capitalChange, filters)
+            self.assertEqual(snapshot.getTransactions(**filters), transactions, filters)
+
+        Ledger.materializeSnapshot(snapshot)
+        self.assertEqual(Ledger().getTransactions(), expectedTotals[0][2])
+
+    def testMinorUnitAmountsAndOnlyIntegerFingerPrints(self):
+        Ledger().addTransaction(1.5, Decimal("-0.01"), "alias", set(), None, self.strToDateTime("2025-01-24"), 1)
+        Ledger.saveSnapshot(self.path)
+        snapshot = self.loadSnapshot(materialize = False)
+        self.assertEqual(snapshot.getTotalLiquidityChange(), 1.5)
+        self.assertEqual(snapshot.getTotalNetChange(), 1.49)
+        self.assertEqual(snapshot.getAllTransactions(), list(Ledger().getTransactions()))
+        self.resetSingletons()
+        Ledger().addTransaction(1, 0, "alias", set(), None, self.strToDateTime("2025-01-24"), "fingerprint")
+        with self.assertRaises(SnapshotError):
+            Ledger.saveSnapshot(self.path)
+
+    def testNotASnapshot(self):
+        with open(self.path, "wb") as fp:
+            fp.write(bytes(100))
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.path)
@@ -0,0 +1,105 @@
+import os
+import random
+import tempfile
+from test.test_spendlog import TestSpendlog
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.ledger import Ledger, TimeRange
+from spendlog.parser import InternetbankenParser
+from spendlog.sqliteStore import SqliteStore, SqliteStoreError
+
+class TestSqliteStore(TestSpendlog):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "ledger.sqlite")
+
+    def openStore(self):
+        store = SqliteStore(self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def testTransactionsPersistAcrossRuns(self):
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], tags = {"tag 1"}, category = "booze")
+        Ledger().addTransaction(-100, 0, "alias alias", None, None, self.strToDateTime("2025-01-24"), 1)
+        Ledger().attachStore(self.openStore())
+        Ledger().addTransaction(-200, 5, "alias2", {"tag 2", "tag 3"}, "cake", self.strToDateTime("2025-01-25"), 2)
+        Ledger().addTransaction(-300, 0, "alias3", set(), None, self.strToDateTime("2025-01-26"), 3)
+        # replacing a transaction replaces it in the store too
+        Ledger().addTransaction(-301, 0, "alias3", set(), None, self.strToDateTime("2025-01-26"), 3)
+        expectedTransactions = Ledger().getTransactions()
+
+        # next run: the counter parties and transactions are all loaded from the store,
+        # and ingesting the same transactions again adds nothing
+        self.resetSingletons()
+        store = self.openStore()
+        Ledger().attachStore(store)
+        self.assertEqual(Ledger().getTransactions(), expectedTransactions)
+        self.assertEqual(CounterPartyDataBase().getCounterParty("alias alias").name, "alias")
+        self.assertEqual(CounterPartyDataBase().getCounterParty("alias alias").tags, {"tag 1"})
+        self.assertEqual(CounterPartyDataBase().getCounterParty("alias").category, "booze")
+        Ledger().addTransaction(-200, 5, "alias2", {"tag 2", "tag 3"}, "cake", self.strToDateTime("2025-01-25"), 2)
+        self.assertEqual(store.getSize(), 3)
+        self.assertEqual(store.getTotalLiquidityChange(), -601)
+
+    def testParsingTwiceOnlyAddsNewTransactions(self):
+        InternetbankenParser().parseFromFilename("transactions_template.txt")
+        Ledger().attachStore(self.openStore())
+        expectedTransactions = Ledger().getTransactions()
+
+        self.resetSingletons()
+        Ledger().attachStore(self.openStore())
+        InternetbankenParser().parseFromFilename("transactions_template.txt")
+        self.assertEqual(Ledger().getTransactions(), expectedTransactions)
+        self.assertEqual(self.openStore().getSize(), len(expectedTransactions))
+
+    def testQueriesMatchLedger(self):
+        rng = random.Random(0)
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], category = "booze")
+        store = self.openStore()
+        Ledger().attachStore(store)
+        for fingerPrint in range(300):
+            Ledger().addTransaction(liquidityChange = rng.randint(-1000, 1000),
+                                    capitalChange = rng.randint(-10, 10),
+                                    counterPartyAlias = rng.choice(["alias", "alias alias", "alias2", "alias3"]),
+                                    tags = set(rng.sample(["tag 1", "tag 2", "tag 3", "tag 4"], rng.randint(0, 3))),
+                                    category = rng.choice([None, "booze", "weed", "cake"]),
+                                    date = self.strToDateTime(f"2025-0{rng.randint(1, 3)}-{rng.randint(10, 28)}"),
+                                    fingerPrint = fingerPrint)
+        for _ in range(200):
+            filters = {
+                "timeRange"             : TimeRange(self.strToDateTime("2025-01-20"), self.strToDateTime(f"2025-0{rng.randint(1, 3)}-15")),
+                "requiredCategory"      : rng.choice(["booze", "weed", "uncategorized"]),
+                "forbiddenCategory"     : rng.choice(["booze", "cake"]),
+                "allowedCategories"     : rng.sample(["booze", "weed", "cake", "uncategorized"], 2),
+                "requiredTags"          : rng.sample(["tag 1", "tag 2", "tag 3"], rng.randint(0, 2)),
+                "forbiddenTags"         : rng.sample(["tag 1", "tag 2", "tag 3"], 1),
+                "allowedTags"           : rng.sample(["tag 1", "tag 2", "tag 3", "tag 4"], 3),
+                "requiredCounterParty"  : rng.choice(["alias", "alias alias", "alias2"]),
+                "forbiddenCounterParty" : rng.choice(["alias", "alias3"]),
+                "allowedCounterParties" : rng.sample(["alias", "alias2", "alias3"], 2)}
+            filters = {name : value for name, value in filters.items() if rng.random() < 0.3}
+            self.assertEqual(store.getTransactions(**filters), Ledger().getTransactions(**filters), filters)
+            self.assertEqual(store.getTotalNetChange(**filters), Ledger().getTotalNetChange(**filters), filters)
+
+    def testTupleFingerPrints(self):
+        Ledger().attachStore(self.openStore())
+        Ledger().addTransaction(-100, 0, "alias", set(), None, self.strToDateTime("2025-01-24"), (0, 1, "alias", -1))
+        Ledger().addTransaction(-200, 0, "alias", set(), None, self.strToDateTime("2025-01-25"), ("a", 2 ** 70))
+        expectedTransactions = Ledger().getTransactions()
+
+        self.resetSingletons()
+        store = self.openStore()
+        Ledger().attachStore(store)
+        self.assertEqual(Ledger().getTransactions(), expectedTransactions)
+        self.assertEqual({transaction.fingerPrint for transaction in Ledger().getTransactions()}, {(0, 1, "alias", -1), ("a", 2 ** 70)})
+        Ledger().addTransaction(-100, 0, "alias", set(), None, self.strToDateTime("2025-01-24"), (0, 1, "alias", -1))
+        self.assertEqual(store.getSize(), 2)
+
+    def testUnstorableFingerPrint(self):
+        store = self.openStore()
+        Ledger().attachStore(store)
+        with self.assertRaises(SqliteStoreError):
+            Ledger().addTransaction(-100, 0, "alias", set(), None, self.strToDateTime("2025-01-24"), object())
+        self.assertEqual(store.getSize(), 0)
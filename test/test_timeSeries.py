@@ -0,0 +1,40 @@
+import datetime
+from test.test_spendlog import TestSpendlog
+from spendlog.timeSeries import TimeSeries, UnknownFrequencyError, getPeriodStart, getPeriods, DAY, WEEK, MONTH, YEAR
+
+class TestTimeSeries(TestSpendlog):
+
+    def testPeriods(self):
+        date = datetime.datetime(2024, 12, 31, 13, 37)
+        self.assertEqual(getPeriodStart(date, DAY), datetime.datetime(2024, 12, 31))
+        # 2024-12-31 is a Tuesday
+        self.assertEqual(getPeriodStart(date, WEEK), datetime.datetime(2024, 12, 30))
+        self.assertEqual(getPeriodStart(date, MONTH), datetime.datetime(2024, 12, 1))
+        self.assertEqual(getPeriodStart(date, YEAR), datetime.datetime(2024, 1, 1))
+
+        end = datetime.datetime(2025, 2, 1)
+        self.assertEqual(getPeriods(date, end, MONTH), [datetime.datetime(2024, 12, 1), datetime.datetime(2025, 1, 1), datetime.datetime(2025, 2, 1)])
+        self.assertEqual(getPeriods(date, end, YEAR), [datetime.datetime(2024, 1, 1), datetime.datetime(2025, 1, 1)])
+        self.assertEqual(len(getPeriods(date, end, DAY)), 33)
+        self.assertEqual(len(getPeriods(date, end, WEEK)), 5)
+        self.assertEqual(getPeriods(end, date, DAY), list())
+
+        with self.assertRaises(UnknownFrequencyError):
+            getPeriodStart(date, "fortnight")
+
+    def testTimeSeries(self):
+        timeSeries = TimeSeries(DAY, getPeriods(datetime.datetime(2025, 1, 1), datetime.datetime(2025, 1, 3), DAY), "category")
+        self.assertEqual(timeSeries.getKeys(), list())
+        timeSeries.add("booze", 1, -10, 1)
+        timeSeries.addSeries("booze", [1, 2, 3], [0, 0, 1])
+        self.assertEqual(timeSeries.getLiquidityChanges("booze"), [1, -8, 3])
+        self.assertEqual(timeSeries.getCapitalChanges("booze"), [0, 1, 1])
+        self.assertEqual(timeSeries.getNetChanges("booze"), [1, -7, 4])
+        self.assertEqual(timeSeries.getLiquidityChanges("cake"), [0, 0, 0])
+
+        copy = timeSeries.copy()
+        self.assertEqual(copy, timeSeries)
+        copy.add("booze", 0, 1, 1)
+        self.assertNotEqual(copy, timeSeries)
+
+        self.assertEqual(TimeSeries(DAY, list()).getKeys(), [None])
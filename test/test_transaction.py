@@ -0,0 +1,146 @@
+from test.test_spendlog import TestSpendlog
+from decimal import Decimal
+import datetime
+import threading
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.transaction import Transaction, AmountPrecisionError, toMinorUnits, fromMinorUnits, internedDates
+
+class TestTransaction(TestSpendlog):
+
+    def testMinorUnits(self):
+        self.assertEqual(toMinorUnits(-100), -10000)
+        self.assertEqual(toMinorUnits(0.1 + 0.2), 30)
+        self.assertEqual(toMinorUnits(Decimal("24900.55")), 2490055)
+        with self.assertRaises(AmountPrecisionError):
+            toMinorUnits(Decimal("0.001"))
+        self.assertEqual(fromMinorUnits(-10000), -100)
+        self.assertEqual(type(fromMinorUnits(-10000)), int)
+        # fractional amounts read as floats, same as before they were kept in minor units
+        self.assertEqual(fromMinorUnits(2490055), 24900.55)
+        self.assertEqual(type(fromMinorUnits(2490055)), float)
+        self.assertEqual(toMinorUnits(fromMinorUnits(2490055)), 2490055)
+
+        transaction = Transaction(Decimal("-99.90"), 0, "alias", None, None, self.strToDateTime("2025-01-24"), 1)
+        self.assertEqual(transaction.getLiquidityChangeMinor(), -9990)
+        self.assertEqual(transaction.getNetChange(), -99.9)
+        transaction.setCapitalChange(0.1)
+        self.assertEqual(transaction.getCapitalChangeMinor(), 10)
+        self.assertEqual(transaction.getNetChange(), -99.8)
+
+    def testFromRecordsDoesNotLockModifiers(self):
+        # another thread can resolve counter parties while the modifiers of a batch run
+        resolvedByOtherThread = list()
+        def modifier(transaction):
+            thread = threading.Thread(target = lambda : resolvedByOtherThread.append(CounterPartyDataBase().getCounterParty("other alias").name))
+            thread.start()
+            thread.join(timeout = 10)
+        CounterPartyDataBase().addCounterParty(["alias"], transactionModifier = modifier)
+        Transaction.fromRecords([{"liquidityChange" : -100, "counterPartyAlias" : "alias", "fingerPrint" : fingerPrint} for fingerPrint in range(3)])
+        self.assertEqual(resolvedByOtherThread, ["other alias"] * 3)
+
+    def testModifierFloatArithmetic(self):
+        def halve(transaction):
+            transaction.setLiquidityChange(transaction.getLiquidityChange() * 0.5)
+        CounterPartyDataBase().addCounterParty(["alias"], transactionModifier = halve)
+        self.assertEqual(Transaction(Decimal("-99.90"), 0, "alias", None, None, self.strToDateTime("2025-01-24"), 1).getLiquidityChange(), -49.95)
+        self.assertEqual(Transaction(-99, 0, "alias", None, None, self.strToDateTime("2025-01-24"), 2).getLiquidityChangeMinor(), -4950)
+
+    def testCompactAndInterned(self):
+        transaction1 = Transaction(-100, 0, "alias", {"tag 1", "tag 2"}, "booze", self.strToDateTime("2025-01-24"), 1)
+        transaction2 = Transaction(-200, 0, "".join(["ali", "as"]), ["tag 2", "tag 1"], "".join(["boo", "ze"]), self.strToDateTime("2025-01-24"), 2)
+        self.assertFalse(hasattr(transaction1, "__dict__"))
+        self.assertIs(transaction1.getDate(), transaction2.getDate())
+        self.assertIs(transaction1.getTags(), transaction2.getTags())
+        self.assertIs(transaction1.getCategory(), transaction2.getCategory())
+        self.assertIs(transaction1.counterPartyAlias, transaction2.counterPartyAlias)
+
+        transaction2.setTags({"tag 3"})
+        self.assertEqual(transaction1.getTags(), {"tag 1", "tag 2"})
+        self.assertEqual(transaction2.getTags(), {"tag 3"})
+
+        # timestamps aren't interned, so they don't pile up in the table
+        nInternedDates = len(internedDates)
+        for fingerPrint in range(3, 10):
+            Transaction(-100, 0, "alias", None, None, None, fingerPrint)
+            Transaction(-100, 0, "alias", None, None, datetime.datetime(2025, 1, 24, 12, fingerPrint), fingerPrint)
+        self.assertEqual(len(internedDates), nInternedDates)
+
+    def testFromRecords(self):
+        def modifier(transaction):
+            transaction.setCapitalChange(-transaction.getLiquidityChange())
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], tags = {"tag 1"}, category = "booze", transactionModifier = modifier)
+        records = [{"liquidityChange" : -100, "counterPartyAlias" : "alias alias", "date" : self.strToDateTime("2025-01-24"), "fingerPrint" : 1},
+                   {"liquidityChange" : Decimal("-2.50"), "counterPartyAlias" : "alias", "tags" : {"tag 2"}, "category" : "food", "date" : self.strToDateTime("2025-01-25")},
+                   {"liquidityChange" : 300, "counterPartyAlias" : "new alias", "date" : self.strToDateTime("2025-01-26")}]
+        with self.assertLogs(level = "WARNING") as logs:
+            transactions = Transaction.fromRecords(records)
+        self.assertEqual(len([record for record in logs.records if "fingerprint" in record.getMessage()]), 1)
+        self.assertIn("2 of 3", logs.output[-1])
+
+        for transaction, record in zip(transactions, records):
+            expected = Transaction(**record)
+            self.assertEqual((transaction.getLiquidityChangeMinor(), transaction.getCapitalChangeMinor(), transaction.counterPartyAlias, transaction.tags, transaction.category, transaction.date, transaction.fingerPrint),
+                             (expected.getLiquidityChangeMinor(), expected.getCapitalChangeMinor(), expected.counterPartyAlias, expected.tags, expected.category, expected.date, expected.fingerPrint))
+        self.assertEqual(transactions[0].counterPartyAlias, "alias")
+        self.assertEqual(transactions[0].getTags(), {"tag 1"})
+        self.assertEqual(transactions[0].getCapitalChange(), 100)
+        self.assertEqual(transactions[1].getCategory(), "food")
+        self.assertEqual(transactions[2].getCategory(), "uncategorized")
+        self.assertIs(transactions[2].getCounterParty(), CounterPartyDataBase().getCounterParty("new alias"))
+
+        with self.assertRaises(TypeError):
+            Transaction.fromRecords([{"amount" : 1}])
+
+    def testCachedHash(self):
+        date = self.strToDateTime("2025-01-24")
+        transaction1 = Transaction(-100, 0, "alias", ["tag 1", "tag 2", "tag 3"], "booze", date)
+        transaction2 = Transaction(-100, 0, "alias", ["tag 3", "tag 1", "tag 2"], "booze", date)
+        self.assertEqual(hash(transaction1), hash(transaction2))
+
+        oldHash = hash(transaction1)
+        transaction1.setTags({"tag 4"})
+        self.assertNotEqual(hash(transaction1), oldHash)
+        transaction1.setTags(["tag 2", "tag 1", "tag 3"])
+        self.assertEqual(hash(transaction1), oldHash)
+        transaction1.setCategory("food")
+        self.assertNotEqual(hash(transaction1), oldHash)
+        transaction1.setCategory("booze")
+        transaction1.setLiquidityChange(-200)
+        self.assertNotEqual(hash(transaction1), oldHash)
+        transaction1.setLiquidityChange(-100)
+        transaction1.setDate(self.strToDateTime("2025-01-25"))
+        self.assertNotEqual(hash(transaction1), oldHash)
+        transaction1.setDate(date)
+        self.assertEqual(hash(transaction1), oldHash)
+
+        transaction1.fingerPrint = 1
+        self.assertEqual(hash(transaction1), hash(1))
+
+    def testRederive(self):
+        def modifier(transaction):
+            transaction.setCapitalChange(-transaction.getLiquidityChange())
+        CounterPartyDataBase().addCounterParty(["alias"], tags = {"tag 1"}, category = "booze")
+        date = self.strToDateTime("2025-01-24")
+        transaction = Transaction(-100, 0, "alias", None, None, date, 1)
+        explicit = Transaction(-100, 0, "alias", {"tag 2"}, "food", date, 2)
+        self.assertEqual(transaction.getSourceAlias(), "alias")
+        self.assertIsNone(Transaction.fromFields(-10000, 0, "alias", set(), "booze", date, 3).getSourceAlias())
+
+        CounterPartyDataBase().addCounterParty(["alias"], tags = {"tag 3"}, category = "food", transactionModifier = modifier)
+        self.assertTrue(transaction.rederive())
+        self.assertTrue(explicit.rederive())
+        self.assertEqual((transaction.getTags(), transaction.getCategory(), transaction.getCapitalChange()), ({"tag 3"}, "food", 100))
+        self.assertEqual((explicit.getTags(), explicit.getCategory(), explicit.getCapitalChange()), ({"tag 2"}, "food", 100))
+        # the modifier is applied to the amounts from before it was applied
+        self.assertTrue(transaction.rederive())
+        self.assertEqual(transaction.getCapitalChange(), 100)
+
+        # changes through the setters are lost, but amounts and dates are kept as given
+        CounterPartyDataBase().addCounterParty(["alias"], tags = {"tag 1"}, category = "booze")
+        transaction.rederive()
+        transaction.setLiquidityChange(-300)
+        transaction.setDate(self.strToDateTime("2025-01-25"))
+        transaction.setCategory("food")
+        transaction.rederive()
+        self.assertEqual((transaction.getLiquidityChange(), transaction.getCapitalChange(), transaction.getDate(), transaction.getCategory()), (-100, 0, date, "booze"))
+        self.assertEqual(transaction, Transaction(-100, 0, "alias", None, None, date, 1))
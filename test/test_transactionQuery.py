@@ -0,0 +1,106 @@
+import random
+import threading
+from test.test_spendlog import TestSpendlog
+from spendlog.ledger import Ledger, TimeRange
+from spendlog.counterParty import CounterPartyDataBase
+from spendlog.transactionQuery import UnknownOrderKeyError, UnknownAmountError, InvalidLimitError, CAPITAL_CHANGE, NET_CHANGE
+
+class TestTransactionQuery(TestSpendlog):
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(0)
+        CounterPartyDataBase().addCounterParty(["alias", "alias alias"], category = "booze")
+        for fingerPrint in range(200):
+            Ledger().addTransaction(liquidityChange = rng.randint(-1000, 1000),
+                                    capitalChange = rng.randint(-10, 10),
+                                    counterPartyAlias = rng.choice(["alias", "alias alias", "alias2"]),
+                                    tags = rng.sample(["tag 1", "tag 2", "tag 3"], rng.randint(0, 2)),
+                                    category = rng.choice([None, "booze", "cake"]),
+                                    date = self.strToDateTime(f"2025-0{rng.randint(1, 3)}-{rng.randint(10, 28)}"),
+                                    fingerPrint = fingerPrint)
+        self.filterCombinations = [dict(),
+                                   {"timeRange" : TimeRange(self.strToDateTime("2025-01-20"), self.strToDateTime("2025-02-15"))},
+                                   {"requiredCategory" : "booze", "forbiddenTags" : ["tag 1"]},
+                                   {"requiredCounterParty" : "alias", "timeRange" : TimeRange(self.strToDateTime("2025-02-01"), self.strToDateTime("2025-03-31"))},
+                                   {"forbiddenCategory" : "cake", "allowedTags" : ["tag 2"]}]
+
+    def testMatchesGetTransactions(self):
+        for filters in self.filterCombinations:
+            transactions = Ledger().getTransactions(**filters)
+            query = Ledger().query(**filters)
+            self.assertEqual(set(query), transactions, filters)
+            self.assertEqual(query.count(), len(transactions), filters)
+            self.assertEqual(query.sum(), sum(transaction.getLiquidityChange() for transaction in transactions), filters)
+            self.assertEqual(query.sum(CAPITAL_CHANGE), Ledger().getTotalCapitalChange(**filters), filters)
+            self.assertEqual(query.limit(7).count(), min(7, len(transactions)), filters)
+        # positional filters, same as for getTransactions
+        timeRange = self.filterCombinations[1]["timeRange"]
+        self.assertEqual(set(Ledger().query(timeRange)), Ledger().getTransactions(timeRange))
+
+    def testOrderByAndLimit(self):
+        for filters in self.filterCombinations:
+            transactions = list(Ledger().getTransactions(**filters))
+            for keys in [("date",), ("date", "liquidityChange"), ("liquidityChange", "date"), ("category", lambda transaction : transaction.fingerPrint), ("date", lambda transaction : transaction.fingerPrint)]:
+                getters = [key if callable(key) else (lambda transaction, key = key : getattr(transaction, key)) for key in keys]
+                sortKey = lambda transaction : tuple(getter(transaction) for getter in getters)
+                for descending in (False, True):
+                    expected = sorted(transactions, key = sortKey, reverse = descending)
+                    query = Ledger().query(**filters).orderBy(*keys, descending = descending)
+                    # only compare the keys; transactions that tie may come in any order
+                    self.assertEqual([sortKey(transaction) for transaction in query.materialize()],
+                                     [sortKey(transaction) for transaction in expected], (filters, keys))
+                    self.assertEqual([sortKey(transaction) for transaction in query.limit(10).limit(20)],
+                                     [sortKey(transaction) for transaction in expected[:10]], (filters, keys))
+                    if callable(keys[-1]):
+                        # ties are broken by fingerprint, so the first few are always the same
+                        self.assertEqual(query.limit(5).sum(NET_CHANGE), sum(transaction.getNetChange() for transaction in expected[:5]))
+
+        with self.assertRaises(UnknownOrderKeyError):
+            Ledger().query().orderBy("amount")
+        with self.assertRaises(UnknownAmountError):
+            Ledger().query().sum("amount")
+
+    def testLazy(self):
+        query = Ledger().query(requiredCategory = "booze")
+        Ledger().addTransaction(1, 0, "alias", [], "booze", self.strToDateTime("2025-04-01"), 1000)
+        self.assertIn(1000, {transaction.fingerPrint for transaction in query})
+
+        # the ledger isn't locked while a query is being iterated, so it can be changed
+        # from the same thread, without adding to what the iteration yields
+        transactions = iter(query)
+        first = next(transactions)
+        Ledger().addTransaction(1, 0, "alias", [], "booze", self.strToDateTime("2025-04-01"), 1001)
+        self.assertEqual(len([first] + list(transactions)), Ledger().query(requiredCategory = "booze").count() - 1)
+        self.assertIn(1001, {transaction.fingerPrint for transaction in query})
+
+        # nor is it while an iteration is paused, so counter party changes take effect
+        # right away, even on the transactions the iteration has yet to filter
+        self.assertGreater(Ledger().query(requiredCounterParty = "alias2", forbiddenCategory = "food").count(), 1)
+        transactions = iter(Ledger().query(requiredCounterParty = "alias2", forbiddenCategory = "food"))
+        next(transactions)
+        CounterPartyDataBase().addCounterParty(["alias2"], category = "food")
+        self.assertNotIn("food", {transaction.getCategory() for transaction in transactions})
+        self.assertEqual(Ledger().pendingAliases, set())
+        self.assertEqual(Ledger().query(requiredCounterParty = "alias2", requiredCategory = "uncategorized").count(), 0)
+        self.assertGreater(Ledger().query(requiredCounterParty = "alias2", requiredCategory = "food").count(), 0)
+
+        # a paused iteration on another thread doesn't block writers either
+        transactions = iter(query)
+        next(transactions)
+        thread = threading.Thread(target = Ledger().addTransaction, args = (1, 0, "alias", [], "booze", self.strToDateTime("2025-04-01"), 1002))
+        thread.start()
+        thread.join(timeout = 10)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNotNone(Ledger().getTransactionByFingerPrint(1002))
+
+    def testLimit(self):
+        with self.assertRaises(InvalidLimitError):
+            Ledger().query().limit(-1)
+        query = Ledger().query().orderBy("liquidityChange").limit(0)
+        self.assertEqual(query.materialize(), list())
+        self.assertEqual(query.count(), 0)
+        self.assertEqual(query.sum(), 0)
+        self.assertEqual(Ledger().query().limit(3).limit(0).materialize(), list())
+        self.assertEqual(Ledger().topTransactions(0), list())
+        self.assertEqual(Ledger().topTransactions(-1), list())